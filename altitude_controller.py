@@ -0,0 +1,44 @@
+"""
+Description:
+    The roboBee's altitude controller on plain floats, shared by roboBee's own time
+    step (see roboBee._altitude_controller()) and closed_loop.simulate_lqr(), so the
+    two always fly the same altitude loop.
+"""
+
+
+# change to z_dot [m/s] per time step while the robot is already moving toward its
+# desired altitude fast enough
+Z_DOT_ADJUSTMENT = 0.02
+# limits of the lift coefficient
+LIFT_MIN = 0.5
+LIFT_MAX = 1.5
+
+def altitude_control(z, z_dot, z_desired, lift_coefficient):
+    """
+    Adjusts the lift force based on where the robot is to its desired altitude. If the
+    robot is already moving toward it fast enough, z_dot is nudged toward zero instead
+    and the lift is left as it was.
+
+    ==== ARGUMENTS ====
+    z                = altitude [m]
+    z_dot            = vertical velocity [m/s]
+    z_desired        = desired altitude [m]
+    lift_coefficient = lift coefficient from the last time step
+
+    ==== RETURNS ====
+    z_dot            = vertical velocity after the controller's adjustment
+    lift_coefficient = new lift coefficient, between LIFT_MIN and LIFT_MAX
+    """
+    if (z_dot > 0 and z_dot > (z_desired - z)):
+        z_dot -= Z_DOT_ADJUSTMENT
+    elif (z_dot < 0 and z_dot < (z_desired - z)):
+        z_dot += Z_DOT_ADJUSTMENT
+    else:
+        lift_coefficient = 1 + (z_desired - z)
+
+    if (lift_coefficient > LIFT_MAX):
+        lift_coefficient = LIFT_MAX
+    elif (lift_coefficient < LIFT_MIN):
+        lift_coefficient = LIFT_MIN
+
+    return z_dot, lift_coefficient
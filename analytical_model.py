@@ -0,0 +1,296 @@
+"""
+Description:
+    Nonlinear 6-DOF (12 state) model of the roboBee, brought over from
+    archive/roboBee_class_with_analytical_controller.py.
+
+    The model calculates translational and angular accelerations from the robot's
+    current state (drag, lift, gravity and a torque controller that opposes angular
+    velocity), integrates them over a time step, and rotates the robot's orientation,
+    inertial frame and sensor normals by the resulting rotation. Unlike the archived
+    version, the inertial frame, sensor orientations and lift live on each model
+    instance instead of being shared class attributes.
+
+    The archived version built three axis-angle rotation matrices per step (one per
+    inertial frame axis), multiplied them, and rotated the frame and each sensor vector
+    one at a time, so rounding errors slowly pulled the frame away from orthonormal.
+    Here the attitude is a unit quaternion (see quaternions.py) that is advanced with the
+    exponential map of the angular velocity and renormalized every few steps, and the
+    frame and sensor vectors are recomputed from it in a single matrix product.
+
+    At 3-vector sizes most of a step's time goes into the overhead of the many small
+    NumPy calls (np.cross, np.dot, three rotation matrices...). If Numba is installed,
+    the whole step is instead done by a JIT-compiled kernel written in scalar code,
+    which matches the NumPy reference (AnalyticalModel.step_numpy()) to within
+    floating point rounding.
+"""
+
+
+import math
+import numpy as np
+
+import quaternions
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# vectors normal to each sensor face at initial orientation (x,y,z)
+INITIAL_SENSOR_ORIENTATIONS = np.array([ [np.sqrt(0.75),   0.5,  0.0],
+                                         [0.0,             0.5,  np.sqrt(0.75)],
+                                         [-np.sqrt(0.75),  0.5,  0.0],
+                                         [0.0,             0.5,  -np.sqrt(0.75)]])
+INITIAL_SENSOR_ORIENTATIONS.setflags(write=False)
+
+# inertial frame axes followed by the sensor normals, in body coordinates. Rotating
+# these by the attitude gives all of them in global coordinates at once
+BODY_VECTORS = np.vstack([np.identity(3), INITIAL_SENSOR_ORIENTATIONS])
+BODY_VECTORS.setflags(write=False)
+
+
+def _step_kernel(u, attitude, vectors, body_vectors, renormalize, lift, Rw, B_w, MASS, g, Jz,
+                 torque_constant, dt):
+    """
+    One step of the model in scalar code (see AnalyticalModel.step_numpy() for the
+    same math written with NumPy). Updates u, attitude and vectors (inertial frame
+    axes, then sensor normals) in place. Compiled with Numba when it is available.
+    """
+    vx, vy, vz = u[3], u[4], u[5]
+    wx, wy, wz = u[9], u[10], u[11]
+
+    # drag_force = -B_w*(v + w x R_w), with R_w = [0, Rw, 0]
+    fx = -B_w*(vx - wz*Rw)
+    fy = -B_w*vy
+    fz = -B_w*(vz + wx*Rw)
+
+    # drag_torque = -R_w x drag_force, and R_w x drag_force = -drag_torque
+    tx = -Rw*fz
+    ty = 0.0
+    tz = Rw*fx
+
+    # gravity in the inertial frame
+    gx = -g*vectors[0,1]
+    gy = -g*vectors[1,1]
+    gz = -g*vectors[2,1]
+
+    # translational acceleration (in inertial frame)
+    ax = fx / MASS + gx - (wy*vz - wz*vy)
+    ay = (fy + lift) / MASS + gy - (wz*vx - wx*vz)
+    az = fz / MASS + gz - (wx*vy - wy*vx)
+
+    # rotational acceleration, the w x (Jz*w) term is always zero
+    alpha_x = (-torque_constant*wx - tx - tx) / Jz
+    alpha_y = (-torque_constant*wy - ty - ty) / Jz
+    alpha_z = (-torque_constant*wz - tz - tz) / Jz
+
+    vx += dt*ax
+    vy += dt*ay
+    vz += dt*az
+    wx += dt*alpha_x
+    wy += dt*alpha_y
+    wz += dt*alpha_z
+
+    u[3], u[4], u[5] = vx, vy, vz
+    u[9], u[10], u[11] = wx, wy, wz
+
+    # position (see step_numpy() for why the velocity is used directly)
+    u[0] += dt*vx
+    u[1] += dt*vy
+    u[2] += dt*vz
+
+    # orientation in body coordinates, so it can be rotated along with the frame
+    ox = vectors[0,0]*u[6] + vectors[0,1]*u[7] + vectors[0,2]*u[8]
+    oy = vectors[1,0]*u[6] + vectors[1,1]*u[7] + vectors[1,2]*u[8]
+    oz = vectors[2,0]*u[6] + vectors[2,1]*u[7] + vectors[2,2]*u[8]
+
+    # attitude = attitude * exp(dt*w)
+    rx, ry, rz = dt*wx, dt*wy, dt*wz
+    half_angle = 0.5*math.sqrt(rx*rx + ry*ry + rz*rz)
+    if half_angle < 1e-4:
+        scale = 0.5 - half_angle*half_angle / 12.0
+    else:
+        scale = math.sin(half_angle) / (2.0*half_angle)
+    dw, dx, dy, dz = math.cos(half_angle), scale*rx, scale*ry, scale*rz
+
+    qw, qx, qy, qz = attitude[0], attitude[1], attitude[2], attitude[3]
+    qw, qx, qy, qz = (qw*dw - qx*dx - qy*dy - qz*dz,
+                      qw*dx + qx*dw + qy*dz - qz*dy,
+                      qw*dy - qx*dz + qy*dw + qz*dx,
+                      qw*dz + qx*dy - qy*dx + qz*dw)
+    if renormalize:
+        norm = math.sqrt(qw*qw + qx*qx + qy*qy + qz*qz)
+        qw, qx, qy, qz = qw / norm, qx / norm, qy / norm, qz / norm
+    attitude[0], attitude[1], attitude[2], attitude[3] = qw, qx, qy, qz
+
+    # rotation matrix of the new attitude, then rotate every body vector with it
+    r00 = 1 - 2*(qy*qy + qz*qz)
+    r01 = 2*(qx*qy - qw*qz)
+    r02 = 2*(qx*qz + qw*qy)
+    r10 = 2*(qx*qy + qw*qz)
+    r11 = 1 - 2*(qx*qx + qz*qz)
+    r12 = 2*(qy*qz - qw*qx)
+    r20 = 2*(qx*qz - qw*qy)
+    r21 = 2*(qy*qz + qw*qx)
+    r22 = 1 - 2*(qx*qx + qy*qy)
+
+    for row in range(body_vectors.shape[0]):
+        x, y, z = body_vectors[row,0], body_vectors[row,1], body_vectors[row,2]
+        vectors[row,0] = r00*x + r01*y + r02*z
+        vectors[row,1] = r10*x + r11*y + r12*z
+        vectors[row,2] = r20*x + r21*y + r22*z
+
+    for i in range(3):
+        u[6 + i] = ox*vectors[0,i] + oy*vectors[1,i] + oz*vectors[2,i]
+
+
+if njit is not None:
+    _step_kernel = njit(cache=True)(_step_kernel)
+
+
+class AnalyticalModel(object):
+
+    TORQUE_CONTROLLER_CONSTANT = 1.1e-7
+    # the attitude quaternion is renormalized every this many steps
+    RENORMALIZE_EVERY = 64
+
+    def __init__(self, bee, desired_height = 10, use_jit = None):
+        """
+        ==== ARGUMENTS ====
+        bee            = roboBee instance the physical constants are taken from
+        desired_height = Y position the altitude hack keeps the robot around [m]
+        use_jit        = True to use the compiled kernel, False for the NumPy version,
+                         None to use the kernel if Numba is installed
+        """
+        if use_jit is None:
+            use_jit = njit is not None
+        elif use_jit and njit is None:
+            raise ImportError("use_jit=True needs Numba, which is not installed")
+
+        self.use_jit = use_jit
+        self.desired_height = desired_height
+
+        self.B_w = bee.B_w
+        self.Rw = bee.Rw
+        self.R_w = np.array([0.0, bee.Rw, 0.0]) #z distance between center of mass and wings [m]
+        self.MASS = bee.MASS
+        self.g = bee.g
+        self.Jz = bee.Jz
+
+        self.lift = bee.LIFT_COEFFICIENT*bee.MASS*bee.g #lift force generated by wings [N]
+        self.increased = False
+
+        # attitude quaternion (w,x,y,z) rotating body coordinates to global ones, and
+        # the inertial frame axes and sensor normals it gives in global coordinates,
+        # all views into one buffer holding the model's orientation state
+        self._buffer = np.empty(4 + BODY_VECTORS.size)
+        self.attitude = self._buffer[:4]
+        self.attitude[:] = quaternions.IDENTITY
+        self._vectors = self._buffer[4:].reshape(BODY_VECTORS.shape)
+        self._vectors[:] = BODY_VECTORS
+        self.inertial_frame = self._vectors[:3]
+        self.sensor_orientations = self._vectors[3:]
+        self._steps = 0
+
+
+    def initial_state(self):
+        """
+        ==== RETURNS ====
+        state = state the archived model started from (10 m up, pointing straight up,
+                rotating about the x axis)
+        """
+        return np.array([0.0, 10.0, 0.0,   #position (x, y, z)
+                         0.0, 0.0, 0.0,   #velocity
+                         0.0, 1.0, 0.0,   #orientation (basically theta)
+                         1.0, 0.0, 0.0])  #angular velocity
+
+
+    def _altitude_hack(self, u):
+        #this ensures the robot's altitude doesn't get too low or high
+        if u[1] < self.desired_height and not self.increased:
+            self.lift *= 1.01
+            self.increased = True
+        elif u[1] > self.desired_height and self.increased:
+            self.lift /= 1.003
+            self.increased = False
+
+
+    def step(self, u, dt):
+        """
+        This function generates translational and angular accelerations
+        based on the current state (position, orientation, velocities) of the
+        robot. It then uses these to calculate the new state.
+
+        ==== ARGUMENTS ====
+        u = current state (12 double numpy 1D array, see ANALYTICAL_STATE_DTYPE in
+            state_layout.py for a view with named fields), updated in place
+            u[:3]  = position in global coordinates [m]
+            u[3:6] = velocity in inertial frame [m/s]
+            u[6:9] = orientation vector (in global coords)
+            u[9:]  = angular velocities about inertial reference frame [rad/sec]
+        dt = time step [seconds], usually 1/120 (wings flap at 120 Hz)
+
+        ==== RETURNS ====
+        u = the state one time step later (the same array that was passed in)
+        """
+        if not self.use_jit:
+            return self.step_numpy(u, dt)
+
+        self._altitude_hack(u)
+        self._steps += 1
+        _step_kernel(u, self.attitude, self._vectors, BODY_VECTORS,
+                     self._steps % self.RENORMALIZE_EVERY == 0, self.lift, self.Rw,
+                     self.B_w, self.MASS, self.g, self.Jz, self.TORQUE_CONTROLLER_CONSTANT, dt)
+
+        return u
+
+
+    def step_numpy(self, u, dt):
+        """
+        NumPy reference version of step(). The dynamics are written the same way as in
+        the archived model.
+        """
+        self._altitude_hack(u)
+
+        state_dot = np.zeros(12)
+        lift = np.array([0.0, self.lift, 0.0])
+
+        drag_force = -self.B_w*(u[3:6] + np.cross(u[9:], self.R_w))
+        drag_torque = np.cross(-self.R_w, drag_force)
+
+        gravity = np.array([0.0, -self.g, 0.0])
+        gravity_inertial = np.array([np.dot(gravity, self.inertial_frame[0]),
+                                     np.dot(gravity, self.inertial_frame[1]),
+                                     np.dot(gravity, self.inertial_frame[2])])
+
+        #generating torque opposing angular velocity keep robot upright
+        torque_gen = -self.TORQUE_CONTROLLER_CONSTANT*u[9:]
+
+        #TRANSLATIONAL ACCELERATION (in ineratial frame)
+        state_dot[3:6] = ((drag_force + lift) / self.MASS + gravity_inertial -
+                            np.cross(u[9:], u[3:6]))
+        #ROTATIONAL ACCELERATION (about inertial frame axes)
+        state_dot[9:] = ((torque_gen - drag_torque + np.cross(self.R_w, drag_force)
+                            - np.cross(u[9:], self.Jz*u[9:]))/self.Jz)
+
+        u[3:6] += dt*state_dot[3:6]   #update vel based on acceleration
+        u[9:] += dt*state_dot[9:]     #update angular vel based on angular accel
+
+        # update position from velocity vector. The archived model converted the
+        # velocity to the global frame with dot products against GLOBAL_FRAME, but
+        # GLOBAL_FRAME was the same array as inertial_frame, so the conversion
+        # always reduced to using the velocity as is
+        u[:3] += dt*u[3:6]
+
+        #rotate the attitude by the angular vels (about the inertial frame axes) over
+        #this step, then recompute orientation, sensors, and inertial frame from it
+        body_orientation = self.inertial_frame.dot(u[6:9])
+
+        self.attitude[:] = quaternions.multiply(self.attitude, quaternions.exp_map(dt*u[9:]))
+        self._steps += 1
+        if self._steps % self.RENORMALIZE_EVERY == 0:
+            self.attitude[:] = quaternions.normalize(self.attitude)
+
+        self._vectors[:] = quaternions.rotate(self.attitude, BODY_VECTORS)
+        u[6:9] = body_orientation.dot(self.inertial_frame)
+
+        return u
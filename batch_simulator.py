@@ -0,0 +1,270 @@
+"""
+Description:
+    Vectorized version of roboBee.run_lqr() that simulates N robots at once. Every
+    robot's state is a row of one (N, 6) array, so each time step advances the whole
+    batch with a handful of array operations instead of N calls to
+    updateState_LQR_Control(). This is meant for generating neural network training
+    data from thousands of initial conditions and setpoints.
+
+    Each robot goes through exactly the same steps as a sequential run_lqr() call:
+    the sensors are read and the angular velocity estimated from them, the LQR
+    drives the lateral states, the altitude controller adjusts each robot's lift
+    coefficient, and a robot stops logging once it reaches its desired state.
+"""
+
+
+import copy
+import numpy as np
+
+from roboBee_class_PD_and_LQR import roboBee
+from observer import AngularVelocityObserver
+from convergence import L1Criterion
+from trajectory_recorder import TrajectoryRecorder
+from state_layout import FleetHistory, LQR_LOG_DTYPE, as_records
+
+# constants that can differ from robot to robot, besides the lift coefficient
+ROBOT_CONSTANTS = ('B_w', 'MASS', 'Rw', 'Jz')
+
+
+def _batch_plants(bee, lift_coefficients, constants):
+    """
+    Looks up the lateral plant and solves the LQR once for every distinct set of
+    constants in the batch (the gains run_lqr() uses depend on the lift coefficient
+    the robot starts with).
+
+    ==== ARGUMENTS ====
+    bee               = roboBee the rest of the constants (and the plant cache) come from
+    lift_coefficients = (N,) starting lift coefficient of each robot
+    constants         = (N, len(ROBOT_CONSTANTS)) constants of each robot
+
+    ==== RETURNS ====
+    A     = (N,4,4) lateral plant of each robot without the lift dependent A[3,0] term
+    B     = (N,) theta_dot entry of each robot's input matrix (the only nonzero one)
+    gains = (N,4) LQR gains of each robot
+    """
+    n_bees = lift_coefficients.shape[0]
+    A = np.empty((n_bees, 4, 4))
+    B = np.empty(n_bees)
+    gains = np.empty((n_bees, 4))
+
+    groups, index = np.unique(np.column_stack((lift_coefficients, constants)), axis=0, return_inverse=True)
+    index = index.reshape(n_bees)
+
+    # scratch copy to hold each group's constants, so the caller's bee isn't changed
+    group_bee = copy.copy(bee)
+    for n, group in enumerate(groups):
+        lift = group[0]
+        for name, value in zip(ROBOT_CONSTANTS, group[1:]):
+            setattr(group_bee, name, value)
+
+        members = index == n
+        A_group, B_group = bee.plant_cache.lateral_plant(bee.g, None, group_bee.B_w, group_bee.MASS,
+                                                         group_bee.Rw, group_bee.Jz)
+        A[members] = A_group
+        B[members] = B_group[1,0]
+        gains[members] = np.asarray(group_bee.LQR_gains(lift)).reshape(4)
+
+    return A, B, gains
+
+
+def iter_lqr_batch(timesteps, states_desired, initial_states = None, lift_coefficients = None, bee = None,
+                   constants = None, convergence = None, estimator = None):
+    """
+    Generator version of run_lqr_batch() that yields the whole batch every time step
+    instead of logging it, e.g. to compute statistics over thousands of robots without
+    keeping their trajectories (see monte_carlo.py).
+
+    ==== ARGUMENTS ====
+    timesteps, states_desired, initial_states, lift_coefficients, bee = see run_lqr_batch()
+    constants         = optional dictionary giving some of each robot's physical
+                        constants (any of ROBOT_CONSTANTS) as (N,) arrays or scalars;
+                        the rest are taken from bee
+    convergence       = optional criterion for when a robot has reached its desired
+                        state (see convergence.py), tested on the whole batch at once
+    estimator         = optional BatchKalmanFilter (see kalman_filter.py) for the N
+                        robots, to estimate theta_dot with instead of getAngularVel()'s
+                        observer. Not with constants, since the filter assumes every
+                        robot has the same constants
+
+    ==== YIELDS ====
+    state      = (N, 6) state of every robot at the start of the time step (robots that
+                 have stopped keep their last state)
+    torque_gen = (N,) torque_gen of every robot this time step
+    active     = (N,) True for the robots still running this time step; a robot is
+                 active for the first n steps, where n is the length of its run_lqr()
+                 trajectory. The generator returns once no robot is active
+    reached    = (N,) True for the robots the convergence criterion stops this time
+                 step, i.e. this is the last step they are active for
+    """
+    if bee is None:
+        bee = roboBee()
+
+    states_desired = np.atleast_2d(np.array(states_desired, dtype=float))
+    n_bees = states_desired.shape[0]
+
+    if initial_states is None:
+        state = np.zeros((n_bees, 6))
+    else:
+        state = np.array(initial_states, dtype=float).reshape(n_bees, 6)
+
+    if lift_coefficients is None:
+        lift_coefficients = bee.LIFT_COEFFICIENT
+    lift = np.array(np.broadcast_to(lift_coefficients, (n_bees,)), dtype=float)
+
+    if constants is None:
+        constants = {}
+    unknown = set(constants) - set(ROBOT_CONSTANTS)
+    if unknown:
+        raise ValueError("constants can only be some of %s, not %s" % (ROBOT_CONSTANTS, sorted(unknown)))
+    if constants and estimator is not None:
+        # the filter's model is built from one robot's constants, see BatchKalmanFilter
+        raise ValueError("an estimator can't be used with per robot constants, it models every robot "
+                         "with the constants of the bee it was built for")
+    robot_constants = np.column_stack([ np.broadcast_to(constants.get(name, getattr(bee, name)), (n_bees,))
+                                        for name in ROBOT_CONSTANTS ]).astype(float)
+    MASS = robot_constants[:,ROBOT_CONSTANTS.index('MASS')]
+
+    # Lateral plant without the lift dependent A[3,0] term, which differs per robot
+    A, B, gains = _batch_plants(bee, lift, robot_constants)
+
+    dt = bee.dt
+    g = bee.g
+
+    # B*K for every robot, B only has an entry for theta_dot
+    BK = np.zeros((n_bees, 4, 4))
+    BK[:,1,:] = B[:,None] * gains
+    BK_desired = np.einsum('nij,nj->ni', BK, states_desired[:,:4])
+
+    # Observer matrix from getAngularVel(), scaled for this time step like the
+    # robot's own observer
+    L = AngularVelocityObserver.L * (AngularVelocityObserver.CALIBRATION_DT / dt)
+
+    last_sensor_readings = np.zeros((n_bees, 4))
+    torque_gen = np.zeros(n_bees)
+    aVelEstimates = np.zeros((n_bees, 2))
+    # the estimator starts from this run's initial states, not from a previous run,
+    # and the first time step uses them (see iter_lqr())
+    if estimator is not None:
+        estimator.reset(state)
+        aVelEstimates[:,0] = state[:,1]
+
+    if convergence is None:
+        convergence = L1Criterion()
+    convergence.reset()
+
+    active = np.ones(n_bees, dtype=bool)
+    adjustment = 0.02
+
+    for i in range(timesteps):
+        if not active.any():
+            break
+
+        # per robot version of run_lqr()'s stopping condition
+        point_reached = convergence.update(state, states_desired)
+
+        if i != 0:
+            new_readings = bee.sensor_model.readings(state[:,0], state[:,2::2])
+            if estimator is None:
+                aVelEstimates = (new_readings - last_sensor_readings).dot(L.T)
+                aVelEstimates[:,0] += dt*torque_gen
+            else:
+                aVelEstimates[:,0] = estimator.update(new_readings, torque_gen, state[:,2::2], lift)[:,1]
+            last_sensor_readings = new_readings
+
+        estimated_state = state.copy()
+        estimated_state[:,1] = aVelEstimates[:,0]
+
+        # Lateral controller: (A - B*K)*x + B*K*x_desired, with A[3,0] = g*lift
+        A_cl = A - BK
+        A_cl[:,3,0] += g*lift
+        state_dot_lat = np.einsum('nij,nj->ni', A_cl, estimated_state[:,:4]) + BK_desired
+        torque_gen = state_dot_lat[:,1]
+
+        # Altitude controller, see updateState_LQR_Control()
+        z_vel = estimated_state[:,5]
+        z_error = states_desired[:,4] - estimated_state[:,4]
+        slowing_up = (z_vel > 0) & (z_vel > z_error)
+        slowing_down = ~slowing_up & (z_vel < 0) & (z_vel < z_error)
+
+        estimated_state[:,5] = np.where(slowing_up, z_vel - adjustment,
+                                        np.where(slowing_down, z_vel + adjustment, z_vel))
+        lift = np.where(slowing_up | slowing_down, lift, 1 + z_error)
+        lift = np.clip(lift, 0.5, 1.5)
+
+        state_dot = np.empty((n_bees, 6))
+        state_dot[:,:4] = state_dot_lat
+        state_dot[:,4] = estimated_state[:,5]
+        state_dot[:,5] = MASS*g*(lift*np.cos(estimated_state[:,0]) - 1)
+
+        yield state, torque_gen, active.copy(), active & point_reached
+
+        # robots that reached their desired state stop here, their states are frozen
+        # so they don't affect anything else
+        new_state = estimated_state + state_dot*dt
+        state = np.where(active[:,None], new_state, state)
+        active &= ~point_reached
+
+
+def run_lqr_fleet(timesteps, states_desired, initial_states = None, lift_coefficients = None, bee = None,
+                  constants = None, convergence = None, estimator = None):
+    """
+    Same simulation as run_lqr_batch(), but the whole batch's logs are kept together
+    in one contiguous buffer instead of being copied out robot by robot.
+
+    ==== ARGUMENTS ====
+    see run_lqr_batch()
+
+    ==== RETURNS ====
+    history = FleetHistory (see state_layout.py) of every robot's log
+    """
+    states_desired = np.atleast_2d(np.array(states_desired, dtype=float))
+    n_bees = states_desired.shape[0]
+    lengths = np.zeros(n_bees, dtype=int)
+
+    capacity = min(timesteps, 1024)
+    state_log = TrajectoryRecorder(capacity, (n_bees, 8))
+    torque_log = TrajectoryRecorder(capacity, n_bees)
+
+    for i, (state, torque_gen, active, reached) in enumerate(iter_lqr_batch(timesteps, states_desired,
+                                                                            initial_states, lift_coefficients,
+                                                                            bee, constants, convergence,
+                                                                            estimator)):
+        state_row = state_log.next_row()
+        state_row[:,:6] = state
+        state_row[:,6] = states_desired[:,2]
+        state_row[:,7] = states_desired[:,4]
+
+        torque_log.append(torque_gen)
+        lengths[active] = i + 1
+
+    return FleetHistory(as_records(state_log.data(), LQR_LOG_DTYPE), torque_log.data(), lengths)
+
+
+def run_lqr_batch(timesteps, states_desired, initial_states = None, lift_coefficients = None, bee = None,
+                  constants = None, convergence = None, estimator = None):
+    """
+    Simulates N robots with the LQR controller, equivalent to calling run_lqr() once
+    per robot (each on a fresh roboBee instance).
+
+    ==== ARGUMENTS ====
+    timesteps         = maximum number of time steps to simulate each robot for
+    states_desired    = final state each robot is trying to get to, (N, 6) array
+                        (see updateState_LQR_Control() for the state layout)
+    initial_states    = state each robot starts in, (N, 6) array (defaults to zeros)
+    lift_coefficients = LIFT_COEFFICIENT each robot starts with, (N,) array or a
+                        scalar (defaults to the roboBee class value)
+    bee               = roboBee instance to take physical constants from
+    constants         = optional per robot physical constants, see iter_lqr_batch()
+    convergence       = optional stopping criterion, see iter_lqr_batch()
+    estimator         = optional BatchKalmanFilter, see iter_lqr_batch()
+
+    ==== RETURNS ====
+    results = list with one (state_data, torque_data) tuple per robot, shaped
+              like the arrays run_lqr() returns: (n, 8) and (n,), where n is the
+              number of time steps that robot ran for
+    """
+    history = run_lqr_fleet(timesteps, states_desired, initial_states, lift_coefficients, bee, constants,
+                            convergence, estimator)
+
+    return [ (np.ascontiguousarray(state_data), torque_data.copy())
+             for state_data, torque_data in (history.robot(n) for n in range(len(history))) ]
@@ -0,0 +1,495 @@
+"""
+Description:
+    Benchmark suite for the roboBee simulator.
+
+    The main suite measures how many time steps per second each of the simulator's
+    per-step functions manages (updateState_LQR_Control, updateState_PD_Control,
+    updateState_analytical, readSensors and getAngularVel) over trajectories of
+    1e3 to 1e6 steps, plus the batched simulator and sensor model over several batch
+    sizes. Plots and printing are off for all of it. Results are saved as JSON, and
+    compared against a stored baseline so that any slowdown fails the run:
+
+        python benchmarks.py --save-baseline          # record this machine's baseline
+        python benchmarks.py --output results.json    # later, exits with 1 on a regression
+
+    Without a baseline file nothing is compared and only a warning is printed, unless
+    --require-baseline is given (e.g. in CI), which exits with 1 instead.
+
+    --extras also times the gain schedule lookups, the Numba compiled analytical model
+    against its NumPy version, the nonlinear plant's integrators, the multi-rate
+    scheduler, the closed-loop fast path and the simulator's import time.
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+from roboBee_class_PD_and_LQR import roboBee
+from batch_simulator import run_lqr_batch
+from gain_schedule import GainSchedule
+from sensor_model import SensorModel, LookupTableSensorModel
+from light_sources import LightingModel, PointLight, AreaLight
+from analytical_model import AnalyticalModel
+from nonlinear_plant import NonlinearPlant
+from multirate import MultiRateScheduler
+from closed_loop import ClosedLoopPropagator, simulate_lqr
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+LENGTHS = (1000, 10000, 100000, 1000000)
+BATCH_SIZES = (1, 10, 100, 1000)
+# batch benchmarks with more robot-steps than this are skipped
+MAX_BATCH_WORK = 10**7
+
+
+def _best_time(function, repeats):
+    # shortest of several runs, the others are mostly noise from the rest of the machine
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def _repeats(steps):
+    return 3 if steps <= 10000 else 1
+
+
+def bench_lqr_step(steps):
+    bee = roboBee()
+    gains = bee.LQR_gains()
+    state_desired = np.array([0.0, 0.0, 2, 0.0, 2, 0.0]).reshape(6,1)
+
+    def run():
+        state = np.zeros(6).reshape(6,1)
+        for i in range(steps):
+            state, torque = bee.updateState_LQR_Control(state, bee.dt, state_desired, gains)
+
+    return steps / _best_time(run, _repeats(steps))
+
+
+def bench_pd_step(steps):
+    bee = roboBee()
+
+    def run():
+        state = np.array([0.0, 5.0, 0.0, 0.0])
+        for i in range(steps):
+            state, torque = bee.updateState_PD_Control(state, bee.dt)
+
+    return steps / _best_time(run, _repeats(steps))
+
+
+def bench_analytical_step(steps, use_jit = None):
+    model = AnalyticalModel(roboBee(), use_jit=use_jit)
+    dt = roboBee.dt
+    model.step(model.initial_state(), dt/2) #compiles the kernel, if there is one
+
+    def run():
+        # alternating half and full steps like run_analytical() does, the model's
+        # torque controller is unstable with plain dt sized Euler steps
+        state = model.initial_state()
+        for i in range(steps // 2):
+            model.step(state, dt/2)
+            model.step(state, dt)
+
+    return steps / _best_time(run, _repeats(steps))
+
+
+def bench_analytical_step_numpy(steps):
+    return bench_analytical_step(steps, use_jit=False)
+
+
+def bench_read_sensors(steps):
+    bee = roboBee()
+    thetas = np.random.default_rng(0).uniform(-0.2, 0.2, steps).tolist()
+
+    def run():
+        for theta in thetas:
+            bee.readSensors(theta)
+
+    return steps / _best_time(run, _repeats(steps))
+
+
+def bench_angular_vel(steps):
+    bee = roboBee()
+    thetas = np.random.default_rng(0).uniform(-0.2, 0.2, steps)
+    readings = SensorModel().readings(thetas)[:,:,None]
+
+    def run():
+        for i in range(steps):
+            bee.getAngularVel(readings[i], 0.0)
+
+    return steps / _best_time(run, _repeats(steps))
+
+
+def bench_lqr_batch(steps, batch_size):
+    rng = np.random.default_rng(0)
+    states_desired = np.zeros((batch_size, 6))
+    states_desired[:,2] = rng.uniform(-2, 2, batch_size)
+    states_desired[:,4] = rng.uniform(0, 3, batch_size)
+
+    # a desired state that is never reached, so every robot runs for every step
+    states_desired[:,0] = 1.0
+
+    def run():
+        run_lqr_batch(steps, states_desired)
+
+    return batch_size * steps / _best_time(run, _repeats(steps))
+
+
+def bench_read_sensors_batch(steps, batch_size):
+    thetas = np.random.default_rng(0).uniform(-0.2, 0.2, (batch_size, steps))
+    model = SensorModel()
+
+    return batch_size * steps / _best_time(lambda: model.readings(thetas), _repeats(steps))
+
+
+def bench_read_sensors_lights(steps, batch_size):
+    rng = np.random.default_rng(0)
+    thetas = rng.uniform(-0.2, 0.2, (batch_size, steps))
+    positions = rng.uniform(-2, 2, (batch_size, steps, 2))
+    model = LightingModel([ PointLight((0.0, 5.0, 0.0)), AreaLight((1.0, 6.0, 0.0), (0, -1, 0), 0.5) ])
+
+    return batch_size * steps / _best_time(lambda: model.readings(thetas, positions), _repeats(steps))
+
+
+def bench_read_sensors_table(steps, batch_size):
+    thetas = np.random.default_rng(0).uniform(-0.2, 0.2, (batch_size, steps))
+    model = LookupTableSensorModel()
+
+    return batch_size * steps / _best_time(lambda: model.readings(thetas), _repeats(steps))
+
+
+STEP_BENCHMARKS = { 'updateState_LQR_Control': bench_lqr_step,
+                    'updateState_PD_Control': bench_pd_step,
+                    'updateState_analytical': bench_analytical_step,
+                    'AnalyticalModel.step_numpy': bench_analytical_step_numpy,
+                    'readSensors': bench_read_sensors,
+                    'getAngularVel': bench_angular_vel }
+
+BATCH_BENCHMARKS = { 'run_lqr_batch': bench_lqr_batch,
+                     'SensorModel.readings': bench_read_sensors_batch,
+                     'LookupTableSensorModel.readings': bench_read_sensors_table,
+                     'LightingModel.readings': bench_read_sensors_lights }
+
+
+def run_suite(lengths = LENGTHS, batch_sizes = BATCH_SIZES, log = print):
+    """
+    Runs every benchmark for every trajectory length (and batch size).
+
+    ==== ARGUMENTS ====
+    lengths     = trajectory lengths [time steps]
+    batch_sizes = numbers of robots for the batched benchmarks
+    log         = function each result is passed to as it comes in (None for silence)
+
+    ==== RETURNS ====
+    results = dictionary from benchmark name, e.g. 'readSensors[T=1000]' or
+              'run_lqr_batch[N=10,T=1000]', to steps per second (robot-steps per
+              second for the batched benchmarks)
+    """
+    results = {}
+
+    def record(name, steps_per_second):
+        results[name] = steps_per_second
+        if log is not None:
+            log("%-40s %14.0f steps/s" % (name, steps_per_second))
+
+    for steps in lengths:
+        for name, benchmark in STEP_BENCHMARKS.items():
+            record("%s[T=%d]" % (name, steps), benchmark(steps))
+
+        for batch_size in batch_sizes:
+            if batch_size * steps > MAX_BATCH_WORK:
+                continue
+            for name, benchmark in BATCH_BENCHMARKS.items():
+                record("%s[N=%d,T=%d]" % (name, batch_size, steps), benchmark(steps, batch_size))
+
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    ==== ARGUMENTS ====
+    results   = output of run_suite()
+    baseline  = results stored from an earlier run
+    tolerance = fraction a benchmark may slow down by before it counts as a regression
+
+    ==== RETURNS ====
+    regressions = list of (name, steps/s now, steps/s in the baseline) for every
+                  benchmark that got slower than allowed
+    """
+    regressions = []
+    for name, steps_per_second in results.items():
+        if name in baseline and steps_per_second < baseline[name] * (1 - tolerance):
+            regressions.append((name, steps_per_second, baseline[name]))
+
+    return regressions
+
+
+def bench_gain_schedule(calls = 2000):
+    """
+    Compares looking gains up in a GainSchedule against solving the LQR online (once
+    per call, which is what a gain-scheduled run would cost without the table).
+
+    ==== ARGUMENTS ====
+    calls = number of gain computations to time for each method
+
+    ==== RETURNS ====
+    results = dictionary with the time per call of each method [seconds], the
+              one-off cost of building the table, and the table's interpolation error
+    """
+    import control
+
+    bee = roboBee()
+    lifts = np.random.default_rng(0).uniform(0.5, 1.5, calls)
+
+    start = time.perf_counter()
+    schedule = GainSchedule(bee)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for lift in lifts:
+        schedule.gains_at(lift)
+    lookup_time = (time.perf_counter() - start) / calls
+
+    Q = np.diag([100, 1, 100, 0.1])
+    R = 5e15
+    solve_calls = max(calls // 10, 1)
+    start = time.perf_counter()
+    for lift in lifts[:solve_calls]:
+        A, B = bee.plant_cache.lateral_plant(bee.g, lift, bee.B_w, bee.MASS, bee.Rw, bee.Jz)
+        control.lqr(A, B, Q, R)
+    solve_time = (time.perf_counter() - start) / solve_calls
+
+    return { 'lookup': lookup_time,
+             'solve': solve_time,
+             'build': build_time,
+             'interpolation_error': schedule.interpolation_error(bee) }
+
+
+def bench_analytical_jit(steps = 20000):
+    """
+    Compares the Numba compiled analytical model against its NumPy version.
+
+    ==== RETURNS ====
+    results = dictionary with the steps per second of each version, or None for 'jit'
+              if Numba isn't installed
+    """
+    import analytical_model
+
+    jit = None
+    if analytical_model.njit is not None:
+        jit = bench_analytical_step(steps, use_jit=True)
+
+    return { 'numpy': bench_analytical_step(steps, use_jit=False), 'jit': jit }
+
+
+def _run_nonlinear_lqr(steps, integrator, substeps = 1, rtol = 1e-6, atol = 1e-9):
+    # LQR driving the nonlinear plant, fed the true state so only the integrator differs
+    bee = roboBee()
+    gains = bee.LQR_gains()
+    state_desired = bee._lqr_setpoint(None)
+    plant = NonlinearPlant(bee, integrator, substeps, rtol, atol)
+    plant.set_lqr_state(np.zeros(6))
+
+    states = np.empty((steps, 6))
+    start = time.perf_counter()
+    for i in range(steps):
+        state = plant.lqr_state()
+        states[i] = state[:,0]
+        bee.updateState_LQR_Nonlinear(state.copy(), bee.dt, state_desired, gains, plant)
+
+    return states, time.perf_counter() - start
+
+
+def bench_nonlinear_integrators(steps = 600):
+    """
+    Compares the nonlinear plant's integrators at the 120 Hz control rate, against a
+    tight tolerance RK45 run.
+
+    ==== RETURNS ====
+    results = dictionary of (run time [seconds], largest error of any state) for each
+              (integrator, substeps per control step)
+    """
+    reference, run_time = _run_nonlinear_lqr(steps, 'rk45', rtol=1e-11, atol=1e-13)
+
+    results = {}
+    for integrator, substeps in (('euler', 1), ('euler', 10), ('euler', 100), ('rk4', 1), ('rk4', 2), ('rk45', 1)):
+        states, run_time = _run_nonlinear_lqr(steps, integrator, substeps)
+        results[(integrator, substeps)] = (run_time, np.abs(states - reference).max())
+
+    return results
+
+
+def bench_multirate(steps = 2000, sensor_rate = 1000, substeps = (1, 10, 100)):
+    """
+    Times the multi-rate scheduler (linear plant, sensors at sensor_rate) with more
+    and more plant substeps per 120 Hz control period.
+
+    ==== RETURNS ====
+    results = dictionary of control steps per second for each number of substeps
+    """
+    results = {}
+    for n in substeps:
+        bee = roboBee()
+        bee.LQR_gains() #solved (and cached) outside the timed part
+        scheduler = MultiRateScheduler(1 / bee.dt, sensor_rate, n)
+
+        start = time.perf_counter()
+        for step in scheduler.iter_lqr(bee, steps):
+            pass
+        results[n] = steps / (time.perf_counter() - start)
+
+    return results
+
+
+def bench_closed_loop(steps = 20000, horizon = 10000):
+    """
+    Times simulate_lqr() with and without its fast path, and a single horizon of
+    steps at constant lift propagated in one batch against a step at a time.
+
+    ==== RETURNS ====
+    results = dictionary of run times [seconds]
+    """
+    results = {}
+    for fast_path in (False, True):
+        bee = roboBee()
+        bee.LQR_gains() #solved (and cached) outside the timed part
+        start = time.perf_counter()
+        simulate_lqr(bee, steps, fast_path=fast_path)
+        results['fast_path' if fast_path else 'step_by_step'] = time.perf_counter() - start
+
+    bee = roboBee()
+    propagator = ClosedLoopPropagator(bee, bee.LQR_gains(), bee.dt)
+    state_desired = bee._lqr_setpoint(None)[:4,0]
+    state = np.array([0.1, 0.0, 0.0, 0.0])
+    propagator.matrices(1.0)
+
+    results['horizon_batched'] = _best_time(lambda: propagator.propagate(state, state_desired, 1.0, horizon), 5)
+
+    def one_at_a_time():
+        x = state
+        for i in range(horizon):
+            x = propagator.propagate(x, state_desired, 1.0, 1)[1]
+    results['horizon_looped'] = _best_time(one_at_a_time, 1)
+
+    return results
+
+
+def _time_import(statement, repeats):
+    # fresh interpreter each time, so nothing is already cached in sys.modules
+    code = ("import time; start = time.perf_counter(); %s; "
+            "print(time.perf_counter() - start)" % statement)
+    times = []
+    for i in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(float(output))
+
+    return min(times)
+
+
+def bench_import_time(repeats = 5):
+    """
+    Measures how long importing the simulator takes in a fresh interpreter, next to
+    the cost of the plotting and control libraries it only loads when needed.
+
+    ==== RETURNS ====
+    results = dictionary with the best of 'repeats' import times [seconds]
+    """
+    return { 'simulator': _time_import("import roboBee_class_PD_and_LQR", repeats),
+             'matplotlib_and_control': _time_import("import matplotlib.pyplot, control", repeats) }
+
+
+def _print_extras():
+    results = bench_gain_schedule()
+    print("Gain schedule lookup:  %8.2f us/call" % (results['lookup'] * 1e6))
+    print("Online LQR solve:      %8.2f us/call" % (results['solve'] * 1e6))
+    print("Speedup:               %8.1fx" % (results['solve'] / results['lookup']))
+    print("Table build (one-off): %8.2f ms" % (results['build'] * 1e3))
+    print("Max interpolation error (relative): %.2e" % results['interpolation_error'])
+
+    results = bench_analytical_jit()
+    print("Analytical model, NumPy: %10.0f steps/s" % results['numpy'])
+    if results['jit'] is None:
+        print("Analytical model, Numba: not installed")
+    else:
+        print("Analytical model, Numba: %10.0f steps/s" % results['jit'])
+        print("Speedup:                 %10.1fx" % (results['jit'] / results['numpy']))
+
+    print("Nonlinear plant integrators (LQR at 120 Hz, 600 steps):")
+    for (integrator, substeps), (run_time, error) in bench_nonlinear_integrators().items():
+        print("    %-5s x%-3d %8.1f ms   max error %.1e" % (integrator, substeps, run_time * 1e3, error))
+
+    print("Multi-rate LQR (1 kHz sensing), control steps/s by plant substeps:")
+    for n, steps_per_second in bench_multirate().items():
+        print("    %4d substeps %10.0f steps/s" % (n, steps_per_second))
+
+    results = bench_closed_loop()
+    print("Closed-loop LQR, step by step: %8.1f ms" % (results['step_by_step'] * 1e3))
+    print("Closed-loop LQR, fast path:    %8.1f ms" % (results['fast_path'] * 1e3))
+    print("10000 steps at constant lift:  %8.2f ms batched, %8.1f ms looped"
+          % (results['horizon_batched'] * 1e3, results['horizon_looped'] * 1e3))
+
+    results = bench_import_time()
+    print("Simulator import time:          %8.1f ms" % (results['simulator'] * 1e3))
+    print("matplotlib + control (skipped): %8.1f ms" % (results['matplotlib_and_control'] * 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the roboBee simulator")
+    parser.add_argument("--lengths", type=int, nargs="+", default=LENGTHS,
+                        help="trajectory lengths [time steps]")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--quick", action="store_true", help="only run the 1e3 and 1e4 step lengths")
+    parser.add_argument("--output", help="file to save the results to (JSON)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown before a benchmark counts as a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="exit with 1 if there is no baseline to compare against")
+    parser.add_argument("--extras", action="store_true",
+                        help="also time gain schedule lookups, the analytical model's JIT and the simulator's import")
+    args = parser.parse_args()
+
+    lengths = [ steps for steps in args.lengths if not args.quick or steps <= 10000 ]
+    results = run_suite(lengths, args.batch_sizes)
+
+    report = { 'python': platform.python_version(), 'numpy': np.__version__,
+               'machine': platform.machine(), 'results': results }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.extras:
+        _print_extras()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print("Saved baseline to", args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for name, steps_per_second, baseline_steps_per_second in regressions:
+            print("REGRESSION: %s %.0f steps/s (baseline %.0f steps/s)"
+                  % (name, steps_per_second, baseline_steps_per_second))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+    else:
+        print("WARNING: no baseline at %s, nothing compared (record one with --save-baseline)" % args.baseline)
+        if args.require_baseline:
+            sys.exit(1)
@@ -0,0 +1,175 @@
+"""
+Description:
+    Exact (zero order hold) propagation of the LQR's closed-loop lateral model, with
+    a fast path that computes whole stretches of a run in one batched operation.
+
+    With the controller seeing the true state, the lateral (theta, theta_dot, x, x_dot)
+    dynamics are
+        x_dot = (A - B*K)*x + B*K*x_desired
+    and for a fixed lift coefficient A - B*K is constant, so the state one time step
+    later is exactly
+        x[k+1] = Phi*x[k] + Gamma*x_desired,   [Phi Gamma] = top rows of expm(M*dt)
+    with M = [[A - B*K, B*K], [0, 0]]. Phi and Gamma are only recomputed when the lift
+    changes, and over T steps with the same lift
+        x[k] = Phi^k*x[0] + (I + Phi + ... + Phi^(k-1))*Gamma*x_desired
+    which comes out of log2(T) batched matrix products (see matrix_powers()) instead of
+    T Python iterations.
+
+    simulate_lqr() uses this to run the same controller as run_lqr() (LQR plus the
+    altitude controller, without the sensors). The altitude controller only changes
+    the lift in some steps. Between those steps the lift is constant, so the lateral
+    states are computed in batches, over a horizon that doubles while the lift keeps
+    holding. The altitude controller then runs over the batch in a cheap scalar loop
+    to find where the lift changes next. fast_path=False computes every step on its
+    own and gives the same trajectory, step for step.
+"""
+
+
+import numpy as np
+
+from linear_plant import matrix_powers
+from altitude_controller import altitude_control
+
+
+class ClosedLoopPropagator(object):
+
+    def __init__(self, bee, gains, dt):
+        """
+        ==== ARGUMENTS ====
+        bee   = roboBee instance the physical constants and plant cache come from
+        gains = (1,4) LQR gains
+        dt    = time step [seconds]
+        """
+        self.bee = bee
+        self.gains = np.asarray(gains, dtype=float)
+        self.dt = dt
+
+        self._lift = None
+        self._Phi = None
+        self._Gamma = None
+
+
+    def matrices(self, lift_coefficient):
+        """
+        ==== RETURNS ====
+        Phi, Gamma = (4,4) discrete closed-loop matrices for this lift, see the module
+                     description. The last pair is kept, since the lift usually stays
+                     the same for many steps in a row
+        """
+        if lift_coefficient != self._lift:
+            # imported here like the control library, scipy is slow to load
+            from scipy.linalg import expm
+
+            bee = self.bee
+            A, B = bee.plant_cache.lateral_plant(bee.g, lift_coefficient, bee.B_w, bee.MASS, bee.Rw, bee.Jz)
+            BK = B.dot(self.gains)
+
+            M = np.zeros((8, 8))
+            M[:4,:4] = A - BK
+            M[:4,4:] = BK
+            discrete = expm(M*self.dt)
+
+            self._lift = lift_coefficient
+            self._Phi = discrete[:4,:4]
+            self._Gamma = discrete[:4,4:]
+
+        return self._Phi, self._Gamma
+
+
+    def propagate(self, lateral_state, lateral_desired, lift_coefficient, steps):
+        """
+        ==== ARGUMENTS ====
+        lateral_state    = (4,) current theta, theta_dot, x, x_dot
+        lateral_desired  = (4,) desired lateral state
+        lift_coefficient = lift coefficient held for all the steps
+        steps            = number of time steps to propagate
+
+        ==== RETURNS ====
+        states = (steps+1, 4) lateral state at each step, starting with lateral_state
+        """
+        Phi, Gamma = self.matrices(lift_coefficient)
+        powers = matrix_powers(Phi, steps)
+        sums = np.cumsum(powers[:-1], axis=0)
+
+        states = np.empty((steps + 1, 4))
+        states[0] = lateral_state
+        states[1:] = powers[1:].dot(lateral_state) + sums.dot(Gamma.dot(lateral_desired))
+
+        return states
+
+
+def simulate_lqr(bee, timesteps, state_desired = None, initial_state = None, fast_path = True,
+                 max_horizon = 1024):
+    """
+    Runs the LQR and altitude controller on the linearized model with exact lateral
+    propagation and full state feedback (no sensors), see the module description.
+
+    ==== ARGUMENTS ====
+    bee           = roboBee to simulate; its LIFT_COEFFICIENT is changed by the
+                    altitude controller, same as in run_lqr()
+    timesteps     = maximum number of time steps (stops early if the desired state
+                    is reached)
+    state_desired, initial_state = see run_lqr()
+    fast_path     = batch the steps over which the lift doesn't change. False steps
+                    one at a time, which gives the same result more slowly
+    max_horizon   = most steps batched at once
+
+    ==== RETURNS ====
+    state_data  = (n,8) state of the robot at each time step, then desired x and z
+    torque_data = (n,) torque_gen of each time step (see updateState_LQR_Control())
+    """
+    state_desired = bee._lqr_setpoint(state_desired)[:,0]
+    state = np.zeros(6) if initial_state is None else np.array(initial_state, dtype=float).ravel()
+
+    gains = bee.LQR_gains()
+    propagator = ClosedLoopPropagator(bee, gains, bee.dt)
+    A, B = bee.plant_cache.lateral_plant(bee.g, None, bee.B_w, bee.MASS, bee.Rw, bee.Jz)
+    # torque_gen = A[1]*x + B[1]*K*(x_desired - x), for many x at once
+    torque_row = A[1] - B[1,0]*gains[0]
+    torque_offset = B[1,0]*gains[0].dot(state_desired[:4])
+
+    state_data = np.empty((timesteps, 8))
+    state_data[:,6] = state_desired[2]
+    state_data[:,7] = state_desired[4]
+    torque_data = np.empty(timesteps)
+
+    dt = bee.dt
+    z_desired, z_dot_desired = state_desired[4], state_desired[5]
+    z, z_dot = float(state[4]), float(state[5])
+    horizon = 1
+    i = 0
+    pointReached = False
+
+    while i < timesteps and not pointReached:
+        lift = bee.LIFT_COEFFICIENT
+        steps = min(horizon if fast_path else 1, timesteps - i)
+        lateral = propagator.propagate(state[:4], state_desired[:4], lift, steps)
+
+        state_data[i:i + steps,:4] = lateral[:-1]
+        torque_data[i:i + steps] = lateral[:-1].dot(torque_row) + torque_offset
+
+        # altitude controller and Euler altitude step, one time step at a time, until
+        # the lift changes (the lateral states after that were propagated with the
+        # wrong lift and are recomputed next time around)
+        lateral_diffs = np.abs(lateral[:-1] - state_desired[:4]).sum(axis=1).tolist()
+        cos_thetas = np.cos(lateral[:-1,0]).tolist()
+        for j in range(steps):
+            state_data[i,4] = z
+            state_data[i,5] = z_dot
+
+            if lateral_diffs[j] + abs(z - z_desired) + abs(z_dot - z_dot_desired) < 0.01:
+                pointReached = True
+
+            z_dot, bee.LIFT_COEFFICIENT = altitude_control(z, z_dot, z_desired, bee.LIFT_COEFFICIENT)
+
+            z, z_dot = z + z_dot*dt, z_dot + bee.MASS*bee.g*(bee.LIFT_COEFFICIENT*cos_thetas[j] - 1)*dt
+            i += 1
+
+            if pointReached or bee.LIFT_COEFFICIENT != lift:
+                break
+
+        state[:4] = lateral[j + 1]
+        # grow the horizon while the lift holds, start over when it doesn't
+        horizon = min(2*horizon, max_horizon) if j + 1 == steps else 1
+
+    return state_data[:i], torque_data[:i]
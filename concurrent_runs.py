@@ -0,0 +1,111 @@
+"""
+Description:
+    Runs many LQR simulations in a pool of threads, in the same process.
+
+    Every run gets its own roboBee built from one shared, immutable RobotParameters
+    (see robot_parameters.py), so the only thing the threads share is the plant
+    cache, which is locked. A thread pool avoids the cost of starting processes and
+    pickling results (dataset_generation.py uses processes), but Python only runs one
+    thread at a time outside of NumPy's array operations, which let the others run
+    while they work. So threads pay off for the batched simulator, whose time goes
+    into operations on (N, 6) arrays, much more than for single robot runs:
+
+        results = run_lqr_batch_threaded(1000, states_desired, chunk_size=500)
+
+    matches_serial() runs the same simulations in threads and one after the other
+    and checks that the results are exactly equal.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from roboBee_class_PD_and_LQR import roboBee
+from batch_simulator import run_lqr_batch
+from robot_parameters import RobotParameters
+
+
+def _run_lqr(parameters, run):
+    bee = roboBee(parameters)
+    # plots and printing are off unless the run asks for them
+    return bee.run_lqr(**dict(dict(plots=False, quiet=True), **run))
+
+
+def run_lqr_threaded(runs, parameters = None, max_workers = None):
+    """
+    ==== ARGUMENTS ====
+    runs        = list of dictionaries of run_lqr() keyword arguments, one per run
+                  (timesteps, state_desired, initial_state, ...; plots and printing
+                  are off unless a run sets them)
+    parameters  = RobotParameters of every robot, defaults to the class's constants
+    max_workers = number of threads, defaults to ThreadPoolExecutor's default
+
+    ==== RETURNS ====
+    results = list of (state_data, torque_data) tuples, in the same order as runs
+    """
+    if parameters is None:
+        parameters = RobotParameters.defaults()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda run: _run_lqr(parameters, run), runs))
+
+
+def run_lqr_batch_threaded(timesteps, states_desired, initial_states = None, lift_coefficients = None,
+                           parameters = None, chunk_size = 256, max_workers = None):
+    """
+    Splits a run_lqr_batch() into chunks of robots and simulates the chunks in
+    separate threads.
+
+    ==== ARGUMENTS ====
+    timesteps, states_desired, initial_states, lift_coefficients = see run_lqr_batch()
+    parameters  = RobotParameters of every robot, defaults to the class's constants
+    chunk_size  = number of robots simulated together in one thread
+    max_workers = number of threads
+
+    ==== RETURNS ====
+    results = same as run_lqr_batch()
+    """
+    if parameters is None:
+        parameters = RobotParameters.defaults()
+
+    states_desired = np.atleast_2d(np.array(states_desired, dtype=float))
+    n_bees = states_desired.shape[0]
+
+    if initial_states is not None:
+        initial_states = np.array(initial_states, dtype=float).reshape(n_bees, 6)
+    if lift_coefficients is None:
+        lift_coefficients = parameters.LIFT_COEFFICIENT
+    lift_coefficients = np.broadcast_to(lift_coefficients, (n_bees,))
+
+    def run_chunk(start):
+        chunk = slice(start, start + chunk_size)
+        return run_lqr_batch(timesteps, states_desired[chunk],
+                             None if initial_states is None else initial_states[chunk],
+                             lift_coefficients[chunk], roboBee(parameters))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        chunks = list(pool.map(run_chunk, range(0, n_bees, chunk_size)))
+
+    return [ result for chunk in chunks for result in chunk ]
+
+
+def matches_serial(runs, parameters = None, max_workers = None):
+    """
+    Runs the same simulations with run_lqr_threaded() and one at a time, and checks
+    that every array comes out exactly the same.
+
+    ==== ARGUMENTS ====
+    runs, parameters, max_workers = see run_lqr_threaded()
+
+    ==== RETURNS ====
+    identical = True if all the threaded results are equal to the serial ones
+    """
+    if parameters is None:
+        parameters = RobotParameters.defaults()
+
+    threaded = run_lqr_threaded(runs, parameters, max_workers)
+    serial = [ _run_lqr(parameters, run) for run in runs ]
+
+    return all(np.array_equal(threaded_array, serial_array, equal_nan=True)
+               for threaded_result, serial_result in zip(threaded, serial)
+               for threaded_array, serial_array in zip(threaded_result, serial_result))
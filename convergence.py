@@ -0,0 +1,159 @@
+"""
+Description:
+    Convergence criteria that decide when a simulation has reached its desired
+    state and can stop.
+
+    run_lqr() used to stop as soon as sum(abs(state - state_desired)) < 0.01, with
+    Python's sum() iterating over NumPy scalars every time step. A criterion instead
+    does its test with NumPy reductions, and works the same on one robot's (6,1)
+    state and on an (N,6) batch of states (giving one answer per robot):
+
+        L1Criterion           = sum of |state - state_desired| below a tolerance
+                                (the default, same test as before)
+        WeightedNormCriterion = weighted 1, 2 or inf norm of the error below a
+                                tolerance, e.g. to ignore z_dot or care more about x
+        ToleranceBoxCriterion = every state variable within its own tolerance
+
+    Any of them can also require the robot to stay within tolerance for several time
+    steps in a row (dwell), so a run doesn't end on a transient pass through the
+    desired state. E.g. to stop after a quarter of a second in tolerance:
+
+        bee.run_lqr(timesteps, convergence=L1Criterion(0.01, dwell=int(0.25 / bee.dt)))
+"""
+
+
+import numpy as np
+
+
+class ConvergenceCriterion(object):
+    """
+    Base class of the criteria: subclasses only define within(), the per time step
+    test, and this class counts how long it has held.
+    """
+
+    def __init__(self, dwell = 1):
+        """
+        ==== ARGUMENTS ====
+        dwell = number of consecutive time steps the state has to be within
+                tolerance for before it counts as converged
+        """
+        if dwell < 1:
+            raise ValueError("dwell must be at least 1 time step, not %r" % (dwell,))
+
+        self.dwell = dwell
+        self._count = 0
+
+
+    def reset(self):
+        """
+        Forgets the time spent within tolerance, called at the start of every run.
+        """
+        self._count = 0
+
+
+    def within(self, state, state_desired):
+        """
+        ==== ARGUMENTS ====
+        state         = (6,1) state of one robot, or (N,6) states of a batch
+        state_desired = desired state(s), same shape as state
+
+        ==== RETURNS ====
+        within = True if the state is within tolerance ((N,) bools for a batch)
+        """
+        raise NotImplementedError
+
+
+    def update(self, state, state_desired):
+        """
+        Tests this time step's state, see within().
+
+        ==== RETURNS ====
+        converged = True once the state has been within tolerance for dwell time
+                    steps in a row ((N,) bools for a batch)
+        """
+        inside = self.within(state, state_desired)
+        if self.dwell == 1:
+            return inside
+
+        if np.ndim(inside) == 0:
+            self._count = self._count + 1 if inside else 0
+        else:
+            self._count = np.where(inside, self._count + 1, 0)
+
+        return self._count >= self.dwell
+
+
+def _errors(state, state_desired):
+    # absolute errors with the state variables on the last axis
+    errors = np.abs(state - state_desired)
+    if errors.ndim == 2 and errors.shape[1] == 1:
+        return errors[:,0]
+    return errors
+
+
+class L1Criterion(ConvergenceCriterion):
+
+    def __init__(self, tolerance = 0.01, dwell = 1):
+        """
+        ==== ARGUMENTS ====
+        tolerance = largest sum of |state - state_desired| that counts as reached
+        dwell     = see ConvergenceCriterion
+        """
+        ConvergenceCriterion.__init__(self, dwell)
+        self.tolerance = tolerance
+
+
+    def within(self, state, state_desired):
+        if state.ndim == 2 and state.shape[1] == 1:
+            return np.abs(state - state_desired).sum() < self.tolerance
+        return np.abs(state - state_desired).sum(axis=-1) < self.tolerance
+
+
+class WeightedNormCriterion(ConvergenceCriterion):
+
+    def __init__(self, weights, tolerance = 0.01, order = 2, dwell = 1):
+        """
+        ==== ARGUMENTS ====
+        weights   = 6 doubles, the weight of each state variable's error (0 ignores it)
+        tolerance = largest norm that counts as reached
+        order     = 1, 2 or np.inf, which norm of the weighted error to take
+        dwell     = see ConvergenceCriterion
+        """
+        if order not in (1, 2, np.inf):
+            raise ValueError("order must be 1, 2 or np.inf, not %r" % (order,))
+
+        ConvergenceCriterion.__init__(self, dwell)
+        self.weights = np.asarray(weights, dtype=float).ravel()
+        self.tolerance = tolerance
+        self.order = order
+
+
+    def within(self, state, state_desired):
+        errors = _errors(state, state_desired)*self.weights
+
+        if self.order == 1:
+            norm = errors.sum(axis=-1)
+        elif self.order == 2:
+            # squared norm against squared tolerance, no square root needed
+            return np.einsum('...i,...i->...', errors, errors) < self.tolerance**2
+        else:
+            norm = errors.max(axis=-1)
+
+        return norm < self.tolerance
+
+
+class ToleranceBoxCriterion(ConvergenceCriterion):
+
+    def __init__(self, tolerances, dwell = 1):
+        """
+        ==== ARGUMENTS ====
+        tolerances = 6 doubles, largest |error| allowed for each state variable (inf
+                     ignores it)
+        dwell      = see ConvergenceCriterion
+        """
+        ConvergenceCriterion.__init__(self, dwell)
+        self.tolerances = np.asarray(tolerances, dtype=float).ravel()
+
+
+    def within(self, state, state_desired):
+        return (_errors(state, state_desired) <= self.tolerances).all(axis=-1)
@@ -0,0 +1,177 @@
+"""
+Description:
+    Generates neural network training data by running the LQR controller for many
+    setpoints and initial states in parallel.
+
+    Every (setpoint, initial state) pair is one task. Tasks are spread over a pool of
+    worker processes (one per core by default), each worker saves its trajectory as a
+    shard (an .npz file holding that run's 'input' and 'output' arrays, same as
+    run_lqr() returns) as soon as it finishes, and a manifest listing every shard is
+    written once all tasks are done. Each task gets its own seed spawned from the
+    dataset's seed, so a dataset can be regenerated exactly no matter how many workers
+    are used or what order the tasks finish in.
+
+    With sensor_table_points set, the runs read their sensors from a
+    LookupTableSensorModel of that many points (see sensor_model.py) instead of the
+    exact model, which is faster but off by up to the table's error_bound (saved in the
+    manifest).
+
+    Example (from a terminal):
+        python dataset_generation.py training_data --timesteps 1000 --x -2 2 5 --z 0 3 4
+"""
+
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from roboBee_class_PD_and_LQR import roboBee
+from sensor_model import LookupTableSensorModel
+
+# Standard deviations of the random offsets added to the initial state
+# (theta, theta_dot, x, x_dot, z, z_dot)
+INITIAL_STATE_STD = (0.01, 0.0, 0.5, 0.0, 0.5, 0.0)
+
+
+# tables already built in this process, by number of points
+_sensor_tables = {}
+
+
+def _sensor_table(points):
+    if points not in _sensor_tables:
+        _sensor_tables[points] = LookupTableSensorModel(points=points)
+    return _sensor_tables[points]
+
+
+def _shard_path(out_dir, index):
+    return os.path.join(out_dir, "shard_%06d.npz" % index)
+
+
+def _simulate_task(task):
+    """
+    Runs one task in a worker process and writes its shard. Plots and printing are
+    turned off since nobody would see them.
+    """
+    rng = np.random.default_rng(task['seed'])
+    initial_state = rng.normal(0.0, task['initial_state_std'])
+
+    state_desired = np.zeros(6)
+    state_desired[2] = task['x']
+    state_desired[4] = task['z']
+
+    bee = roboBee()
+    if task['sensor_table_points'] is not None:
+        bee.sensor_model = _sensor_table(task['sensor_table_points'])
+    input, output = bee.run_lqr(task['timesteps'], verbose=False, plots=False, quiet=True,
+                                state_desired=state_desired, initial_state=initial_state)
+
+    # write to a temporary file first, so a crash can't leave a half written shard
+    path = _shard_path(task['out_dir'], task['index'])
+    temp_path = path[:-len(".npz")] + ".tmp.npz"
+    np.savez(temp_path, input=input, output=output, state_desired=state_desired,
+             initial_state=initial_state)
+    os.replace(temp_path, path)
+
+    return task['index'], path, input.shape[0]
+
+
+def generate_dataset(out_dir, setpoints, timesteps = 1000, runs_per_setpoint = 1, seed = 0,
+                     max_workers = None, initial_state_std = INITIAL_STATE_STD, sensor_table_points = None):
+    """
+    ==== ARGUMENTS ====
+    out_dir           = directory the shards and manifest are written to
+    setpoints         = iterable of (x, z) positions for the robot to fly to
+    timesteps         = maximum number of time steps of each run (see run_lqr())
+    runs_per_setpoint = number of random initial states simulated for each setpoint
+    seed              = seed the per-task seeds are spawned from
+    max_workers       = number of worker processes, defaults to the number of cores
+    initial_state_std = standard deviations of the random initial state (6 doubles)
+    sensor_table_points = number of points of the sensor lookup table the runs use,
+                          None (default) for the exact sensor model
+
+    ==== RETURNS ====
+    manifest = dictionary describing the dataset (also saved to manifest.json), with
+               one entry per shard giving its task's setpoint, seed (spawn key of
+               np.random.SeedSequence(seed)) and length
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    tasks = []
+    for x, z in setpoints:
+        for run in range(runs_per_setpoint):
+            tasks.append({ 'index': len(tasks), 'x': float(x), 'z': float(z),
+                           'timesteps': timesteps, 'out_dir': out_dir,
+                           'initial_state_std': list(initial_state_std),
+                           'sensor_table_points': sensor_table_points })
+
+    # independent random streams for every task, no matter which worker runs it
+    for task, task_seed in zip(tasks, np.random.SeedSequence(seed).spawn(len(tasks))):
+        task['seed'] = task_seed
+
+    shards = [None] * len(tasks)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [ pool.submit(_simulate_task, task) for task in tasks ]
+
+        for future in as_completed(futures):
+            index, path, steps = future.result()
+            task = tasks[index]
+            shards[index] = { 'file': os.path.basename(path), 'x': task['x'], 'z': task['z'],
+                              'spawn_key': list(task['seed'].spawn_key), 'timesteps': steps }
+
+    manifest = { 'seed': seed, 'timesteps': timesteps, 'runs_per_setpoint': runs_per_setpoint,
+                 'initial_state_std': list(initial_state_std), 'shards': shards }
+    if sensor_table_points is not None:
+        manifest['sensor_table'] = { 'points': sensor_table_points,
+                                     'error_bound': _sensor_table(sensor_table_points).error_bound }
+
+    with open(os.path.join(out_dir, "manifest.json"), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return manifest
+
+
+def load_dataset(out_dir):
+    """
+    Loads every shard listed in a dataset's manifest and stacks them.
+
+    ==== RETURNS ====
+    input  = state data of every run, one row per time step (see run_lqr())
+    output = torques generated at each of those time steps
+    """
+    with open(os.path.join(out_dir, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    inputs = []
+    outputs = []
+    for shard in manifest['shards']:
+        with np.load(os.path.join(out_dir, shard['file'])) as data:
+            inputs.append(data['input'])
+            outputs.append(data['output'])
+
+    return np.concatenate(inputs), np.concatenate(outputs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate LQR training data for the neural network")
+    parser.add_argument("out_dir")
+    parser.add_argument("--timesteps", type=int, default=1000)
+    parser.add_argument("--x", type=float, nargs=3, default=[-2, 2, 5], metavar=("MIN", "MAX", "N"),
+                        help="grid of desired x positions")
+    parser.add_argument("--z", type=float, nargs=3, default=[0, 3, 4], metavar=("MIN", "MAX", "N"),
+                        help="grid of desired z positions")
+    parser.add_argument("--runs-per-setpoint", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sensor-table", type=int, default=None, metavar="POINTS",
+                        help="read the sensors from a lookup table of this many points")
+    args = parser.parse_args()
+
+    x_values = np.linspace(args.x[0], args.x[1], int(args.x[2]))
+    z_values = np.linspace(args.z[0], args.z[1], int(args.z[2]))
+    setpoints = [ (x, z) for x in x_values for z in z_values ]
+
+    manifest = generate_dataset(args.out_dir, setpoints, args.timesteps, args.runs_per_setpoint,
+                                args.seed, args.workers, sensor_table_points=args.sensor_table)
+    print("Wrote", len(manifest['shards']), "shards to", args.out_dir)
@@ -0,0 +1,89 @@
+"""
+Description:
+    Gain-scheduled LQR for the roboBee's lateral controller.
+
+    A[3,0] of the lateral plant is g*LIFT_COEFFICIENT, and the altitude controller
+    moves the lift coefficient between 0.5 and 1.5 while the robot flies. run_lqr()
+    normally solves for the gains once, at whatever lift the run starts with. A
+    GainSchedule instead solves the LQR on a grid of lift coefficients up front, and
+    then looks up (and linearly interpolates) the gains for the current lift at every
+    time step, so there is no Riccati equation to solve while the simulation runs.
+"""
+
+
+import numpy as np
+
+class GainSchedule(object):
+
+    def __init__(self, bee, lift_min = 0.5, lift_max = 1.5, points = 41, interpolate = True):
+        """
+        ==== ARGUMENTS ====
+        bee         = roboBee instance whose constants (and Q and R weights) the
+                      gains are computed for
+        lift_min    = smallest lift coefficient in the table (altitude controller's
+                      lower limit)
+        lift_max    = largest lift coefficient in the table (upper limit)
+        points      = number of lift coefficients the LQR is solved for
+        interpolate = if true, gains are linearly interpolated between grid points,
+                      otherwise the gains of the nearest grid point are used
+        """
+        if points < 2 or not lift_max > lift_min:
+            raise ValueError("the table needs at least 2 points and lift_max > lift_min")
+
+        self.lifts = np.linspace(lift_min, lift_max, points)
+        self.interpolate = interpolate
+
+        self.table = np.array([ np.asarray(bee.LQR_gains(lift)).reshape(4) for lift in self.lifts ])
+        # change in gains between neighbouring grid points, for interpolating
+        self._slopes = np.diff(self.table, axis=0)
+
+        self._lift_min = float(lift_min)
+        self._spacing = (lift_max - lift_min) / (points - 1)
+        self._last_index = points - 1
+
+
+    def gains_at(self, lift):
+        """
+        ==== ARGUMENTS ====
+        lift = current lift coefficient, either a scalar or an (N,) array (one per robot).
+               Values outside of the table are clamped to its edges
+
+        ==== RETURNS ====
+        gains = (1,4) gain matrix for a scalar lift (same shape LQR_gains() returns),
+                (N,4) array of gains for an (N,) array of lifts
+        """
+        # the grid is evenly spaced, so the index comes straight from the lift value
+        if np.ndim(lift) == 0:
+            # plain float math for the one robot case, this is called every time step
+            position = min(max((float(lift) - self._lift_min) / self._spacing, 0.0), self._last_index)
+            if not self.interpolate:
+                return self.table[int(round(position))].reshape(1,4)
+
+            lower = min(int(position), self._last_index - 1)
+            return (self.table[lower] + (position - lower) * self._slopes[lower]).reshape(1,4)
+
+        position = np.clip((np.asarray(lift, dtype=float) - self._lift_min) / self._spacing,
+                           0, self._last_index)
+
+        if not self.interpolate:
+            gains = self.table[np.rint(position).astype(int)]
+        else:
+            lower = np.minimum(position.astype(int), self._last_index - 1)
+            fraction = (position - lower)[..., None]
+            gains = self.table[lower] + fraction * self._slopes[lower]
+
+        return gains
+
+
+    def interpolation_error(self, bee):
+        """
+        Largest relative error of the scheduled gains compared to solving the LQR
+        exactly, checked halfway between every pair of grid points (where the error
+        of the interpolation is largest).
+        """
+        midpoints = 0.5 * (self.lifts[1:] + self.lifts[:-1])
+        exact = np.array([ np.asarray(bee.LQR_gains(lift)).reshape(4) for lift in midpoints ])
+        scheduled = self.gains_at(midpoints)
+
+        # tiny keeps a gain that is exactly zero from dividing by zero
+        return np.max(np.abs(scheduled - exact) / np.maximum(np.abs(exact), np.finfo(float).tiny))
@@ -0,0 +1,189 @@
+"""
+Description:
+    ODE integrators for the nonlinear plant (see nonlinear_plant.py).
+
+    All of them integrate autonomous systems y_dot = f(y, *args), where args holds whatever
+    is constant over the interval being integrated (e.g. the torque and lift the
+    controller chose for this time step):
+
+        euler_step()    = one forward Euler step, what the linearized simulation uses
+        rk4_step()      = one classic fixed step 4th order Runge-Kutta step
+        DormandPrince45 = adaptive 5(4) Runge-Kutta (the same method as MATLAB's ode45
+                          and scipy's RK45) with dense output, which keeps its step
+                          size from one call to the next so a simulation that calls it
+                          once per control step doesn't restart from tiny steps
+"""
+
+
+import numpy as np
+
+
+def interpolate(times, states, sample_times):
+    """
+    Linearly interpolates states recorded at increasing times (e.g. the ends of fixed
+    substeps) at sample_times, for all states at once.
+
+    ==== ARGUMENTS ====
+    times        = (n,) times the states were recorded at
+    states       = (n,...) recorded states
+    sample_times = (k,) times within [times[0], times[-1]]
+
+    ==== RETURNS ====
+    samples = (k,...) interpolated states
+    """
+    sample_times = np.asarray(sample_times, dtype=float)
+    index = np.clip(np.searchsorted(times, sample_times, side='right') - 1, 0, len(times) - 2)
+    weight = (sample_times - times[index]) / (times[index + 1] - times[index])
+    weight = weight.reshape(weight.shape + (1,)*(states.ndim - 1))
+
+    return (1 - weight)*states[index] + weight*states[index + 1]
+
+
+def euler_step(f, y, h, args = ()):
+    return y + h*f(y, *args)
+
+
+def rk4_step(f, y, h, args = ()):
+    """
+    ==== ARGUMENTS ====
+    f    = derivative function, called as f(y, *args)
+    y    = state at the start of the step (1D numpy array)
+    h    = step size [seconds]
+    args = extra arguments passed on to f
+
+    ==== RETURNS ====
+    y_new = state at the end of the step
+    """
+    k1 = f(y, *args)
+    k2 = f(y + 0.5*h*k1, *args)
+    k3 = f(y + 0.5*h*k2, *args)
+    k4 = f(y + h*k3, *args)
+
+    return y + (h/6.0)*(k1 + 2*k2 + 2*k3 + k4)
+
+
+class DormandPrince45(object):
+
+    # Butcher tableau
+    C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1])
+    A = [ np.array([]),
+          np.array([1/5]),
+          np.array([3/40, 9/40]),
+          np.array([44/45, -56/15, 32/9]),
+          np.array([19372/6561, -25360/2187, 64448/6561, -212/729]),
+          np.array([9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]) ]
+    B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+    # difference between the 5th and 4th order solutions, for the error estimate
+    E = np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+    # coefficients of the 4th order interpolant used for dense output
+    P = np.array([
+        [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+        [0, 0, 0, 0],
+        [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+        [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+        [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+        [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+        [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]])
+
+    SAFETY = 0.9
+    MIN_FACTOR = 0.2
+    MAX_FACTOR = 10.0
+
+
+    def __init__(self, f, rtol = 1e-6, atol = 1e-9, max_step = np.inf):
+        """
+        ==== ARGUMENTS ====
+        f        = derivative function, called as f(y, *args)
+        rtol     = relative error tolerance of each step
+        atol     = absolute error tolerance of each step (scalar or one per state)
+        max_step = largest step size the integrator may take [seconds]
+        """
+        self.f = f
+        self.rtol = rtol
+        self.atol = atol
+        self.max_step = max_step
+
+        self.h = None #step size, carried over between calls to integrate()
+        self.n_evaluations = 0
+        self.n_accepted = 0
+        self.n_rejected = 0
+
+
+    def _initial_step(self, y, f0, duration):
+        scale = self.atol + self.rtol*np.abs(y)
+        d0 = np.sqrt(np.mean((y / scale)**2))
+        d1 = np.sqrt(np.mean((f0 / scale)**2))
+        h = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01*d0 / d1
+
+        return min(h, duration, self.max_step)
+
+
+    def integrate(self, y0, duration, args = (), sample_times = None):
+        """
+        ==== ARGUMENTS ====
+        y0           = state at the start of the interval (1D numpy array)
+        duration     = length of the interval to integrate over [seconds]
+        args         = extra arguments passed on to f, constant over the interval
+        sample_times = optional increasing times within (0, duration] at which to also
+                       return the state, interpolated from the steps taken (dense output)
+                       instead of forcing extra steps at each of them
+
+        ==== RETURNS ====
+        y1      = state at the end of the interval
+        samples = (len(sample_times), len(y0)) states at sample_times, or None
+        """
+        f = self.f
+        y = np.asarray(y0, dtype=float)
+        K = np.empty((7, y.size))
+        K[0] = f(y, *args)
+        self.n_evaluations += 1
+
+        samples = None
+        if sample_times is not None:
+            sample_times = np.asarray(sample_times, dtype=float)
+            samples = np.empty((sample_times.size, y.size))
+        next_sample = 0
+
+        if self.h is None:
+            self.h = self._initial_step(y, K[0], duration)
+
+        t = 0.0
+        while t < duration:
+            h = min(self.h, self.max_step)
+            last_step = t + h >= duration
+            if last_step:
+                h = duration - t
+
+            for stage in range(1, 6):
+                K[stage] = f(y + h*K[:stage].T.dot(self.A[stage]), *args)
+            y_new = y + h*K[:6].T.dot(self.B)
+            K[6] = f(y_new, *args)
+            self.n_evaluations += 6
+
+            scale = self.atol + self.rtol*np.maximum(np.abs(y), np.abs(y_new))
+            error = np.sqrt(np.mean((h*K.T.dot(self.E) / scale)**2))
+
+            if error > 1:
+                self.h = h*max(self.MIN_FACTOR, self.SAFETY*error**-0.2)
+                self.n_rejected += 1
+                continue
+
+            # dense output for every sample time inside this step
+            while samples is not None and next_sample < sample_times.size and \
+                    (sample_times[next_sample] <= t + h or last_step):
+                theta = (sample_times[next_sample] - t) / h
+                samples[next_sample] = y + h*K.T.dot(self.P.dot([theta, theta**2, theta**3, theta**4]))
+                next_sample += 1
+
+            # a step cut short to land on the end of the interval says nothing about
+            # the step size the error allows, so it doesn't set the next one
+            factor = self.MAX_FACTOR if error == 0 else min(self.MAX_FACTOR, self.SAFETY*error**-0.2)
+            if not last_step or h >= self.h:
+                self.h = h*factor
+
+            t = duration if last_step else t + h
+            y = y_new
+            K[0] = K[6]
+            self.n_accepted += 1
+
+        return y, samples
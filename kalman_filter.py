@@ -0,0 +1,339 @@
+"""
+Description:
+    Kalman filter state estimators for the roboBee's lateral (theta, theta_dot, x,
+    x_dot) states, to use instead of the finite difference observer behind
+    getAngularVel() (observer.py), which only differences two consecutive sensor
+    readings and trusts them completely.
+
+    The filter predicts the lateral state with the same linearized model the LQR is
+    designed on (stepped like updateState_LQR_Control(), with torque_gen, the
+    angular acceleration the LQR commands, as its input), and corrects it with every
+    time step's four sensor readings and the robot's x position (the light only tells
+    the robot which way it's tilted, so without the position x and x_dot couldn't be
+    estimated at all). Sensor noise and the accelerations the model misses are
+    weighed against each other by MEASUREMENT_NOISE and PROCESS_NOISE.
+
+    By default the sensor map is linearized about hovering upright, and the filter
+    uses its steady state gain. The model's only changing term is the altitude
+    controller's lift coefficient, so like GainSchedule the gains are solved for a
+    grid of lift coefficients up front (and cached, see PlantCache.kalman_gain()) and
+    interpolated, so each update is only a few small matrix-vector products. With
+    extended=True it's an extended Kalman filter instead, which linearizes the sensor
+    model (any of them, e.g. the lights in light_sources.py) about the current
+    estimate every update and keeps track of the estimate's covariance.
+
+    A KalmanFilter can take the place of a robot's observer:
+        bee.observer = KalmanFilter(bee)
+        bee.run_lqr(timesteps)
+    and a BatchKalmanFilter estimates a whole batch of robots at once (see
+    run_lqr_batch()'s estimator argument).
+"""
+
+
+import numpy as np
+
+# standard deviations of the angular acceleration [rad/s^2] and x acceleration
+# [m/s^2] the model doesn't account for
+PROCESS_NOISE = (50.0, 1.0)
+# standard deviations of each sensor reading and of the measured x position [m]
+MEASUREMENT_NOISE = (1.0, 0.001)
+
+
+class _LateralKalmanFilter(object):
+    """
+    Model, noise and gains shared by KalmanFilter and BatchKalmanFilter.
+    """
+
+    def __init__(self, bee, extended = False, process_noise = PROCESS_NOISE, measurement_noise = MEASUREMENT_NOISE,
+                 lift_min = 0.5, lift_max = 1.5, points = 21):
+        """
+        ==== ARGUMENTS ====
+        bee               = roboBee whose constants, time step and sensor_model the
+                            filter uses
+        extended          = if true, an extended Kalman filter (see the module
+                            description), otherwise the steady state linear filter
+        process_noise     = (theta_ddot, x_ddot) standard deviations, see PROCESS_NOISE
+        measurement_noise = (sensor reading, x) standard deviations, see MEASUREMENT_NOISE
+        lift_min, lift_max, points = grid of lift coefficients the steady state gains
+                            are solved for (the altitude controller keeps the lift
+                            between 0.5 and 1.5)
+        """
+        if points < 2 or not lift_max > lift_min:
+            raise ValueError("the gain grid needs at least 2 points and lift_max > lift_min")
+
+        self.bee = bee
+        self.extended = extended
+        self.dt = dt = bee.dt
+        self.sensor_model = bee.sensor_model
+
+        # lateral model without the lift dependent F[3,0] term, which is added for the
+        # current lift every update. theta_ddot is the input, so its row holds nothing
+        # but theta_dot itself
+        A, B = bee.plant_cache.lateral_plant(bee.g, None, bee.B_w, bee.MASS, bee.Rw, bee.Jz)
+        self.F = np.identity(4) + dt*A
+        self.F[1] = [0, 1, 0, 0]
+        self._lift_term = dt*bee.g
+
+        # the unmodelled accelerations are constant over each time step
+        theta_ddot_std, x_ddot_std = process_noise
+        noise_input = np.array([ [dt*dt/2, 0], [dt, 0], [0, dt*dt/2], [0, dt] ])
+        self.W = noise_input.dot(np.diag([theta_ddot_std**2, x_ddot_std**2])).dot(noise_input.T)
+
+        reading_std, x_std = measurement_noise
+        self.V = np.diag([reading_std**2]*4 + [x_std**2])
+
+        # measurements (4 readings, x) linearized about hovering upright at the origin
+        readings, H = self._measurement(np.zeros(1), np.zeros(1), np.zeros(1))
+        self.H = H[0]
+        self._offset = readings[0]
+
+        # steady state gains on a grid of lift coefficients, for interpolating
+        self.lifts = np.linspace(lift_min, lift_max, points)
+        solutions = [ bee.plant_cache.kalman_gain(bee.g, lift, bee.B_w, bee.MASS, bee.Rw, bee.Jz, dt,
+                                                  self.H, self.W, self.V)
+                      for lift in self.lifts ]
+        self.gains = np.array([ gain for gain, covariance in solutions ])
+        self._slopes = np.diff(self.gains, axis=0)
+        self._covariances = np.array([ covariance for gain, covariance in solutions ])
+
+        self._lift_min = float(lift_min)
+        self._spacing = (lift_max - lift_min) / (points - 1)
+        self._last_index = points - 1
+
+
+    def _position(self, lift):
+        # (clamped) position of lift(s) on the grid, and the grid point below
+        position = np.clip((np.asarray(lift, dtype=float) - self._lift_min) / self._spacing, 0, self._last_index)
+        lower = np.minimum(position.astype(int), self._last_index - 1)
+        return position, lower
+
+
+    def gains_at(self, lift):
+        """
+        ==== ARGUMENTS ====
+        lift = lift coefficient, scalar or (N,) array
+
+        ==== RETURNS ====
+        gains = (4,5) steady state gain ((N,4,5) for an array of lifts), linearly
+                interpolated between the grid points
+        """
+        position, lower = self._position(lift)
+        return self.gains[lower] + (position - lower)[..., None, None] * self._slopes[lower]
+
+
+    def steady_state_covariance(self, lift):
+        """
+        ==== RETURNS ====
+        covariance = (4,4) covariance of the steady state filter's estimate at the
+                     grid point nearest lift, also where the extended filter starts
+        """
+        position, lower = self._position(lift)
+        return self._covariances[np.rint(position).astype(int)].copy()
+
+
+    def _measurement(self, theta, x, z):
+        """
+        ==== ARGUMENTS ====
+        theta, x, z = (N,) angles and positions of the robots
+
+        ==== RETURNS ====
+        measurements = (N,5) predicted sensor readings and x of each robot
+        H            = (N,5,4) their derivatives with respect to the lateral state
+        """
+        n_bees = theta.shape[0]
+        step = 1e-6
+
+        # the sensor model at theta and x, then a step either way in each, in one call
+        thetas = np.stack([ theta, theta + step, theta - step, theta, theta ])
+        positions = np.empty((5, n_bees, 2))
+        positions[:,:,0] = x
+        positions[:,:,1] = z
+        positions[3,:,0] += step
+        positions[4,:,0] -= step
+        readings = self.sensor_model.readings(thetas, positions)
+
+        measurements = np.empty((n_bees, 5))
+        measurements[:,:4] = readings[0]
+        measurements[:,4] = x
+
+        H = np.zeros((n_bees, 5, 4))
+        H[:,:4,0] = (readings[1] - readings[2]) / (2*step)
+        H[:,:4,2] = (readings[3] - readings[4]) / (2*step)
+        H[:,4,2] = 1.0
+
+        return measurements, H
+
+
+    def _predict(self, estimates, torque_gen, lift):
+        # (N,4) estimates one time step ahead, see updateState_LQR_Control()
+        predicted = estimates.dot(self.F.T)
+        predicted[:,3] += self._lift_term*lift*estimates[:,0]
+        predicted[:,1] += self.dt*torque_gen
+        return predicted
+
+
+    def _correct(self, predicted, measurements, z, lift):
+        # (N,4) predictions corrected with the (N,5) measurements
+        if not self.extended:
+            innovation = measurements - predicted.dot(self.H.T) - self._offset
+            return predicted + np.einsum('nij,nj->ni', self.gains_at(lift), innovation)
+
+        F = np.broadcast_to(self.F, self.covariances.shape).copy()
+        F[:,3,0] += self._lift_term*lift
+        prediction_covariances = np.matmul(np.matmul(F, self.covariances), F.transpose(0,2,1)) + self.W
+
+        expected, H = self._measurement(predicted[:,0], predicted[:,2], z)
+        HP = np.matmul(H, prediction_covariances)
+        S = np.matmul(HP, H.transpose(0,2,1)) + self.V
+        gains = np.linalg.solve(S, HP).transpose(0,2,1)
+
+        # Joseph form, (I - K*H)*P*(I - K*H)' + K*V*K', then symmetrized: the short
+        # form P - K*H*P loses positive definiteness to rounding within a few
+        # thousand steps once the readings are strongly nonlinear (e.g. lights)
+        I_KH = np.identity(4) - np.matmul(gains, H)
+        covariances = (np.matmul(np.matmul(I_KH, prediction_covariances), I_KH.transpose(0,2,1))
+                       + np.matmul(np.matmul(gains, self.V), gains.transpose(0,2,1)))
+        self.covariances = 0.5*(covariances + covariances.transpose(0,2,1))
+        return predicted + np.einsum('nij,nj->ni', gains, measurements - expected)
+
+
+class KalmanFilter(_LateralKalmanFilter):
+    """
+    Kalman filter for one robot, with the same interface as AngularVelocityObserver.
+    """
+
+    def __init__(self, bee, extended = False, process_noise = PROCESS_NOISE, measurement_noise = MEASUREMENT_NOISE,
+                 lift_min = 0.5, lift_max = 1.5, points = 21, log_hook = None):
+        """
+        ==== ARGUMENTS ====
+        bee, extended, process_noise, measurement_noise, lift_min, lift_max, points =
+            see _LateralKalmanFilter
+        log_hook = optional function called with every new estimate, e.g. print
+        """
+        _LateralKalmanFilter.__init__(self, bee, extended, process_noise, measurement_noise,
+                                      lift_min, lift_max, points)
+        self.log_hook = log_hook
+
+        self.last_sensor_readings = np.zeros((4,1))
+        self.angular_vel_estimates = np.zeros((2,1))
+        self._measurements = np.zeros(5)
+        self.reset()
+
+
+    def reset(self, state = None):
+        """
+        Starts the estimate over (e.g. before starting a new run).
+
+        ==== ARGUMENTS ====
+        state = the robot's state (see updateState_LQR_Control()) if it's known,
+                defaults to zeros
+        """
+        self.estimate = np.zeros(4)
+        if state is not None:
+            self.estimate[:] = np.asarray(state, dtype=float).ravel()[:4]
+        self.covariances = self.steady_state_covariance(self.bee.LIFT_COEFFICIENT)[None]
+
+        self.last_sensor_readings[...] = 0.0
+        self.angular_vel_estimates[...] = 0.0
+
+
+    def update(self, new_readings, torque_gen, position = None):
+        """
+        ==== ARGUMENTS ====
+        new_readings = (4,1) sensor readings of the current time step
+        torque_gen   = torque generated during the last time step
+        position     = the robot's current (x, z) position
+
+        ==== RETURNS ====
+        angular_vel_estimates = (2,1) estimated angular velocities about Y and X axes,
+                                like AngularVelocityObserver.update() (the filter only
+                                estimates the first, the whole lateral state is in
+                                self.estimate). Overwritten by the next update
+        """
+        if position is None:
+            raise ValueError("the Kalman filter needs the robot's (x, z) position, see getAngularVel()")
+        lift = float(self.bee.LIFT_COEFFICIENT)
+
+        measurements = self._measurements
+        measurements[:4] = new_readings[:,0]
+        measurements[4] = position[0]
+
+        if self.extended:
+            predicted = self._predict(self.estimate[None], torque_gen, lift)
+            self.estimate = self._correct(predicted, measurements[None], np.array([position[1]]), lift)[0]
+        else:
+            # the same math as _predict(), _correct() and gains_at(), written for one
+            # robot since this is called every time step
+            estimate = self.estimate
+            predicted = self.F.dot(estimate)
+            predicted[3] += self._lift_term*lift*estimate[0]
+            predicted[1] += self.dt*torque_gen
+
+            grid_position = min(max((lift - self._lift_min) / self._spacing, 0.0), self._last_index)
+            lower = min(int(grid_position), self._last_index - 1)
+            gain = self.gains[lower] + (grid_position - lower)*self._slopes[lower]
+
+            measurements -= self._offset
+            measurements -= self.H.dot(predicted)
+            self.estimate = predicted + gain.dot(measurements)
+
+        self.last_sensor_readings[...] = new_readings
+        self.angular_vel_estimates[0,0] = self.estimate[1]
+
+        if self.log_hook is not None:
+            self.log_hook(self.angular_vel_estimates)
+
+        return self.angular_vel_estimates
+
+
+class BatchKalmanFilter(_LateralKalmanFilter):
+    """
+    Kalman filters for N robots with the same constants, updated together.
+    """
+
+    def __init__(self, bee, n_bees, extended = False, process_noise = PROCESS_NOISE,
+                 measurement_noise = MEASUREMENT_NOISE, lift_min = 0.5, lift_max = 1.5, points = 21):
+        """
+        ==== ARGUMENTS ====
+        bee, extended, process_noise, measurement_noise, lift_min, lift_max, points =
+            see _LateralKalmanFilter
+        n_bees = number of robots
+        """
+        _LateralKalmanFilter.__init__(self, bee, extended, process_noise, measurement_noise,
+                                      lift_min, lift_max, points)
+        self.n_bees = n_bees
+        self.reset()
+
+
+    def reset(self, states = None):
+        """
+        ==== ARGUMENTS ====
+        states = (N,6) states of the robots if they're known, defaults to zeros
+        """
+        self.estimates = np.zeros((self.n_bees, 4))
+        if states is not None:
+            self.estimates[:] = np.asarray(states, dtype=float).reshape(self.n_bees, -1)[:,:4]
+        self.covariances = np.repeat(self.steady_state_covariance(self.bee.LIFT_COEFFICIENT)[None],
+                                     self.n_bees, axis=0)
+
+
+    def update(self, new_readings, torque_gen, positions, lifts):
+        """
+        ==== ARGUMENTS ====
+        new_readings = (N,4) sensor readings of the current time step
+        torque_gen   = (N,) torque each robot generated during the last time step
+        positions    = (N,2) each robot's current (x, z) position
+        lifts        = (N,) lift coefficient of each robot
+
+        ==== RETURNS ====
+        estimates = (N,4) estimated lateral state of every robot (theta, theta_dot,
+                    x, x_dot)
+        """
+        measurements = np.empty((self.n_bees, 5))
+        measurements[:,:4] = new_readings
+        measurements[:,4] = positions[:,0]
+
+        predicted = self._predict(self.estimates, torque_gen, lifts)
+        self.estimates = self._correct(predicted, measurements, positions[:,1], lifts)
+
+        return self.estimates
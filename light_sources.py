@@ -0,0 +1,222 @@
+"""
+Description:
+    Sensor model with real light sources: any number of point or area lights at a
+    finite distance from the robot, instead of SensorModel's single light infinitely
+    far away (the archived roboBee_class.py placed its light at light_source_loc and
+    pointed the sensors at it from the robot's position, this brings that back).
+
+    Each of the four ocelli (normals INITIAL_SENSOR_ORIENTATIONS, rotated with the
+    robot) reads the illuminance on its face [lux]: every light contributes
+        intensity * cos(angle between sensor normal and light) / distance^2
+    and nothing once the light is behind the sensor face. A point light has the same
+    intensity in every direction (output / (4*pi) candela). An area light is a flat
+    square split into samples x samples patches, each a Lambertian emitter whose
+    intensity also falls with the cosine of the angle from the light's normal, so only
+    its front side lights anything.
+
+    Everything is done with array operations over the sensors and lights, for any
+    number of robot poses at once (e.g. (N,T) for N robots over T time steps), so
+    whole batches of trajectories are lit in one call:
+        model = LightingModel([ PointLight((0.0, 3.0, 0.0)), AreaLight((2.0, 4.0, 0.0), (0, -1, 0), 0.5) ])
+        readings = model.readings(thetas, positions)    # thetas (N,T), positions (N,T,2)
+
+    Positions here are in the LQR's coordinates (x, altitude), which are the global x
+    and y (up) axes (see nonlinear_plant.py); illuminance() takes full 3D positions and
+    sensor normals. A LightingModel can also be used as a robot's sensor_model, the
+    simulators pass it the robot's position every time step. Note that getAngularVel()
+    was derived for SensorModel's readings, which are proportional to the angle to the
+    light, so its angular velocity estimates are only approximate with these.
+"""
+
+
+import numpy as np
+
+from analytical_model import INITIAL_SENSOR_ORIENTATIONS
+
+
+class PointLight(object):
+
+    def __init__(self, position, output = 850):
+        """
+        ==== ARGUMENTS ====
+        position = (x,y,z) location of the light [m], y is up
+        output   = light output [lumens], spread evenly in every direction
+        """
+        self.position = np.array(position, dtype=float)
+        self.output = output
+
+
+    def emitters(self):
+        """
+        ==== RETURNS ====
+        positions   = (1,3) location of the light
+        intensities = (1,) luminous intensity [candela]
+        normals     = (1,3) zeros, the light shines the same in every direction
+        """
+        return self.position.reshape(1,3), np.array([self.output / (4*np.pi)]), np.zeros((1,3))
+
+
+class AreaLight(object):
+
+    def __init__(self, center, normal, size, output = 850, samples = 4):
+        """
+        ==== ARGUMENTS ====
+        center  = (x,y,z) location of the middle of the light [m]
+        normal  = direction the light faces
+        size    = length of the square light's sides [m]
+        output  = light output [lumens], all of it in front of the light
+        samples = the light is split into samples x samples patches, more is more
+                  accurate for robots close to the light
+        """
+        self.center = np.array(center, dtype=float)
+        self.normal = np.array(normal, dtype=float) / np.linalg.norm(normal)
+        self.size = size
+        self.output = output
+        self.samples = samples
+
+
+    def emitters(self):
+        """
+        ==== RETURNS ====
+        positions   = (samples^2,3) middles of the patches
+        intensities = (samples^2,) luminous intensity of each patch straight ahead
+                      [candela], a Lambertian emitter puts out pi times that
+        normals     = (samples^2,3) the light's normal, for every patch
+        """
+        # two directions along the light's face
+        helper = np.array([1.0, 0.0, 0.0]) if abs(self.normal[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+        u = np.cross(self.normal, helper)
+        u /= np.linalg.norm(u)
+        v = np.cross(self.normal, u)
+
+        offsets = self.size * ((np.arange(self.samples) + 0.5) / self.samples - 0.5)
+        a, b = np.meshgrid(offsets, offsets, indexing='ij')
+        positions = self.center + a.reshape(-1,1)*u + b.reshape(-1,1)*v
+
+        patches = self.samples**2
+        intensities = np.full(patches, self.output / (np.pi * patches))
+
+        return positions, intensities, np.tile(self.normal, (patches, 1))
+
+
+class LightingModel(object):
+
+    # robot poses lit at a time by illuminance()
+    CHUNK_SIZE = 1024
+
+    def __init__(self, lights, sensor_orientations = INITIAL_SENSOR_ORIENTATIONS):
+        """
+        ==== ARGUMENTS ====
+        lights              = list of PointLight and AreaLight
+        sensor_orientations = (4,3) vectors normal to each sensor face when the robot
+                              points straight up
+        """
+        self.lights = list(lights)
+        self.sensor_orientations = np.array(sensor_orientations, dtype=float)
+        self.sensor_orientations /= np.linalg.norm(self.sensor_orientations, axis=1, keepdims=True)
+
+        # every light's emitters in one set of arrays, (E,3), (E,) and (E,3)
+        positions, intensities, normals = zip(*[ light.emitters() for light in self.lights ])
+        self.emitter_positions = np.concatenate(positions)
+        self.emitter_intensities = np.concatenate(intensities)
+        self.emitter_normals = np.concatenate(normals)
+        self._lambertian = np.any(self.emitter_normals != 0, axis=1)
+
+        # terms of the products with the vectors to the emitters that only depend on
+        # the emitters, see _illuminance()
+        self._emitter_norms_squared = np.einsum('ec,ec->e', self.emitter_positions, self.emitter_positions)
+        self._emitter_offsets = np.einsum('ec,ec->e', self.emitter_positions, self.emitter_normals)
+
+
+    def sensor_normals(self, theta):
+        """
+        ==== ARGUMENTS ====
+        theta = angle(s) of rotation of robot body relative to pointing straight up,
+                any shape
+
+        ==== RETURNS ====
+        normals = vectors normal to each sensor face, shape theta.shape + (4,3)
+        """
+        # rotation about the global -z axis by theta, see NonlinearPlant.set_lqr_state()
+        theta = np.asarray(theta, dtype=float)[..., None]
+        cos, sin = np.cos(theta), np.sin(theta)
+        x, y, z = self.sensor_orientations.T
+
+        return np.stack([ cos*x + sin*y, cos*y - sin*x, np.broadcast_to(z, cos.shape[:-1] + (4,)) ], axis=-1)
+
+
+    def illuminance(self, positions, sensor_normals):
+        """
+        ==== ARGUMENTS ====
+        positions      = (...,3) locations of the robot [m]
+        sensor_normals = (...,4,3) vectors normal to each sensor face (unit length),
+                         e.g. from sensor_normals() or AnalyticalModel
+
+        ==== RETURNS ====
+        illuminance = (...,4) light falling on each sensor face [lux]
+        """
+        positions = np.asarray(positions, dtype=float)
+        shape = np.broadcast_shapes(positions.shape[:-1], sensor_normals.shape[:-2])
+        if positions.shape[:-1] != shape:
+            positions = np.broadcast_to(positions, shape + (3,))
+        if sensor_normals.shape[:-2] != shape:
+            sensor_normals = np.broadcast_to(sensor_normals, shape + (4,3))
+        positions = positions.reshape(-1,3)
+        sensor_normals = sensor_normals.reshape(-1,4,3)
+
+        sensor_illuminance = np.empty((positions.shape[0], 4))
+        # a chunk of poses at a time, so the (poses, 4, emitters) products stay small
+        for start in range(0, positions.shape[0], self.CHUNK_SIZE):
+            chunk = slice(start, start + self.CHUNK_SIZE)
+            sensor_illuminance[chunk] = self._illuminance(positions[chunk], sensor_normals[chunk])
+
+        return sensor_illuminance.reshape(shape + (4,))
+
+
+    def _illuminance(self, positions, sensor_normals):
+        # (P,3) positions and (P,4,3) normals. The vectors to the emitters, light
+        # position - robot position, are never built: every product with them is
+        # split into a product with the light positions minus one with the robot's
+        light_positions = self.emitter_positions
+
+        distances_squared = (np.einsum('pc,pc->p', positions, positions)[:,None] - 2*positions.dot(light_positions.T)
+                             + self._emitter_norms_squared)
+        inverse_distances = 1 / np.sqrt(distances_squared)
+        # intensity / distance^3: one 1/distance normalizes the dot product below
+        weights = self.emitter_intensities * inverse_distances**3
+
+        if self._lambertian.any():
+            # cosine of the angle from the area lights' normals, point lights get 1
+            facing = (positions.dot(self.emitter_normals.T) - self._emitter_offsets) * inverse_distances
+            facing[:, ~self._lambertian] = 1.0
+            weights *= np.maximum(facing, 0.0)
+
+        # distance times the cosine of the angle at each sensor, (P,4,E)
+        incidence = sensor_normals.reshape(-1,3).dot(light_positions.T).reshape(-1, 4, light_positions.shape[0])
+        incidence -= np.einsum('pkc,pc->pk', sensor_normals, positions)[:,:,None]
+        np.maximum(incidence, 0.0, out=incidence)
+
+        return np.einsum('pke,pe->pk', incidence, weights)
+
+
+    def readings(self, theta, position = None):
+        """
+        Same interface as SensorModel.readings(), so it can be used as a robot's
+        sensor_model.
+
+        ==== ARGUMENTS ====
+        theta    = angle(s) of rotation of robot body relative to pointing straight up,
+                   any shape, e.g. (T,) for one trajectory or (N,T) for N
+        position = robot's (x, altitude) position(s) in the LQR's coordinates [m],
+                   shape theta.shape + (2,), the origin if not given
+
+        ==== RETURNS ====
+        sensor_readings = illuminance on each of the four sensors [lux], shape
+                          theta.shape + (4,)
+        """
+        theta = np.asarray(theta, dtype=float)
+        positions = np.zeros(theta.shape + (3,))
+        if position is not None:
+            positions[..., :2] = position
+
+        return self.illuminance(positions, self.sensor_normals(theta))
@@ -0,0 +1,123 @@
+"""
+Description:
+    The linearized model updateState_LQR_Control() moves the robot with (lateral
+    dynamics plus the altitude equation), as a plant object with the same interface
+    as NonlinearPlant, so it can be stepped at a finer rate than the controller (see
+    multirate.py).
+
+    Between two control updates the torque and lift are constant, so forward Euler
+    substeps of the lateral model are the linear recurrence
+        x[j+1] = M*x[j] + c,    M = I + h*A,  c = h*B*torque
+    whose solution is x[j] = M^j*x[0] + (I + M + ... + M^(j-1))*c. All the powers of M
+    are built by repeated doubling (log2(substeps) matrix products, each covering a
+    whole block of substeps) and the altitude is integrated with cumulative sums, so
+    every substep of a control step comes out of a handful of vectorized NumPy calls
+    instead of a Python loop over substeps.
+"""
+
+
+import numpy as np
+
+from integrators import interpolate
+
+
+def matrix_powers(M, n):
+    """
+    ==== ARGUMENTS ====
+    M = square matrix
+    n = highest power wanted
+
+    ==== RETURNS ====
+    powers = (n+1, ...) stack of M^0 (identity), M^1, ..., M^n
+    """
+    powers = np.empty((n + 1,) + M.shape)
+    powers[0] = np.identity(M.shape[0])
+    if n > 0:
+        powers[1] = M
+
+    have = 2 #powers[:have] are filled in
+    while have <= n:
+        block = min(have, n + 1 - have)
+        # M^(have + i) = M^i * M^have
+        powers[have:have + block] = np.matmul(powers[:block], powers[have - 1].dot(M))
+        have += block
+
+    return powers
+
+
+class LinearPlant(object):
+
+    def __init__(self, bee, substeps = 1):
+        """
+        ==== ARGUMENTS ====
+        bee      = roboBee instance the physical constants and plant cache come from
+        substeps = Euler steps per control step
+        """
+        self.bee = bee
+        self.substeps = substeps
+
+        # theta, theta_dot, x, x_dot, z, z_dot (see updateState_LQR_Control())
+        self.state = np.zeros(6)
+
+
+    def set_lqr_state(self, lqr_state):
+        self.state[:] = np.asarray(lqr_state, dtype=float).ravel()
+
+
+    def lqr_state(self):
+        return self.state.copy().reshape(6,1)
+
+
+    def add_vertical_velocity(self, delta):
+        self.state[5] += delta
+
+
+    def advance(self, dt, torque, lift_coefficient, sample_times = None):
+        """
+        Integrates the plant over one control step with the torque and lift held
+        constant, see the module description.
+
+        ==== ARGUMENTS ====
+        dt               = length of the control step [seconds]
+        torque           = torque the LQR tells the wings to generate
+        lift_coefficient = lift as a fraction of the robot's weight
+        sample_times     = optional increasing times within (0, dt] to also return the
+                           state at (interpolated between substeps)
+
+        ==== RETURNS ====
+        samples = (len(sample_times), 6) states at sample_times, or None
+        """
+        bee = self.bee
+        n = self.substeps
+        h = dt / n
+
+        A, B = bee.plant_cache.lateral_plant(bee.g, None, bee.B_w, bee.MASS, bee.Rw, bee.Jz)
+        M = np.identity(4) + h*A
+        M[3,0] += h*bee.g*lift_coefficient
+        c = h*B[:,0]*torque
+
+        powers = matrix_powers(M, n)
+        sums = np.cumsum(powers[:-1], axis=0)
+
+        states = np.empty((n + 1, 6))
+        states[0] = self.state
+        states[1:,:4] = powers[1:].dot(self.state[:4]) + sums.dot(c)
+
+        # altitude, with theta at the start of each substep like the Euler step
+        z_dot_dot = bee.MASS*bee.g*(lift_coefficient*np.cos(states[:-1,0]) - 1)
+        states[1:,5] = self.state[5] + h*np.cumsum(z_dot_dot)
+        states[1:,4] = self.state[4] + h*np.cumsum(states[:-1,5])
+
+        self.state = states[-1].copy()
+
+        if sample_times is None:
+            return None
+        return interpolate(h*np.arange(n + 1), states, sample_times)
+
+
+    def thetas(self, states):
+        return states[:,0]
+
+
+    def positions(self, states):
+        return states[:,2::2]
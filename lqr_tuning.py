@@ -0,0 +1,228 @@
+"""
+Description:
+    Sweeps the LQR's Q and R weights (the hand tuning in
+    archive/attempt_to_find_ideal_Q_matrix.m, automated).
+
+    Each candidate (the 4 doubles on Q's diagonal and R) is scored by solving the LQR
+    with those weights and running run_lqr() headless to the setpoint:
+        settling_time = time [s] after which x stays within tolerance of the desired x
+                        (inf if it never does)
+        effort        = integral of torque_gen^2 over the run (see
+                        updateState_LQR_Control() for torque_gen)
+        score         = settling_time + effort_weight*effort, lower is better
+    Candidates come from a grid (grid_candidates()) or are drawn at random on a log
+    scale (random_candidates()), and are evaluated in a pool of worker processes.
+
+    Every result is saved in the cache directory as soon as it's computed, in a file
+    named after a hash of the candidate, the robot's physical constants and the run
+    settings. A sweep that is interrupted (or extended with more candidates) picks up
+    the results already on disk and only simulates the rest.
+
+    Example (from a terminal):
+        python lqr_tuning.py tuning_cache --random 200 --timesteps 10000
+"""
+
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from roboBee_class_PD_and_LQR import roboBee
+from plant_cache import CONSTANT_NAMES
+
+# log10 ranges random_candidates() draws each weight from
+Q_LOG_RANGES = ((0, 4), (-2, 2), (0, 4), (-3, 1))
+R_LOG_RANGE = (14, 17)
+# weight of the control effort in the score, the default weights' effort then counts
+# about as much as their settling time
+EFFORT_WEIGHT = 0.01
+
+
+def grid_candidates(q_values, r_values):
+    """
+    ==== ARGUMENTS ====
+    q_values = 4 sequences, the values tried for each entry of Q's diagonal
+    r_values = values tried for R
+
+    ==== RETURNS ====
+    candidates = list of (Q diagonal, R) tuples, every combination of the values
+    """
+    return [ (tuple(float(q) for q in Q), float(R)) for Q in itertools.product(*q_values) for R in r_values ]
+
+
+def random_candidates(n_candidates, seed = 0, q_log_ranges = Q_LOG_RANGES, r_log_range = R_LOG_RANGE):
+    """
+    ==== ARGUMENTS ====
+    n_candidates = number of candidates to draw
+    seed         = seed of the random draws
+    q_log_ranges = (low, high) range of log10 of each entry of Q's diagonal
+    r_log_range  = (low, high) range of log10(R)
+
+    ==== RETURNS ====
+    candidates = list of (Q diagonal, R) tuples, log-uniformly distributed
+    """
+    rng = np.random.default_rng(seed)
+    low, high = np.array(q_log_ranges, dtype=float).T
+    Qs = 10**rng.uniform(low, high, (n_candidates, 4))
+    Rs = 10**rng.uniform(r_log_range[0], r_log_range[1], n_candidates)
+
+    return [ (tuple(Q.tolist()), float(R)) for Q, R in zip(Qs, Rs) ]
+
+
+def settling_time(x, x_desired, dt, tolerance):
+    """
+    ==== ARGUMENTS ====
+    x         = (n,) position at each time step
+    x_desired = desired position
+    dt        = time step [seconds]
+    tolerance = allowed distance from x_desired
+
+    ==== RETURNS ====
+    time = time of the first step after which x stays within tolerance [seconds],
+           inf if it's still outside at the end (or the run blew up)
+    """
+    outside = np.flatnonzero(~(np.abs(x - x_desired) <= tolerance))
+    if outside.size == 0:
+        return 0.0
+    if outside[-1] == x.size - 1:
+        return np.inf
+    return float((outside[-1] + 1)*dt)
+
+
+def _cache_key(candidate, settings):
+    """
+    Hash of everything a result depends on: the weights, the robot's physical
+    constants, its time step and the run settings.
+    """
+    Q, R = candidate
+    constants = [ getattr(roboBee, name) for name in CONSTANT_NAMES ]
+    description = json.dumps([list(Q), R, constants, roboBee.dt, settings], sort_keys=True)
+
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def _evaluate(task):
+    """
+    Scores one candidate (in a worker process) and saves its result to the cache.
+    """
+    settings = task['settings']
+    Q, R = task['candidate']
+
+    bee = roboBee()
+    bee.LQR_Q = Q
+    bee.LQR_R = R
+
+    # weights that make the robot unstable overflow, they just score inf
+    with np.errstate(over='ignore', invalid='ignore'):
+        state_data, torque_data = bee.run_lqr(settings['timesteps'], plots=False, quiet=True,
+                                              state_desired=settings['state_desired'],
+                                              initial_state=settings['initial_state'])
+
+        result = { 'Q': list(Q), 'R': R,
+                   'settling_time': settling_time(state_data[:,2], settings['state_desired'][2], bee.dt,
+                                                  settings['tolerance']),
+                   'effort': float(np.sum(torque_data**2)*bee.dt),
+                   'steps': int(state_data.shape[0]),
+                   'reached': bool(state_data.shape[0] < settings['timesteps']) }
+    if not np.isfinite(result['effort']):
+        result['effort'] = np.inf
+
+    # write to a temporary file first, so a crash can't leave a half written result.
+    # It's named after this process, so two sweeps sharing the cache can't collide
+    path = task['path']
+    temp_path = path + ".%d.tmp" % os.getpid()
+    with open(temp_path, 'w') as result_file:
+        json.dump(result, result_file)
+    os.replace(temp_path, path)
+
+    return task['indices'], result
+
+
+def sweep(candidates, cache_dir, timesteps = 10000, state_desired = None, initial_state = None, tolerance = 0.05,
+          effort_weight = EFFORT_WEIGHT, max_workers = None):
+    """
+    Evaluates every candidate, reusing results already in cache_dir.
+
+    ==== ARGUMENTS ====
+    candidates    = list of (Q diagonal, R) tuples, see grid_candidates() and
+                    random_candidates()
+    cache_dir     = directory the results are saved to and reloaded from
+    timesteps     = maximum number of time steps of each run (see run_lqr())
+    state_desired = 6 doubles, defaults to hovering at x=2, z=2
+    initial_state = 6 doubles, defaults to zeros
+    tolerance     = distance from the desired x that counts as settled [m]
+    effort_weight = weight of the effort in the score, see the module description
+    max_workers   = number of worker processes, defaults to the number of cores
+
+    ==== RETURNS ====
+    results = list of result dictionaries (Q, R, settling_time, effort, steps,
+              reached and score), sorted by score (best first)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if initial_state is None:
+        initial_state = np.zeros(6)
+    settings = { 'timesteps': int(timesteps),
+                 'state_desired': roboBee()._lqr_setpoint(state_desired)[:,0].tolist(),
+                 'initial_state': np.array(initial_state, dtype=float).ravel().tolist(),
+                 'tolerance': float(tolerance) }
+
+    results = [None] * len(candidates)
+    # one task per cache file, duplicate candidates share it
+    tasks = {}
+    for index, (Q, R) in enumerate(candidates):
+        candidate = (tuple(float(q) for q in Q), float(R))
+        path = os.path.join(cache_dir, _cache_key(candidate, settings) + ".json")
+
+        if path in tasks:
+            tasks[path]['indices'].append(index)
+        elif os.path.exists(path):
+            with open(path) as result_file:
+                results[index] = json.load(result_file)
+        else:
+            tasks[path] = { 'indices': [index], 'candidate': candidate, 'settings': settings, 'path': path }
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [ pool.submit(_evaluate, task) for task in tasks.values() ]
+            for future in as_completed(futures):
+                indices, result = future.result()
+                for index in indices:
+                    results[index] = dict(result)
+
+    for result in results:
+        result['score'] = result['settling_time'] + effort_weight*result['effort']
+
+    return sorted(results, key=lambda result: result['score'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the LQR's Q and R weights")
+    parser.add_argument("cache_dir")
+    parser.add_argument("--random", type=int, default=100, help="number of random candidates")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timesteps", type=int, default=10000)
+    parser.add_argument("--x", type=float, default=2.0, help="desired x position")
+    parser.add_argument("--z", type=float, default=2.0, help="desired z position")
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--effort-weight", type=float, default=EFFORT_WEIGHT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10, help="number of results to print")
+    args = parser.parse_args()
+
+    state_desired = np.zeros(6)
+    state_desired[2] = args.x
+    state_desired[4] = args.z
+
+    candidates = [ (roboBee.LQR_Q, roboBee.LQR_R) ] + random_candidates(args.random, args.seed)
+    results = sweep(candidates, args.cache_dir, args.timesteps, state_desired, tolerance=args.tolerance,
+                    effort_weight=args.effort_weight, max_workers=args.workers)
+
+    for result in results[:args.top]:
+        print("score %10.4g  settling %8.3f s  effort %10.4g  Q %s  R %.3g"
+              % (result['score'], result['settling_time'], result['effort'],
+                 " ".join("%.3g" % q for q in result['Q']), result['R']))
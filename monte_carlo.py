@@ -0,0 +1,356 @@
+"""
+Description:
+    Monte Carlo robustness check of the LQR controller against uncertainty in the
+    robot's physical constants.
+
+    The drag constant, wing distance, moment of inertia, mass and starting lift
+    coefficient (B_w, Rw, Jz, MASS and LIFT_COEFFICIENT) are only known roughly. Each
+    sample draws them from a lognormal distribution around the class values (so they
+    stay positive), solves the LQR for the sampled robot like run_lqr() would, and
+    flies it to the setpoint with the sensors and observer in the loop.
+
+    Samples are simulated in chunks with the batched simulator (iter_lqr_batch()), and
+    the chunks are spread over a pool of worker processes. Nothing per sample is kept:
+    each chunk only returns running statistics of
+        success rate     = fraction of robots that reach the desired state in time
+        time to setpoint = time [s] the robots that made it took
+        peak theta       = largest |theta| [rad] of each flight
+    (count, mean, standard deviation, min/max and quantiles from a fixed size
+    histogram), which are merged as the chunks finish. So memory stays the same
+    whether 100 or 10 million robots are flown. Each chunk gets its own seed spawned
+    from the run's seed, so results don't depend on the number of workers.
+
+    Example (from a terminal):
+        python monte_carlo.py --samples 10000 --timesteps 10000
+"""
+
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from roboBee_class_PD_and_LQR import roboBee
+from batch_simulator import iter_lqr_batch
+from plant_cache import PlantCache
+
+# Standard deviation of the log of each uncertain constant, i.e. roughly its
+# relative standard deviation
+DEFAULT_UNCERTAINTY = { 'B_w': 0.2, 'Rw': 0.1, 'Jz': 0.2, 'MASS': 0.1, 'LIFT_COEFFICIENT': 0.05 }
+
+
+class RunningStats(object):
+    """
+    Count, mean, variance, min and max of a stream of values (Welford's algorithm),
+    updated a batch at a time. Two of them can be merged (Chan et al.'s parallel
+    version), which is how the workers' statistics are combined.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 #sum of squared differences from the mean
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        if total == 0:
+            return
+
+        delta = mean - self.mean
+        self.mean += delta*count / total
+        self.m2 += m2 + delta*delta*self.count*count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+
+        mean = values.mean()
+        self._combine(values.size, mean, ((values - mean)**2).sum(), values.min(), values.max())
+
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class QuantileSketch(object):
+    """
+    Approximate quantiles of a stream of values from a histogram with fixed bins, so
+    it takes the same memory however many values go in and two sketches can be merged
+    by adding their counts. A quantile is off by at most one bin width (resolution)
+    as long as it falls inside [low, high].
+    """
+
+    def __init__(self, low, high, bins = 1000):
+        """
+        ==== ARGUMENTS ====
+        low, high = range the bins cover, values outside it are only counted
+        bins      = number of bins
+        """
+        self.edges = np.linspace(low, high, bins + 1)
+        self.counts = np.zeros(bins + 2, dtype=np.int64) #plus one below low and one above high
+
+
+    @property
+    def resolution(self):
+        return self.edges[1] - self.edges[0]
+
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        self.counts += np.bincount(np.searchsorted(self.edges, values, side='right'),
+                                   minlength=self.counts.size)[:self.counts.size]
+
+
+    def merge(self, other):
+        self.counts += other.counts
+
+
+    def quantile(self, q):
+        """
+        ==== ARGUMENTS ====
+        q = quantile(s) to estimate, in [0, 1]
+
+        ==== RETURNS ====
+        values = estimated quantile(s), interpolated within the bin they fall in
+                 (-inf/inf if they fall below low/above high, nan with no values)
+        """
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(np.shape(q), np.nan)
+
+        cumulative = np.cumsum(self.counts)
+        # rank of the value wanted, kept above 0 so q=0 lands in the first bin holding any
+        rank = np.maximum(np.asarray(q, dtype=float)*total, 0.5)
+        # index of the first bin whose cumulative count reaches the rank
+        index = np.clip(np.searchsorted(cumulative, rank, side='left'), 0, self.counts.size - 1)
+        below = cumulative[index] - self.counts[index]
+        fraction = (rank - below) / np.maximum(self.counts[index], 1)
+
+        inner = np.clip(index, 1, self.counts.size - 2)
+        values = self.edges[inner - 1] + np.clip(fraction, 0, 1)*self.resolution
+        values = np.where(index == 0, -np.inf, values)
+        return np.where(index == self.counts.size - 1, np.inf, values)
+
+
+class MonteCarloResults(object):
+
+    def __init__(self, timesteps, dt):
+        self.samples = 0
+        self.successes = 0
+        self.diverged = 0 #flights whose state went to inf/nan
+        self.time_to_setpoint = RunningStats()
+        self.time_to_setpoint_quantiles = QuantileSketch(0.0, timesteps*dt)
+        self.peak_theta = RunningStats()
+        self.peak_theta_quantiles = QuantileSketch(0.0, np.pi)
+
+
+    def update(self, reached, times, peak_thetas):
+        """
+        ==== ARGUMENTS ====
+        reached     = (N,) True for the robots that reached the desired state
+        times       = (N,) time each robot took to get there [seconds]
+        peak_thetas = (N,) largest |theta| of each flight [rad]
+        """
+        finite = np.isfinite(peak_thetas)
+
+        self.samples += reached.size
+        self.successes += int(np.count_nonzero(reached))
+        self.diverged += int(np.count_nonzero(~finite))
+        self.time_to_setpoint.update(times[reached])
+        self.time_to_setpoint_quantiles.update(times[reached])
+        self.peak_theta.update(peak_thetas[finite])
+        self.peak_theta_quantiles.update(peak_thetas[finite])
+
+
+    def merge(self, other):
+        self.samples += other.samples
+        self.successes += other.successes
+        self.diverged += other.diverged
+        self.time_to_setpoint.merge(other.time_to_setpoint)
+        self.time_to_setpoint_quantiles.merge(other.time_to_setpoint_quantiles)
+        self.peak_theta.merge(other.peak_theta)
+        self.peak_theta_quantiles.merge(other.peak_theta_quantiles)
+
+
+    @property
+    def success_rate(self):
+        return self.successes / self.samples if self.samples else np.nan
+
+
+    def summary(self, quantiles = (0.05, 0.5, 0.95)):
+        """
+        ==== RETURNS ====
+        summary = dictionary of plain numbers, e.g. for saving as JSON
+        """
+        summary = { 'samples': self.samples, 'success_rate': self.success_rate, 'diverged': self.diverged }
+
+        for name, stats, sketch in (('time_to_setpoint', self.time_to_setpoint, self.time_to_setpoint_quantiles),
+                                    ('peak_theta', self.peak_theta, self.peak_theta_quantiles)):
+            summary[name] = { 'count': stats.count, 'mean': stats.mean, 'std': stats.std, 'min': stats.min, 'max': stats.max,
+                              'quantiles': dict(zip(quantiles, sketch.quantile(quantiles).tolist())),
+                              'quantile_resolution': sketch.resolution }
+
+        return summary
+
+
+    def report(self):
+        summary = self.summary()
+        lines = [ "%d samples, success rate %.1f%% (%d diverged)"
+                  % (summary['samples'], 100*summary['success_rate'], summary['diverged']) ]
+
+        for name, unit, missing in (('time_to_setpoint', 's', "no successful runs"),
+                                    ('peak_theta', 'rad', "no flights that stayed finite")):
+            stats = summary[name]
+            if stats['count'] == 0:
+                lines.append("%-16s %s" % (name, missing))
+                continue
+
+            quantiles = ", ".join("p%g %.4g" % (100*q, value) for q, value in stats['quantiles'].items())
+            lines.append("%-16s mean %.4g %s, std %.4g, min %.4g, max %.4g, %s"
+                         % (name, stats['mean'], unit, stats['std'], stats['min'], stats['max'], quantiles))
+
+        return "\n".join(lines)
+
+
+def sample_parameters(rng, n_samples, uncertainty = DEFAULT_UNCERTAINTY, bee = None):
+    """
+    ==== ARGUMENTS ====
+    rng         = np.random.Generator to draw from
+    n_samples   = number of robots to sample
+    uncertainty = standard deviation of the log of each uncertain constant (any of
+                  ROBOT_CONSTANTS and LIFT_COEFFICIENT)
+    bee         = roboBee whose constants are the nominal values
+
+    ==== RETURNS ====
+    parameters = dictionary of (n_samples,) arrays, one per uncertain constant
+    """
+    if bee is None:
+        bee = roboBee()
+
+    return { name: getattr(bee, name)*np.exp(rng.normal(0.0, sigma, n_samples))
+             for name, sigma in uncertainty.items() }
+
+
+def _simulate_chunk(task):
+    """
+    Flies one chunk of sampled robots (in a worker process) and returns the chunk's
+    statistics.
+    """
+    rng = np.random.default_rng(task['seed'])
+
+    bee = roboBee()
+    # thousands of sampled constants would flush the LQR gains out of the shared cache
+    bee.plant_cache = PlantCache(maxsize=16)
+
+    parameters = sample_parameters(rng, task['n_samples'], task['uncertainty'], bee)
+    lift_coefficients = parameters.pop('LIFT_COEFFICIENT', None)
+
+    n_bees = task['n_samples']
+    timesteps = task['timesteps']
+    states_desired = np.broadcast_to(task['state_desired'], (n_bees, 6))
+
+    reached = np.zeros(n_bees, dtype=bool)
+    lengths = np.zeros(n_bees, dtype=int)
+    peak_thetas = np.zeros(n_bees)
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        for i, (state, torque_gen, active, stopped) in enumerate(iter_lqr_batch(timesteps, states_desired,
+                                                                                task['initial_state'],
+                                                                                lift_coefficients, bee, parameters,
+                                                                                task['convergence'])):
+            # the robots the simulator stopped because they reached the desired state
+            reached |= stopped
+            lengths[active] = i + 1
+            peak_thetas[active] = np.fmax(peak_thetas[active], np.abs(state[active,0]))
+            # NaN once a flight blows up, which fmax would skip
+            peak_thetas[active & ~np.isfinite(state[:,0])] = np.inf
+
+    results = MonteCarloResults(timesteps, bee.dt)
+    results.update(reached, (lengths - 1)*bee.dt, peak_thetas)
+
+    return results
+
+
+def run_monte_carlo(n_samples, timesteps = 10000, state_desired = None, initial_state = None,
+                    uncertainty = DEFAULT_UNCERTAINTY, chunk_size = 500, seed = 0, max_workers = None,
+                    convergence = None):
+    """
+    ==== ARGUMENTS ====
+    n_samples     = number of robots to fly
+    timesteps     = time steps each robot gets to reach the desired state
+    state_desired = 6 doubles (see run_lqr()), defaults to hovering at x=2, z=2
+    initial_state = 6 doubles every robot starts in, defaults to zeros
+    uncertainty   = see sample_parameters()
+    chunk_size    = robots simulated together in one batch
+    seed          = seed the chunks' seeds are spawned from
+    max_workers   = number of worker processes, defaults to the number of cores. 1
+                    runs everything in this process
+    convergence   = optional criterion for when a robot has reached the desired state
+                    (see convergence.py), which both stops its flight and counts it as
+                    a success. Defaults to run_lqr()'s
+
+    ==== RETURNS ====
+    results = MonteCarloResults, see summary() and report()
+    """
+    state_desired = roboBee()._lqr_setpoint(state_desired)[:,0]
+    if initial_state is None:
+        initial_state = np.zeros(6)
+    initial_state = np.array(initial_state, dtype=float).ravel()
+
+    sizes = [ min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size) ]
+    tasks = [ { 'n_samples': size, 'seed': chunk_seed, 'timesteps': timesteps, 'uncertainty': dict(uncertainty),
+                'state_desired': state_desired, 'initial_state': np.tile(initial_state, (size, 1)),
+                'convergence': convergence }
+              for size, chunk_seed in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))) ]
+
+    results = MonteCarloResults(timesteps, roboBee.dt)
+    if max_workers == 1:
+        for task in tasks:
+            results.merge(_simulate_chunk(task))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            for chunk_results in pool.map(_simulate_chunk, tasks):
+                results.merge(chunk_results)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo robustness check of the LQR controller")
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--timesteps", type=int, default=10000)
+    parser.add_argument("--x", type=float, default=2.0, help="desired x position")
+    parser.add_argument("--z", type=float, default=2.0, help="desired z position")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    for name, sigma in DEFAULT_UNCERTAINTY.items():
+        parser.add_argument("--" + name, type=float, default=sigma,
+                            help="standard deviation of log(%s) (default %g)" % (name, sigma))
+    args = parser.parse_args()
+
+    state_desired = np.zeros(6)
+    state_desired[2] = args.x
+    state_desired[4] = args.z
+    uncertainty = { name: getattr(args, name) for name in DEFAULT_UNCERTAINTY }
+
+    results = run_monte_carlo(args.samples, args.timesteps, state_desired, uncertainty=uncertainty,
+                              chunk_size=args.chunk_size, seed=args.seed, max_workers=args.workers)
+    print(results.report())
@@ -0,0 +1,170 @@
+"""
+Description:
+    Multi-rate LQR simulation: the controller, the sensors/observer and the plant
+    each run at their own rate instead of all sharing dt = 1/120.
+
+    Each control period the scheduler
+        1. runs the LQR and altitude controller on the latest estimated state,
+        2. advances the plant (LinearPlant or NonlinearPlant) over the whole period
+           with the chosen torque and lift in one call, which takes all of its
+           substeps at once and returns the state at every sensor sample time in
+           the period,
+        3. computes every sensor reading in the period with one vectorized call to
+           the sensor model, and feeds them to the observer in one pass.
+    So raising the sensor rate or the number of plant substeps adds array work, not
+    Python overhead per sample or substep. LinearPlant takes its substeps with batched
+    matrix products. NonlinearPlant takes them in one Numba-compiled kernel, and
+    without Numba falls back to one Python call per substep (see nonlinear_plant.py).
+
+    The sensor rate doesn't have to be a multiple of the control rate (e.g. 120 Hz
+    control with 1 kHz sensing): sample times are counted on the sensor's own clock,
+    and each control update uses the newest estimate taken at or before it.
+
+    Example:
+        scheduler = MultiRateScheduler(control_rate=120, sensor_rate=1000, plant_substeps=10)
+        state_data, torque_data = scheduler.run_lqr(roboBee(), 5000)
+"""
+
+
+import math
+import numpy as np
+
+from linear_plant import LinearPlant
+from nonlinear_plant import NonlinearPlant
+from observer import AngularVelocityObserver
+from convergence import L1Criterion
+from trajectory_recorder import make_recorder
+
+
+class MultiRateScheduler(object):
+
+    def __init__(self, control_rate = 120, sensor_rate = None, plant_substeps = 1):
+        """
+        ==== ARGUMENTS ====
+        control_rate   = rate the LQR and altitude controller run at [Hz]
+        sensor_rate    = rate the phototransistors are read and the observer updated
+                         at [Hz], defaults to the control rate
+        plant_substeps = plant steps per control period (ignored by the adaptive
+                         'rk45' integrator, which picks its own steps)
+        """
+        self.control_rate = control_rate
+        self.sensor_rate = control_rate if sensor_rate is None else sensor_rate
+        self.plant_substeps = plant_substeps
+
+        self.control_dt = 1.0 / control_rate
+        self.sensor_dt = 1.0 / self.sensor_rate
+
+
+    def sample_times(self, step):
+        """
+        ==== ARGUMENTS ====
+        step = index of a control period
+
+        ==== RETURNS ====
+        sample_times = times of the sensor samples taken in (start, end] of that period,
+                       relative to its start [seconds]
+        """
+        # samples are numbered on the sensor clock, so rounding errors don't build up
+        ratio = self.sensor_rate / self.control_rate
+        first = math.floor(step*ratio + 1e-9) + 1
+        last = math.floor((step + 1)*ratio + 1e-9)
+
+        return np.arange(first, last + 1)*self.sensor_dt - step*self.control_dt
+
+
+    def make_plant(self, bee, dynamics = 'linear', integrator = 'rk4'):
+        if dynamics == 'linear':
+            return LinearPlant(bee, self.plant_substeps)
+        elif dynamics == 'nonlinear':
+            return NonlinearPlant(bee, integrator, self.plant_substeps)
+        raise ValueError("dynamics must be 'linear' or 'nonlinear', not %r" % (dynamics,))
+
+
+    def iter_lqr(self, bee, timesteps = None, state_desired = None, initial_state = None,
+                 dynamics = 'linear', integrator = 'rk4', convergence = None):
+        """
+        Multi-rate version of roboBee.iter_lqr(). Unlike iter_lqr()'s linear mode, the
+        plant keeps the robot's true state and the controller only ever sees the
+        estimate, for both the linear and nonlinear plant.
+
+        ==== ARGUMENTS ====
+        bee           = roboBee to simulate (its gains, altitude controller and sensors)
+        timesteps     = maximum number of control periods, or None to keep going until
+                        the desired state is reached
+        state_desired, initial_state, dynamics, integrator, convergence = see roboBee.run_lqr()
+
+        ==== YIELDS ====
+        state           = (6,1) true state at the start of the control period
+        estimated_state = (6,1) state the controller acted on
+        torque_gen      = see updateState_LQR_Control()
+        sensor_estimate = (2,1) newest angular velocity estimate from the sensors
+        """
+        if initial_state is None:
+            initial_state = np.zeros(6)
+        state_desired = bee._lqr_setpoint(state_desired)
+
+        plant = self.make_plant(bee, dynamics, integrator)
+        plant.set_lqr_state(initial_state)
+        state = plant.lqr_state()
+
+        observer = AngularVelocityObserver(self.sensor_dt)
+        observer.last_sensor_readings[:,0] = bee.sensor_model.readings(state[0,0], state[2::2,0])
+        aVelEstimates = np.zeros((2,1))
+
+        if convergence is None:
+            convergence = L1Criterion()
+        convergence.reset()
+
+        gains = bee.LQR_gains()
+        torque_gen = 0
+
+        i = 0
+        pointReached = False
+        while (timesteps is None or i < timesteps) and not pointReached:
+            if convergence.update(state, state_desired):
+                pointReached = True
+
+            estimated_state = state.copy()
+            estimated_state[1] = aVelEstimates[0]
+
+            torque, torque_gen, lift = bee._lqr_control(estimated_state, state_desired, gains, plant)
+            sample_times = self.sample_times(i)
+            samples = plant.advance(self.control_dt, torque, lift, sample_times)
+
+            yield state, estimated_state, torque_gen, aVelEstimates
+
+            if len(sample_times) > 0:
+                readings = bee.sensor_model.readings(plant.thetas(samples), plant.positions(samples))
+                estimates = observer.update_many(readings, torque_gen)
+                aVelEstimates = estimates[-1].reshape(2,1)
+
+            state = plant.lqr_state()
+            i += 1
+
+
+    def run_lqr(self, bee, timesteps, state_desired = None, initial_state = None, dynamics = 'linear',
+                integrator = 'rk4', stream_to = None, convergence = None):
+        """
+        Runs iter_lqr() and logs it the same way roboBee.run_lqr() does (without plots
+        or printing).
+
+        ==== RETURNS ====
+        state_data  = (n,8) true state at each control period, then desired x and z
+        torque_data = (n,) torque_gen of each control period
+        """
+        state_desired = bee._lqr_setpoint(state_desired)
+
+        state_log = make_recorder('state', timesteps, 8, stream_to)
+        torque_log = make_recorder('torque', timesteps, None, stream_to)
+
+        with state_log, torque_log:
+            for state, estimated_state, torque_gen, aVelEstimates in self.iter_lqr(bee, timesteps, state_desired,
+                                                                                    initial_state, dynamics,
+                                                                                    integrator, convergence):
+                state_row = state_log.next_row()
+                state_row[:6] = state[:,0]
+                state_row[6] = state_desired[2,0]
+                state_row[7] = state_desired[4,0]
+                torque_log.append(torque_gen)
+
+        return state_log.data(), torque_log.data()
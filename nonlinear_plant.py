@@ -0,0 +1,324 @@
+"""
+Description:
+    Full nonlinear plant for the LQR simulation (the README's "Version 2" goal).
+
+    updateState_LQR_Control() moves the robot with the linearized lateral model and
+    forward Euler. NonlinearPlant instead integrates the rigid body equations of the
+    12 state model in analytical_model.py (position, body frame velocity, attitude and
+    body angular velocity; the attitude is kept as a quaternion, so the integrated
+    vector has 13 entries) with the LQR's torque and the altitude controller's lift as
+    inputs. Linearizing these equations about hovering gives the lateral model the LQR
+    gains are designed for.
+
+    The LQR works in a plane: its x is the global x axis, its "z" (altitude) is the
+    global y axis (up), and theta is the tilt of the robot's body y axis (the direction
+    its wings push) toward +x, i.e. a rotation about the global -z axis.
+
+    Each control step (dt = 1/120 s) the plant is advanced with one of
+        'euler' = forward Euler, 'substeps' steps per control step
+        'rk4'   = classic Runge-Kutta, 'substeps' steps per control step
+        'rk45'  = adaptive Dormand-Prince (see integrators.py), whose step size can
+                  grow past dt when the robot is barely moving
+
+    If Numba is installed, all of a control step's 'euler' or 'rk4' substeps are
+    taken by one JIT-compiled kernel written in scalar code, so adding substeps costs
+    no Python overhead. Without it (or with use_jit=False) each substep is a call to
+    the NumPy reference step, which gives the same states to within rounding.
+"""
+
+
+import math
+import numpy as np
+
+import quaternions
+from integrators import euler_step, rk4_step, interpolate, DormandPrince45
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+INTEGRATORS = ('euler', 'rk4', 'rk45')
+
+
+def _derivatives_kernel(y, torque, lift, B_w, Rw, MASS, g, Jz, y_dot):
+    """
+    NonlinearPlant.derivatives() in scalar code, written into y_dot. lift is the lift
+    force [N] here.
+    """
+    vx, vy, vz = y[3], y[4], y[5]
+    qw, qx, qy, qz = y[6], y[7], y[8], y[9]
+    wx, wy, wz = y[10], y[11], y[12]
+
+    r00 = 1 - 2*(qy*qy + qz*qz)
+    r01 = 2*(qx*qy - qw*qz)
+    r02 = 2*(qx*qz + qw*qy)
+    r10 = 2*(qx*qy + qw*qz)
+    r11 = 1 - 2*(qx*qx + qz*qz)
+    r12 = 2*(qy*qz - qw*qx)
+    r20 = 2*(qx*qz - qw*qy)
+    r21 = 2*(qy*qz + qw*qx)
+    r22 = 1 - 2*(qx*qx + qy*qy)
+
+    fx = -B_w*(vx - wz*Rw)
+    fy = -B_w*vy
+    fz = -B_w*(vz + wx*Rw)
+
+    y_dot[0] = r00*vx + r01*vy + r02*vz
+    y_dot[1] = r10*vx + r11*vy + r12*vz
+    y_dot[2] = r20*vx + r21*vy + r22*vz
+    y_dot[3] = fx / MASS - g*r10 - (wy*vz - wz*vy)
+    y_dot[4] = (fy + lift) / MASS - g*r11 - (wz*vx - wx*vz)
+    y_dot[5] = fz / MASS - g*r12 - (wx*vy - wy*vx)
+    y_dot[6] = 0.5*(-qx*wx - qy*wy - qz*wz)
+    y_dot[7] = 0.5*(qw*wx + qy*wz - qz*wy)
+    y_dot[8] = 0.5*(qw*wy - qx*wz + qz*wx)
+    y_dot[9] = 0.5*(qw*wz + qx*wy - qy*wx)
+    y_dot[10] = Rw*fz / Jz
+    y_dot[11] = 0.0
+    y_dot[12] = (-torque - Rw*fx) / Jz
+
+
+def _substeps_kernel(states, h, rk4, torque, lift, B_w, Rw, MASS, g, Jz):
+    """
+    Takes len(states) - 1 fixed steps of size h from states[0] (forward Euler, or RK4
+    if rk4 is true), writing the state after each into the next row of states.
+    Compiled with Numba when it is available.
+    """
+    k1 = np.empty(13)
+    k2 = np.empty(13)
+    k3 = np.empty(13)
+    k4 = np.empty(13)
+    y = np.empty(13)
+
+    for i in range(states.shape[0] - 1):
+        start = states[i]
+        _derivatives_kernel(start, torque, lift, B_w, Rw, MASS, g, Jz, k1)
+        if not rk4:
+            for j in range(13):
+                states[i + 1, j] = start[j] + h*k1[j]
+            continue
+
+        for j in range(13):
+            y[j] = start[j] + 0.5*h*k1[j]
+        _derivatives_kernel(y, torque, lift, B_w, Rw, MASS, g, Jz, k2)
+        for j in range(13):
+            y[j] = start[j] + 0.5*h*k2[j]
+        _derivatives_kernel(y, torque, lift, B_w, Rw, MASS, g, Jz, k3)
+        for j in range(13):
+            y[j] = start[j] + h*k3[j]
+        _derivatives_kernel(y, torque, lift, B_w, Rw, MASS, g, Jz, k4)
+        for j in range(13):
+            states[i + 1, j] = start[j] + (h/6.0)*(k1[j] + 2*k2[j] + 2*k3[j] + k4[j])
+
+
+if njit is not None:
+    _derivatives_kernel = njit(cache=True)(_derivatives_kernel)
+    _substeps_kernel = njit(cache=True)(_substeps_kernel)
+
+
+class NonlinearPlant(object):
+
+    def __init__(self, bee, integrator = 'rk4', substeps = 1, rtol = 1e-6, atol = 1e-9, use_jit = None):
+        """
+        ==== ARGUMENTS ====
+        bee        = roboBee instance the physical constants are taken from
+        integrator = 'euler', 'rk4' or 'rk45'
+        substeps   = fixed steps per control step for 'euler' and 'rk4'
+        rtol, atol = error tolerances of 'rk45'
+        use_jit    = True to take the fixed substeps with the compiled kernel, False
+                     for the NumPy version, None to use the kernel if Numba is installed
+        """
+        if integrator not in INTEGRATORS:
+            raise ValueError("integrator must be one of %s, not %r" % (INTEGRATORS, integrator))
+        if use_jit is None:
+            use_jit = njit is not None
+        elif use_jit and njit is None:
+            raise ImportError("use_jit=True needs Numba, which is not installed")
+
+        self.integrator = integrator
+        self.substeps = substeps
+        self.use_jit = use_jit
+
+        self.B_w = bee.B_w
+        self.R_w = np.array([0.0, bee.Rw, 0.0]) #distance between center of mass and wings [m]
+        self.MASS = bee.MASS
+        self.g = bee.g
+        self.Jz = bee.Jz
+
+        self.solver = None
+        if integrator == 'rk45':
+            self.solver = DormandPrince45(self.derivatives, rtol, atol)
+
+        # position, body velocity, attitude (w,x,y,z), body angular velocity
+        self.state = np.zeros(13)
+        self.state[6] = 1.0
+
+
+    def set_lqr_state(self, lqr_state):
+        """
+        Puts the robot in the (planar) state given in the LQR's coordinates.
+
+        ==== ARGUMENTS ====
+        lqr_state = 6 doubles (theta, theta_dot, x, x_dot, z, z_dot), see
+                    updateState_LQR_Control()
+        """
+        theta, theta_dot, x, x_dot, z, z_dot = np.asarray(lqr_state, dtype=float).ravel()
+
+        attitude = quaternions.exp_map([0.0, 0.0, -theta])
+        rotation = quaternions.to_rotation_matrix(attitude)
+
+        self.state[0:3] = [x, z, 0.0]
+        self.state[3:6] = rotation.T.dot([x_dot, z_dot, 0.0])
+        self.state[6:10] = attitude
+        self.state[10:13] = [0.0, 0.0, -theta_dot]
+
+
+    def lqr_state(self):
+        """
+        ==== RETURNS ====
+        lqr_state = (6,1) state of the robot in the LQR's coordinates (theta,
+                    theta_dot, x, x_dot, z, z_dot), ignoring any out of plane motion
+        """
+        x, z = self.state[0:2].tolist()
+        vx, vy, vz, qw, qx, qy, qz = self.state[3:10].tolist()
+
+        # first two rows of the attitude's rotation matrix; its middle column is the
+        # body y axis (the direction the wings push) in global coordinates
+        r00, r01, r02 = 1 - 2*(qy*qy + qz*qz), 2*(qx*qy - qw*qz), 2*(qx*qz + qw*qy)
+        r10, r11, r12 = 2*(qx*qy + qw*qz), 1 - 2*(qx*qx + qz*qz), 2*(qy*qz - qw*qx)
+
+        return np.array([ math.atan2(r01, r11), -self.state[12],
+                          x, r00*vx + r01*vy + r02*vz,
+                          z, r10*vx + r11*vy + r12*vz ]).reshape(6,1)
+
+
+    def add_vertical_velocity(self, delta):
+        """
+        Changes the robot's global vertical (altitude) velocity by delta [m/s], which is
+        how the altitude controller brakes the robot (see updateState_LQR_Control()).
+        """
+        rotation = quaternions.to_rotation_matrix(self.state[6:10])
+        self.state[3:6] += delta*rotation[1]
+
+
+    def derivatives(self, y, torque, lift_coefficient):
+        """
+        ==== ARGUMENTS ====
+        y                = 13 state vector (see __init__)
+        torque           = torque the LQR tells the wings to generate (tilting toward +x)
+        lift_coefficient = lift the wings generate as a fraction of the robot's weight
+
+        ==== RETURNS ====
+        y_dot = time derivative of y
+        """
+        # written out with plain floats, at this size that's several times faster
+        # than np.cross and friends
+        vx, vy, vz, qw, qx, qy, qz, wx, wy, wz = y[3:13].tolist()
+        B_w, Rw, MASS, g, Jz = self.B_w, self.R_w[1], self.MASS, self.g, self.Jz
+
+        # rotation matrix of the attitude (body to global coordinates)
+        r00 = 1 - 2*(qy*qy + qz*qz)
+        r01 = 2*(qx*qy - qw*qz)
+        r02 = 2*(qx*qz + qw*qy)
+        r10 = 2*(qx*qy + qw*qz)
+        r11 = 1 - 2*(qx*qx + qz*qz)
+        r12 = 2*(qy*qz - qw*qx)
+        r20 = 2*(qx*qz - qw*qy)
+        r21 = 2*(qy*qz + qw*qx)
+        r22 = 1 - 2*(qx*qx + qy*qy)
+
+        # drag_force = -B_w*(v + w x R_w), with R_w = [0, Rw, 0]
+        fx = -B_w*(vx - wz*Rw)
+        fy = -B_w*vy
+        fz = -B_w*(vz + wx*Rw)
+
+        lift = lift_coefficient*MASS*g
+
+        return np.array([
+            # velocity in global coordinates
+            r00*vx + r01*vy + r02*vz,
+            r10*vx + r11*vy + r12*vz,
+            r20*vx + r21*vy + r22*vz,
+            # (drag + lift)/MASS + gravity in body coordinates - w x v
+            fx / MASS - g*r10 - (wy*vz - wz*vy),
+            (fy + lift) / MASS - g*r11 - (wz*vx - wx*vz),
+            fz / MASS - g*r12 - (wx*vy - wy*vx),
+            # q_dot = q*[0, w]/2
+            0.5*(-qx*wx - qy*wy - qz*wz),
+            0.5*(qw*wx + qy*wz - qz*wy),
+            0.5*(qw*wy - qx*wz + qz*wx),
+            0.5*(qw*wz + qx*wy - qy*wx),
+            # (torque + R_w x drag - w x (Jz*w)) / Jz, the last term is always zero
+            Rw*fz / Jz,
+            0.0,
+            (-torque - Rw*fx) / Jz ])
+
+
+    def advance(self, dt, torque, lift_coefficient, sample_times = None):
+        """
+        Integrates the plant over one control step with the torque and lift held
+        constant.
+
+        ==== ARGUMENTS ====
+        dt               = length of the control step [seconds]
+        torque           = see derivatives()
+        lift_coefficient = see derivatives()
+        sample_times     = optional increasing times within (0, dt] to also return the
+                           state at (dense output of 'rk45', or interpolated between
+                           substeps otherwise)
+
+        ==== RETURNS ====
+        samples = (len(sample_times), 13) states at sample_times, or None
+        """
+        args = (torque, lift_coefficient)
+        samples = None
+
+        if self.solver is not None:
+            self.state, samples = self.solver.integrate(self.state, dt, args, sample_times)
+        else:
+            h = dt / self.substeps
+            if self.use_jit:
+                # every substep in one compiled call
+                states = np.empty((self.substeps + 1, 13))
+                states[0] = self.state
+                _substeps_kernel(states, h, self.integrator == 'rk4', torque, lift_coefficient*self.MASS*self.g,
+                                 self.B_w, self.R_w[1], self.MASS, self.g, self.Jz)
+                self.state = states[-1].copy()
+            else:
+                step = rk4_step if self.integrator == 'rk4' else euler_step
+                states = [self.state]
+                for i in range(self.substeps):
+                    states.append(step(self.derivatives, states[-1], h, args))
+                self.state = states[-1]
+
+            if sample_times is not None:
+                samples = interpolate(h*np.arange(self.substeps + 1), np.array(states), sample_times)
+
+        # keep the attitude a unit quaternion
+        self.state[6:10] /= np.sqrt(np.dot(self.state[6:10], self.state[6:10]))
+
+        return samples
+
+
+    def thetas(self, states):
+        """
+        ==== ARGUMENTS ====
+        states = (n,13) states, e.g. samples returned by advance()
+
+        ==== RETURNS ====
+        thetas = (n,) theta (see lqr_state()) of each state
+        """
+        qw, qx, qy, qz = states[:,6], states[:,7], states[:,8], states[:,9]
+        return np.arctan2(2*(qx*qy - qw*qz), 1 - 2*(qx*qx + qz*qz))
+
+
+    def positions(self, states):
+        """
+        ==== ARGUMENTS ====
+        states = (n,13) states, e.g. samples returned by advance()
+
+        ==== RETURNS ====
+        positions = (n,2) x and altitude (the global x and y) of each state
+        """
+        return states[:,0:2]
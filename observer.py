@@ -0,0 +1,108 @@
+"""
+Description:
+    Observer that estimates the roboBee's angular velocity from its phototransistor
+    readings (see roboBee.getAngularVel()).
+
+    The observer matrix L is built once, and each observer keeps its own buffer of the
+    previous time step's sensor readings which it updates in place. Every roboBee owns
+    its own observer, so several robots can be simulated side by side without sharing
+    sensor history. Estimates are only printed or logged if a log hook is set.
+"""
+
+
+import numpy as np
+
+class AngularVelocityObserver(object):
+
+    # Factor to convert from angular position to sensor readings
+    # Original estimate was pi/850, added the 7468.8 to scale from obtained
+    # values to desired values
+    k = np.pi / (850) * 7468.8
+
+    # Matrix to convert change in sensor readings (d[SR]) over time to angular velocity (w)
+    # such that:    w = L*d[SR]
+    L = np.array([ [np.sqrt(3)/k,   0,  -np.sqrt(3)/k,    0,  ],
+                   [0,  -np.sqrt(3)/k,  0,  np.sqrt(3)/k]       ])
+    L.setflags(write=False)
+
+    # L turns the change in readings over one time step into a rate, so it was tuned
+    # for (and is exact at) this sampling period; other periods scale it
+    CALIBRATION_DT = 1/120
+
+
+    def __init__(self, dt, log_hook = None):
+        """
+        ==== ARGUMENTS ====
+        dt       = time step between sensor readings [seconds]
+        log_hook = optional function called with every new estimate, e.g. print
+        """
+        self.dt = dt
+        self.log_hook = log_hook
+        self.L_dt = self.L * (self.CALIBRATION_DT / dt)
+
+        self.last_sensor_readings = np.zeros((4,1))
+        self.angular_vel_estimates = np.zeros((2,1))
+        self._diffs = np.zeros((4,1))
+
+
+    def reset(self):
+        """
+        Forgets the previous sensor readings (e.g. before starting a new run).
+        """
+        self.last_sensor_readings[...] = 0.0
+        self.angular_vel_estimates[...] = 0.0
+
+
+    def update(self, new_readings, torque_gen, position = None):
+        """
+        ==== ARGUMENTS ====
+        new_readings = (4,1) sensor readings of the current time step
+        torque_gen   = torque generated during the current time step
+        position     = robot's (x, z) position, unused (kalman_filter.py uses it)
+
+        ==== RETURNS ====
+        angular_vel_estimates = (2,1) estimated angular velocities about Y and X axes.
+                                This is the observer's own buffer and is overwritten
+                                by the next update, copy it to keep it around
+        """
+        np.subtract(new_readings, self.last_sensor_readings, out=self._diffs)
+        self.last_sensor_readings[...] = new_readings
+
+        np.dot(self.L_dt, self._diffs, out=self.angular_vel_estimates)
+        self.angular_vel_estimates[0,0] += self.dt*torque_gen
+
+        if self.log_hook is not None:
+            self.log_hook(self.angular_vel_estimates)
+
+        return self.angular_vel_estimates
+
+
+    def update_many(self, new_readings, torque_gen):
+        """
+        Same as calling update() for each of several consecutive sensor readings (e.g.
+        every reading taken during one control step, see multirate.py), in one
+        vectorized pass.
+
+        ==== ARGUMENTS ====
+        new_readings = (n,4) sensor readings, oldest first
+        torque_gen   = torque generated while they were taken
+
+        ==== RETURNS ====
+        angular_vel_estimates = (n,2) estimate after each reading. The last one is also
+                                left in the observer's buffer, as update() would
+        """
+        if len(new_readings) == 0:
+            return np.zeros((0,2))
+
+        diffs = np.diff(np.vstack([self.last_sensor_readings.T, new_readings]), axis=0)
+        self.last_sensor_readings[:,0] = new_readings[-1]
+
+        estimates = diffs.dot(self.L_dt.T)
+        estimates[:,0] += self.dt*torque_gen
+        self.angular_vel_estimates[:,0] = estimates[-1]
+
+        if self.log_hook is not None:
+            for estimate in estimates:
+                self.log_hook(estimate.reshape(2,1))
+
+        return estimates
@@ -0,0 +1,238 @@
+"""
+Description:
+    Cache for the robot's plant matrices (A and B), LQR gains and Kalman filter gains.
+
+    The plant only depends on the robot's physical constants, but it used to be rebuilt
+    with np.zeros on every call to updateState_LQR_Control() and updateState_PD_Control(),
+    and LQR_gains() solved the Riccati equation on every run_lqr() call. The PlantCache
+    builds each of these once per set of constants and hands back the same read-only
+    arrays on every later call. It holds a bounded number of entries, evicting the least
+    recently used one when full, and entries can be dropped explicitly when one of the
+    constants they were built from changes. It's shared by every robot, so it's
+    locked for robots running in separate threads.
+"""
+
+
+from collections import OrderedDict
+import threading
+import numpy as np
+
+# Physical constants the plant depends on, in the order they appear in cache keys
+CONSTANT_NAMES = ('g', 'LIFT_COEFFICIENT', 'B_w', 'MASS', 'Rw', 'Jz')
+
+class PlantCache(object):
+
+    def __init__(self, maxsize = 64):
+        """
+        ==== ARGUMENTS ====
+        maxsize = maximum number of plants/gains held before the least recently
+                  used entry is evicted
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        # reentrant, building the LQR gains looks up the plant
+        self._lock = threading.RLock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def _lookup(self, key, build):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                value = build()
+                self._entries[key] = value
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+        return value
+
+
+    def lateral_plant(self, g, lift, B_w, MASS, Rw, Jz):
+        """
+        A and B matrices of the lateral (x, x_dot, theta, theta_dot) dynamics used by
+        the LQR controller. See updateState_LQR_Control() for the layout.
+
+        ==== ARGUMENTS ====
+        g, lift, B_w, MASS, Rw, Jz = the robot's physical constants. If lift is None,
+                                     A[3,0] (the only lift dependent term) is left at
+                                     0 so the caller can add g*lift*theta itself; the
+                                     altitude controller changes the lift every step
+
+        ==== RETURNS ====
+        A = (4,4) read-only state matrix
+        B = (4,1) read-only input matrix
+        """
+        constants = (g, lift, B_w, MASS, Rw, Jz)
+
+        def build():
+            A = np.zeros((4, 4))
+            B = np.zeros(4).reshape(4,1)
+            #Derivative of angular positon is angular velocity
+            A[0,1] = 1
+            #Derivative of position is velocity
+            A[2,3] = 1
+
+            # V_x_dot terms
+            if lift is not None:
+                A[3,0] = g*lift
+            A[3,3] = -B_w / MASS
+
+            # Theta_dot term(s)
+            A[1,3] = -Rw*B_w / Jz
+
+            #Coefficients for input matrix B
+            B[1] = 1 / Jz
+
+            A.setflags(write=False)
+            B.setflags(write=False)
+            return A, B
+
+        return self._lookup(('lateral', constants), build)
+
+
+    def pd_plant(self, g, lift, B_w, MASS, Rw, Jz):
+        """
+        A and B matrices used by updateState_PD_Control(), where B maps theta and
+        theta_dot to the torque generated by the PD controller.
+
+        ==== RETURNS ====
+        A = (4,4) read-only state matrix
+        B = (4,4) read-only input matrix
+        """
+        constants = (g, lift, B_w, MASS, Rw, Jz)
+
+        def build():
+            A = np.zeros((4, 4))
+            B = np.zeros((4, 4))
+            A[0,1] = 1
+            A[2,3] = 1
+            A[3,0] = g*lift
+            A[3,3] = -B_w
+            A[1,3] = -Rw*B_w / Jz
+
+            torque_constant_prop = 4e-7
+            torque_constant_deriv = 0.7e-7
+            B[1,0] = -torque_constant_prop / Jz
+            B[1,1] = -torque_constant_deriv / Jz
+
+            A.setflags(write=False)
+            B.setflags(write=False)
+            return A, B
+
+        return self._lookup(('pd', constants), build)
+
+
+    def lqr_gains(self, g, lift, B_w, MASS, Rw, Jz, Q, R):
+        """
+        Gains of the lateral LQR controller, only solving the Riccati equation the
+        first time a given set of constants, Q and R is seen.
+
+        ==== ARGUMENTS ====
+        g, lift, B_w, MASS, Rw, Jz = the robot's physical constants
+        Q = (4,4) state weighting matrix
+        R = input weighting (scalar)
+
+        ==== RETURNS ====
+        gains = (1,4) read-only gain matrix K, the controller's input is u = -K*x
+        """
+        Q = np.asarray(Q, dtype=float)
+        constants = (g, lift, B_w, MASS, Rw, Jz)
+
+        def build():
+            # imported here since loading the control library is slow, and it's only
+            # needed the first time a set of gains is computed
+            import control
+
+            A, B = self.lateral_plant(*constants)
+            gains, ricatti, eigs = control.lqr(A, B, Q, R)
+
+            gains = np.array(gains, dtype=float)
+            gains.setflags(write=False)
+            return gains
+
+        return self._lookup(('lqr', constants, Q.shape, Q.tobytes(), float(R)), build)
+
+
+    def kalman_gain(self, g, lift, B_w, MASS, Rw, Jz, dt, H, W, V):
+        """
+        Steady state gain of the Kalman filter on the lateral model (see
+        kalman_filter.py), only solving the discrete Riccati equation the first time a
+        given set of constants, time step and noise covariances is seen.
+
+        ==== ARGUMENTS ====
+        g, lift, B_w, MASS, Rw, Jz = the robot's physical constants
+        dt = time step between filter updates [seconds]
+        H  = (m,4) measurement matrix
+        W  = (4,4) process noise covariance
+        V  = (m,m) measurement noise covariance
+
+        ==== RETURNS ====
+        gain       = (4,m) read-only Kalman gain
+        covariance = (4,4) read-only covariance of the estimate after each update
+        """
+        H = np.asarray(H, dtype=float)
+        W = np.asarray(W, dtype=float)
+        V = np.asarray(V, dtype=float)
+        constants = (g, lift, B_w, MASS, Rw, Jz)
+
+        def build():
+            # imported here for the same reason as the control library above
+            from scipy.linalg import solve_discrete_are
+
+            # theta_ddot is the filter's input (torque_gen), so its row is left out
+            A, B = self.lateral_plant(*constants)
+            F = np.identity(4) + dt*A
+            F[1] = [0, 1, 0, 0]
+
+            # covariance of the prediction, then of the estimate after the update
+            prediction = solve_discrete_are(F.T, H.T, W, V)
+            gain = np.linalg.solve(H.dot(prediction).dot(H.T) + V, H.dot(prediction)).T
+            covariance = (np.identity(4) - gain.dot(H)).dot(prediction)
+
+            gain.setflags(write=False)
+            covariance.setflags(write=False)
+            return gain, covariance
+
+        return self._lookup(('kalman', constants, float(dt), H.shape, H.tobytes(), W.tobytes(), V.tobytes()),
+                            build)
+
+
+    def invalidate(self, **constants):
+        """
+        Drops cached entries that were built from the given constant values, e.g.
+        invalidate(MASS=0.08) when the robot's mass changes. With no arguments the
+        whole cache is cleared.
+
+        ==== RETURNS ====
+        removed = number of entries dropped
+        """
+        with self._lock:
+            if not constants:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+
+            indices = [ (CONSTANT_NAMES.index(name), value) for name, value in constants.items() ]
+            stale = [ key for key in self._entries
+                      if any(key[1][index] == value for index, value in indices) ]
+
+            for key in stale:
+                del self._entries[key]
+
+        return len(stale)
+
+
+# Cache shared by every roboBee instance (entries are keyed on the constants, so
+# robots with different constants don't collide)
+PLANT_CACHE = PlantCache()
@@ -0,0 +1,73 @@
+"""
+Description:
+    Plots of recorded roboBee trajectories, split out of run_lqr() and run_pd().
+
+    matplotlib is only imported the first time a plot is made, so simulations that
+    don't plot (e.g. batch jobs on a headless machine) never pay for loading it.
+    The functions take the arrays run_lqr() and run_pd() return, so runs can also
+    be plotted after the fact, e.g. from data streamed to disk.
+"""
+
+
+import numpy as np
+
+def plot_lqr_run(state_data, sensor_data, dt):
+    """
+    ==== ARGUMENTS ====
+    state_data  = (n,8) state data returned by run_lqr() (6 states, then desired x and z)
+    sensor_data = (n,2) angular velocity estimates from the sensors at each time step
+    dt          = time step [seconds]
+    """
+    import matplotlib.pyplot as plt
+
+    # Create time array to plot state data against
+    t = np.linspace(0, dt*state_data.shape[0], state_data.shape[0])
+
+    plt.figure(figsize=[8,6])
+    plt.title("Comparing Actual and Estimated Angular Velocity")
+    plt.plot(t, sensor_data[:,0], label="Estimates from Sensors")
+    plt.plot(t, state_data[:,1], label="Actual Angular Velocity Values")
+    plt.plot(t, state_data[:,0], label="Actual Theta Value")
+    plt.ylabel("Rotational Velocity [rad/sec]")
+    plt.xlabel("Time [sec]")
+    plt.xlim(0,1)
+    plt.legend()
+    plt.show()
+
+    plt.figure(figsize=[9,7])
+    plt.suptitle("LQR Controller - Position (Desired Position x=%4.2f, y=%4.2f)" % (state_data[0,6], state_data[0,7]))
+    plt.subplot(1,2,1)
+    plt.plot(state_data[:,2], state_data[:,4])
+    plt.ylabel('Y [m]')
+    plt.xlabel('X [m]')
+    plt.grid()
+
+    plt.subplot(1,2,2)
+    plt.plot(t, state_data[:,0], label='Theta  [rad]')
+    plt.plot(t, state_data[:,1], label='Omega (Theta Dot)  [rad/sec]')
+    plt.xlim(0,1) #angle usually congeres within first 100 time steps of simulation
+    plt.xlabel("Time [sec]")
+    plt.ylabel("Magnitude")
+    plt.legend()
+    plt.show()
+
+
+def plot_pd_run(state_data, dt):
+    """
+    ==== ARGUMENTS ====
+    state_data = (n,4) state data returned by run_pd()
+    dt         = time step [seconds]
+    """
+    import matplotlib.pyplot as plt
+
+    t = np.linspace(0, dt*state_data.shape[0], state_data.shape[0])
+
+    plt.plot(t, state_data[:,3], label='Velocity [m/s]')
+    plt.plot(t, state_data[:,1], label='Angular Velocity [rad/s]')
+    plt.plot(t, state_data[:,0], label='Angular Position [rad]')
+    plt.grid()
+    plt.legend()
+    plt.ylabel("Magnitude")
+    plt.xlabel("time [sec]")
+    plt.title("State Space - PD Controller")
+    plt.show()
@@ -0,0 +1,169 @@
+"""
+Description:
+    Opt-in per phase profiling of the simulation loops.
+
+    A PhaseProfiler adds up the wall time and number of calls of each phase of a
+    run: reading the sensors, estimating the angular velocity, the LQR (or PD) update,
+    the altitude controller, logging and plotting. Times are exclusive, so a phase
+    called from inside another one (e.g. the altitude controller inside
+    updateState_LQR_Control) is only counted once, and the phases add up to the time
+    actually spent.
+
+    Nothing is timed unless a profiler is attached: the roboBee methods are only
+    wrapped on the instance being profiled, and the run loops check for a profiler
+    once per time step around their logging.
+
+    Example:
+        with profile(bee) as profiler:
+            bee.run_lqr(1000, plots=False)
+        print(profiler.report())
+
+    profiler.phase(name) also times any block of code as its own phase.
+"""
+
+
+from contextlib import contextmanager
+import time
+
+# roboBee methods timed by instrument()
+PROFILED_METHODS = ('readSensors', 'getAngularVel', 'updateState_LQR_Control', 'updateState_LQR_Nonlinear',
+                    '_altitude_controller', 'updateState_PD_Control', 'updateState_analytical')
+
+
+class PhaseProfiler(object):
+
+    def __init__(self):
+        self.times = {} #exclusive wall time of each phase [seconds]
+        self.calls = {}
+        self.total = 0.0 #wall time of the profiled runs, see profile()
+
+        self._nested = 0.0 #time spent in phases called from the one running now
+
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+        self.total = 0.0
+
+
+    def add(self, phase, seconds, calls = 1):
+        """
+        Adds time to a phase directly, for code that times itself (see run_lqr()).
+        """
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+        # so a phase this is called from doesn't count it again
+        self._nested += seconds
+
+
+    def _finish(self, name, elapsed, outer):
+        # the phase's own time leaves out the phases called from it
+        self.times[name] = self.times.get(name, 0.0) + elapsed - self._nested
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self._nested = outer + elapsed
+
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the code in a with block as the phase name.
+        """
+        outer = self._nested
+        self._nested = 0.0
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self._finish(name, time.perf_counter() - start, outer)
+
+
+    def wrap(self, name, function):
+        """
+        ==== RETURNS ====
+        timed_function = function, with every call timed as the phase name
+        """
+        def timed_function(*args, **kwargs):
+            outer = self._nested
+            self._nested = 0.0
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._finish(name, time.perf_counter() - start, outer)
+
+        return timed_function
+
+
+    def instrument(self, bee):
+        """
+        Starts timing a roboBee instance's per step methods (PROFILED_METHODS) and the
+        logging and plotting in its run loops. Other instances aren't affected.
+        """
+        for name in PROFILED_METHODS:
+            setattr(bee, name, self.wrap(name, getattr(bee, name)))
+        bee.profiler = self
+
+
+    def release(self, bee):
+        """
+        Undoes instrument().
+        """
+        for name in PROFILED_METHODS:
+            bee.__dict__.pop(name, None)
+        bee.__dict__.pop('profiler', None)
+
+
+    def results(self):
+        """
+        ==== RETURNS ====
+        results = dictionary with the time [seconds], number of calls and time per call
+                  of each phase, plus 'other' (time of the profiled runs that isn't in
+                  any phase) if profile() timed the runs
+        """
+        results = { phase: { 'time': seconds, 'calls': self.calls[phase],
+                             'per_call': seconds / self.calls[phase] if self.calls[phase] else 0.0 }
+                    for phase, seconds in self.times.items() }
+
+        if self.total > 0:
+            other = self.total - sum(self.times.values())
+            results['other'] = { 'time': other, 'calls': 1, 'per_call': other }
+
+        return results
+
+
+    def report(self):
+        results = self.results()
+        total = self.total if self.total > 0 else sum(result['time'] for result in results.values())
+
+        lines = [ "%-26s %10s %10s %12s %7s" % ("phase", "time [ms]", "calls", "per call [us]", "share") ]
+        for phase, result in sorted(results.items(), key=lambda item: -item[1]['time']):
+            lines.append("%-26s %10.2f %10d %12.2f %6.1f%%"
+                         % (phase, result['time']*1e3, result['calls'], result['per_call']*1e6,
+                            100*result['time'] / total if total > 0 else 0.0))
+        lines.append("%-26s %10.2f" % ("total", total*1e3))
+
+        return "\n".join(lines)
+
+
+@contextmanager
+def profile(bee, profiler = None):
+    """
+    Profiles everything a roboBee does inside the with block.
+
+    ==== ARGUMENTS ====
+    bee      = roboBee instance to profile
+    profiler = PhaseProfiler to add the times to, a new one by default
+
+    ==== YIELDS ====
+    profiler = the PhaseProfiler, whose results are complete once the block ends
+    """
+    if profiler is None:
+        profiler = PhaseProfiler()
+
+    profiler.instrument(bee)
+    start = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        profiler.total += time.perf_counter() - start
+        profiler.release(bee)
@@ -0,0 +1,102 @@
+"""
+Description:
+    Small array-backed quaternion helpers used for the roboBee's attitude (see
+    analytical_model.py), so the simulator doesn't need pyquaternion or similar.
+
+    Quaternions are stored as float arrays whose last axis holds (w, x, y, z), so every
+    function works on a single quaternion of shape (4,) as well as on stacks of them,
+    e.g. one per robot of shape (N,4). Rotations use the usual convention that a unit
+    quaternion q rotates a vector v to q*v*conj(q), counterclockwise about its axis.
+"""
+
+
+import numpy as np
+
+IDENTITY = np.array([1.0, 0.0, 0.0, 0.0])
+IDENTITY.setflags(write=False)
+
+
+def multiply(p, q):
+    """
+    ==== ARGUMENTS ====
+    p, q = quaternions (shape (...,4)), broadcast against each other
+
+    ==== RETURNS ====
+    pq = the Hamilton product p*q, i.e. the rotation q followed by the rotation p
+    """
+    p = np.asarray(p, dtype=float)
+    q = np.asarray(q, dtype=float)
+    pw, px, py, pz = p[...,0], p[...,1], p[...,2], p[...,3]
+    qw, qx, qy, qz = q[...,0], q[...,1], q[...,2], q[...,3]
+
+    return np.stack([pw*qw - px*qx - py*qy - pz*qz,
+                     pw*qx + px*qw + py*qz - pz*qy,
+                     pw*qy - px*qz + py*qw + pz*qx,
+                     pw*qz + px*qy - py*qx + pz*qw], axis=-1)
+
+
+def conjugate(q):
+    q = np.array(q, dtype=float)
+    q[...,1:] *= -1.0
+    return q
+
+
+def normalize(q):
+    q = np.asarray(q, dtype=float)
+    return q / np.sqrt(np.sum(q*q, axis=-1, keepdims=True))
+
+
+def exp_map(rotation_vector):
+    """
+    ==== ARGUMENTS ====
+    rotation_vector = axis of rotation scaled by the angle [rad] (shape (...,3)),
+                      e.g. angular velocity * dt
+
+    ==== RETURNS ====
+    q = unit quaternion of that rotation (shape (...,4)). Exact for any angle, with
+        a series expansion near zero so tiny rotations don't divide by zero
+    """
+    rotation_vector = np.asarray(rotation_vector, dtype=float)
+    half_angle = 0.5 * np.sqrt(np.sum(rotation_vector*rotation_vector, axis=-1, keepdims=True))
+
+    # sin(half_angle) / (2*half_angle), the scale from rotation vector to x, y, z
+    small = half_angle < 1e-4
+    safe_angle = np.where(small, 1.0, half_angle)
+    scale = np.where(small, 0.5 - half_angle*half_angle / 12.0, np.sin(safe_angle) / (2.0*safe_angle))
+
+    return np.concatenate([np.cos(half_angle), scale*rotation_vector], axis=-1)
+
+
+def to_rotation_matrix(q):
+    """
+    ==== ARGUMENTS ====
+    q = unit quaternion(s), shape (...,4)
+
+    ==== RETURNS ====
+    R = rotation matrices (shape (...,3,3)) such that R.dot(v) rotates v by q
+    """
+    q = np.asarray(q, dtype=float)
+    w, x, y, z = q[...,0], q[...,1], q[...,2], q[...,3]
+    xx, yy, zz = x*x, y*y, z*z
+    xy, xz, yz = x*y, x*z, y*z
+    wx, wy, wz = w*x, w*y, w*z
+
+    R = np.stack([1 - 2*(yy + zz), 2*(xy - wz),     2*(xz + wy),
+                  2*(xy + wz),     1 - 2*(xx + zz), 2*(yz - wx),
+                  2*(xz - wy),     2*(yz + wx),     1 - 2*(xx + yy)], axis=-1)
+
+    return R.reshape(q.shape[:-1] + (3,3))
+
+
+def rotate(q, vectors):
+    """
+    Rotates many vectors by the same quaternion in one matrix product.
+
+    ==== ARGUMENTS ====
+    q       = unit quaternion, shape (4,)
+    vectors = vectors to rotate, one per row (shape (...,3))
+
+    ==== RETURNS ====
+    rotated = the rotated vectors, same shape as vectors
+    """
+    return np.dot(vectors, to_rotation_matrix(q).T)
@@ -16,10 +16,20 @@ Description:
 """
 
 
+import time
 import numpy as np
-import matplotlib.pyplot as plt
-import control
-from random import seed, random
+from random import Random
+
+from plant_cache import PLANT_CACHE, CONSTANT_NAMES
+from sensor_model import SensorModel
+from observer import AngularVelocityObserver
+from kalman_filter import KalmanFilter
+from altitude_controller import altitude_control
+from plotting import plot_lqr_run, plot_pd_run
+from trajectory_recorder import make_recorder
+from nonlinear_plant import NonlinearPlant
+from convergence import L1Criterion
+from robot_parameters import RobotParameters, PARAMETER_NAMES
 
 class roboBee(object):
 
@@ -33,7 +43,71 @@ class roboBee(object):
     dt = 1/120 #1/120 #time step in seconds; represents one step at 120 Hz
 
     LIFT_COEFFICIENT = 1.0
-    last_sensor_readings = np.array([0.0, 0.0, 0.0, 0.0]).reshape(4,1)
+
+    # LQR weights (see LQR_gains()), set them on an instance to tune its controller
+    LQR_Q = (100, 1, 100, 0.1) #diagonal of the state weighting matrix Q
+    LQR_R = 5e15 #input weighting
+
+    # Plant matrices and LQR gains are looked up here instead of being rebuilt
+    plant_cache = PLANT_CACHE
+    # Phototransistor model used by readSensors()
+    sensor_model = SensorModel()
+    # PhaseProfiler timing this robot's runs, only set while profiling (see profiling.py)
+    profiler = None
+
+
+    def __init__(self, parameters = None):
+        """
+        ==== ARGUMENTS ====
+        parameters = optional RobotParameters (see robot_parameters.py) to use instead
+                     of the class's constants
+        """
+        if parameters is not None:
+            for name, value in zip(PARAMETER_NAMES, parameters):
+                setattr(self, name, value)
+
+        # Everything below (and the lift coefficient, which the altitude controller
+        # changes) belongs to this robot alone, so robots can fly in separate threads
+        # without touching each other's state
+        self.LIFT_COEFFICIENT = self.LIFT_COEFFICIENT
+        # Each robot has its own observer, so its sensor history isn't shared with
+        # other instances. Set self.observer.log_hook (e.g. to print) to see its estimates
+        self.observer = AngularVelocityObserver(self.dt)
+        # Nonlinear 12 state model, built the first time it's used (see analytical_model.py)
+        self.analytical_model = None
+        # Plant driven by the LQR in run_lqr(dynamics='nonlinear')
+        self.nonlinear_plant = None
+
+
+    @property
+    def parameters(self):
+        """
+        Read-only snapshot of the robot's current parameters (RobotParameters).
+        """
+        return RobotParameters.of(self)
+
+
+    @property
+    def last_sensor_readings(self):
+        return self.observer.last_sensor_readings
+
+    @last_sensor_readings.setter
+    def last_sensor_readings(self, readings):
+        self.observer.last_sensor_readings[...] = readings
+
+
+    def set_constant(self, name, value):
+        """
+        Changes one of the robot's physical constants (g, LIFT_COEFFICIENT, B_w, MASS,
+        Rw or Jz) and drops the cached plants and gains that were built with its old
+        value.
+        """
+        if name not in CONSTANT_NAMES:
+            raise ValueError("%s is not one of the plant constants %s" % (name, CONSTANT_NAMES))
+
+        self.plant_cache.invalidate(**{name: getattr(self, name)})
+        setattr(self, name, value)
+        self.analytical_model = None
 
 
     def updateState_PD_Control(self, state, dt):
@@ -80,28 +154,10 @@ class roboBee(object):
         u[0] = state[0]
         u[1] = state[1]
 
-
-        A = np.zeros((4, 4))
-        B = np.zeros((4, 4))
-        #Derivative of angular positon is angular velocity
-        A[0,1] = 1
-        #Derivative of position is velocity
-        A[2,3] = 1
-
-        # V_x_dot terms
-        A[3,0] = self.g*self.LIFT_COEFFICIENT
-        A[3,3] = -self.B_w
-
-        # Theta_dot term(s)
-        A[1,3] = -self.Rw*self.B_w / self.Jz
-
-
-        #Apply input torque (as of now this is just the torque generated by torque
-        #controller that keeps robot upright)
-        torque_constant_prop = 4e-7
-        torque_constant_deriv = 0.7e-7
-        B[1,0] = -torque_constant_prop / self.Jz
-        B[1,1] = -torque_constant_deriv / self.Jz
+        # A holds the plant physics, B applies the input torque (as of now this is just
+        # the torque generated by the PD controller that keeps the robot upright). Both
+        # are built once by the plant cache, see PlantCache.pd_plant()
+        A, B = self.plant_cache.pd_plant(self.g, self.LIFT_COEFFICIENT, self.B_w, self.MASS, self.Rw, self.Jz)
 
 
         state_dot = A.dot(state) + B.dot(u)
@@ -155,61 +211,101 @@ class roboBee(object):
         """
 
 
-        A = np.zeros((4, 4))
-        B = np.zeros(4).reshape(4,1)
-        #Derivative of angular positon is angular velocity
-        A[0,1] = 1
-        #Derivative of position is velocity
-        A[2,3] = 1
+        # Plant without its lift dependent term, which is added below since the altitude
+        # controller changes the lift coefficient every step (see PlantCache.lateral_plant())
+        A, B = self.plant_cache.lateral_plant(self.g, None, self.B_w, self.MASS, self.Rw, self.Jz)
 
-        # V_x_dot terms
-        A[3,0] = self.g*self.LIFT_COEFFICIENT
-        A[3,3] = -self.B_w / self.MASS
+        # (A - B*K)*x + B*K*x_desired
+        state_dot_lat = A.dot(state[:4]) + B.dot(gains.dot(state_desired[:4] - state[:4]))
+        state_dot_lat[3] += self.g*self.LIFT_COEFFICIENT*state[0]
 
-        # Theta_dot term(s)
-        A[1,3] = -self.Rw*self.B_w / self.Jz
-
-        #Coefficients for input matrix B
-        B[1] = 1 / self.Jz
 
+        self._altitude_controller(state, state_desired)
 
+        # New state is calculated by taking last state, and multiplying the current
+        # rate of state change by the time step between states. It's written straight
+        # into one (6,1) array (see LQR_STATE_DTYPE in state_layout.py) instead of
+        # stacking the lateral and altitude parts
+        new_state = np.empty((6,1))
+        # lateral variables (theta, theta_dot, x, x_dot)
+        np.add(state[:4], state_dot_lat*dt, out=new_state[:4])
+        # altitude variables (z, z_dot), from the lift coefficient and orientation of robot
+        z_dot = state[5,0]
+        new_state[4,0] = state[4,0] + z_dot*dt
+        new_state[5,0] = z_dot + self.MASS*self.g*(self.LIFT_COEFFICIENT*np.cos(state[0,0]) - 1)*dt
 
-        state_dot_lat = (A - (B * gains)) * state[:4] + B * gains * state_desired[:4]
+        return new_state, state_dot_lat[1,0]
 
 
+    def _altitude_controller(self, state, state_desired):
         """  ALTITUDE CONTROLLER
                 All it does is adjust the lift force based on where the robot is
-                is to its desired altitude
+                is to its desired altitude. If the robot is already moving toward it
+                fast enough, z_dot (state[5]) is nudged toward zero instead
+                (see altitude_controller.py)
         """
+        state[5,0], self.LIFT_COEFFICIENT = altitude_control(state[4,0], state[5,0], state_desired[4,0],
+                                                             self.LIFT_COEFFICIENT)
 
-        adjustment = 0.02
-        if (state[5] > 0 and state[5] > (state_desired[4] - state[4])):
-            state[5] -= adjustment
-        elif (state[5] < 0 and state[5] < (state_desired[4] - state[4])):
-            state[5] += adjustment
-        else:
-            self.LIFT_COEFFICIENT = 1 + (state_desired[4] - state[4])
 
-        if (self.LIFT_COEFFICIENT > 1.5):
-            self.LIFT_COEFFICIENT = 1.5
-        elif (self.LIFT_COEFFICIENT < 0.5):
-            self.LIFT_COEFFICIENT = 0.5
+    def updateState_LQR_Nonlinear(self, state, dt, state_desired, gains, plant):
+        """
+        Same controller as updateState_LQR_Control(), but instead of moving the robot
+        with the linearized lateral model and forward Euler, the LQR's torque and the
+        altitude controller's lift drive the full nonlinear plant (see nonlinear_plant.py),
+        which keeps the robot's true state.
 
-        # Calculate change in z_axis position and z_axis velocity based on lift coefficient and orientation of robot
-        state_dot_alt = np.array([state[5], self.MASS*self.g*(self.LIFT_COEFFICIENT*np.cos(state[0]) - 1)]).reshape(2,1)
+        ==== ARGUMENTS ====
+        state, dt, state_desired, gains = see updateState_LQR_Control(). state is what
+                                          the controller sees (e.g. with estimated
+                                          theta_dot), not necessarily the true state
+        plant = NonlinearPlant (or LinearPlant) to advance by dt
 
-        # Combine change in state for lateral variables (x, x_dot, theta, theta_dot)
-        # and altitude variables (z, z_dot)
-        state_dot = np.vstack([state_dot_lat, state_dot_alt])
+        ==== RETURNS ====
+        new_state  = (6,1) true state of the robot one time step later
+        torque_gen = same as updateState_LQR_Control() returns
+        """
+        torque, torque_gen, lift = self._lqr_control(state, state_desired, gains, plant)
+        plant.advance(dt, torque, lift)
+
+        return plant.lqr_state(), torque_gen
 
-        # New state is calculated by taking last state, and multiplying the current
-        # rate of state change by the time step between states
-        new_state = state + state_dot*dt
 
-        return new_state, state_dot_lat[1]
+    def _lqr_control(self, state, state_desired, gains, plant):
+        """
+        Controller half of updateState_LQR_Nonlinear(): runs the LQR and the altitude
+        controller on the state the controller sees, and applies the altitude
+        controller's change to z_dot to the plant.
+
+        ==== RETURNS ====
+        torque     = torque the LQR tells the wings to generate
+        torque_gen = same as updateState_LQR_Control() returns
+        lift       = lift coefficient to hand the plant
+        """
+        A, B = self.plant_cache.lateral_plant(self.g, None, self.B_w, self.MASS, self.Rw, self.Jz)
+
+        torque = gains.dot(state_desired[:4] - state[:4])[0,0]
+        torque_gen = A[1].dot(state[:4])[0] + B[1,0]*torque
+
+        # the altitude controller's change to z_dot is applied to the true robot
+        z_dot = state[5,0]
+        self._altitude_controller(state, state_desired)
+        if state[5,0] != z_dot:
+            plant.add_vertical_velocity(state[5,0] - z_dot)
+
+        # The altitude controller was tuned on the linearized model, where z_dot_dot is
+        # MASS*g*(lift*cos(theta) - 1), while the real robot accelerates by
+        # g*(lift*cos(theta) - 1). Given the controller's full lift range the robot
+        # climbs fast enough for wing drag to tip it over, so the lift it hands the
+        # nonlinear plant is scaled back to give the vertical acceleration it was tuned for
+        lift = self.LIFT_COEFFICIENT
+        if isinstance(plant, NonlinearPlant):
+            lift = 1 + self.MASS*(lift - 1)
+
+        return torque, torque_gen, lift
 
 
-    def LQR_gains(self):
+    def LQR_gains(self, lift_coefficient = None, Q = None, R = None):
         """
         This function uses the Robot's physics and two matrices, Q and R, that the
         user can change to adjust controller performance. The Robot's A and B matrices
@@ -220,33 +316,24 @@ class roboBee(object):
         specified by the Q and R matrices, an array of eigen values for the closed
         loop system, and the solution to the Riccati equation.
 
-        ==== RETURNS ====
-
-
-        """
-        A = np.zeros((4, 4))
-        B = np.zeros(4).reshape(4,1)
-        #Derivative of angular positon is angular velocity
-        A[0,1] = 1
-        #Derivative of position is velocity
-        A[2,3] = 1
+        The A and B matrices come from PlantCache.lateral_plant(). Note: There are no
+        terms in the A matrix for V_z_dot because that is controlled by the altitude
+        controller which is decoupled from this controller (the latitude controller)
 
-        # V_x_dot terms
-        A[3,0] = self.g*self.LIFT_COEFFICIENT
-        A[3,3] = -self.B_w / self.MASS
-
-        # Theta_dot term(s)
-        A[1,3] = -self.Rw*self.B_w / self.Jz
-
-        #Note: There are no terms in the A matrix for V_z_dot because that is
-        #   controlled by the altitude controller which is decoupled from this
-        #   controller (the latitude controller)
+        The gains are cached too, so the Riccati equation is only solved the first
+        time a given set of constants, Q and R is used.
 
+        ==== ARGUMENTS ====
+        lift_coefficient = lift coefficient to linearize the plant around, defaults
+                           to the robot's current LIFT_COEFFICIENT
+        Q = state weighting, a (4,4) matrix or the 4 doubles on its diagonal, defaults
+            to the robot's LQR_Q
+        R = input weighting, defaults to the robot's LQR_R
 
-        #Coefficients for input matrix B
-        B[1] = 1 / self.Jz
+        ==== RETURNS ====
+        gains = (1,4) array of gains K, the LQR's input to the plant is u = -K*x
 
-        Q = np.zeros((4,4))
+        """
         """
         I was going to write out an explanation on how to choose proper Q and R matrix
         weights, but I think this paper does a great job:
@@ -255,23 +342,31 @@ class roboBee(object):
         Section 1 explains the basics of how a LQR works, and section 2 gives some
         guidelines on selecting weights for both.
         """
-        Q[0,0] = 100
-        Q[1,1] = 1
-        Q[2,2] = 100
-        Q[3,3] = 0.1
+        if Q is None:
+            Q = self.LQR_Q
+        Q = np.asarray(Q, dtype=float)
+        if Q.ndim == 1:
+            Q = np.diag(Q)
 
-        R = 5e15
+        if R is None:
+            R = self.LQR_R
 
         # If you're getting weird errors from this function call, try installing python
         # and all the libraries needed for this code in a conda environment using
         # anaconda prompt. That worked very well for me (the issue has to do with
         # numpy not always installing with something called mkl, that's all I know)
-        gains, ricatti, eigs = control.lqr(A, B, Q, R)
+        if lift_coefficient is None:
+            lift_coefficient = self.LIFT_COEFFICIENT
+
+        gains = self.plant_cache.lqr_gains(self.g, lift_coefficient, self.B_w, self.MASS,
+                                           self.Rw, self.Jz, Q, R)
 
         return gains
 
 
-    def run_lqr(self, timesteps, verbose = False, plots = True):
+    def run_lqr(self, timesteps, verbose = False, plots = True, state_desired = None, initial_state = None,
+                gain_schedule = None, quiet = False, stream_to = None, dynamics = 'linear', integrator = 'rk4',
+                convergence = None):
         """
         This function drives the LQR solver by calling the updateState_LQR_Control
         function a certain number of times (or until the desired state is reached).
@@ -281,7 +376,8 @@ class roboBee(object):
         separate arrays. This can be used as training data for a neural network
         that is being trained to replicate the LQR controller. The state data would
         serve as the input to such a network, and the torques generated would be
-        the output.
+        the output. The simulation itself is run by iter_lqr(), which can also be
+        used directly to consume each time step as it is computed.
 
         ==== ARGUMENTS ====
         timesteps = number of times the updateState_LQR_Control will be called before
@@ -292,6 +388,27 @@ class roboBee(object):
                   while simulation is running
         plots   = if set to true, this function will generate a few plots to outline
                   system performance during the simulation
+        state_desired = final state the robot is trying to get to (6 doubles, see
+                        updateState_LQR_Control()), defaults to hovering at x=2, z=2
+        initial_state = state the robot starts in (6 doubles), defaults to all zeros
+        gain_schedule = optional GainSchedule (see gain_schedule.py). If given, the gains
+                        are looked up for the current lift coefficient at every time step
+                        instead of being solved once for the lift the run started with
+        quiet   = if set to true, nothing is printed at the start and end of the run
+                  (e.g. when generating data in worker processes)
+        stream_to = optional directory. If given, the state, sensor estimate and torque
+                    logs are streamed to state.npy, sensor.npy and torque.npy in it as
+                    the simulation runs instead of being kept in memory (see
+                    StreamingTrajectoryRecorder), and the returned arrays are read-only
+                    memory maps of those files
+        dynamics   = 'linear' to move the robot with the linearized model the LQR is
+                     designed for, or 'nonlinear' to drive the full nonlinear plant
+                     (see updateState_LQR_Nonlinear())
+        integrator = how the nonlinear plant is integrated each time step: 'rk4',
+                     'rk45' (adaptive) or 'euler', see nonlinear_plant.py
+        convergence = optional criterion for when the desired state has been reached
+                      (see convergence.py), defaults to the sum of the absolute
+                      differences from the desired state being under 0.01
 
         ==== RETURNS ====
         state_data  = state of the robot at each time step (training input for a NN)
@@ -299,10 +416,122 @@ class roboBee(object):
                       time step (training output for a NN)
         """
 
-        print("Running Simulation with LQR controller...")
+        if not quiet:
+            print("Running Simulation with LQR controller...")
+
+        state_desired = self._lqr_setpoint(state_desired)
+        i = 0
+
+        # Logs are preallocated for every time step and trimmed if the desired
+        # state is reached early (or streamed to disk)
+        state_log = make_recorder('state', timesteps, 8, stream_to)
+        sensor_log = make_recorder('sensor', timesteps, 2, stream_to)
+        torque_log = make_recorder('torque', timesteps, None, stream_to)
+        profiler = self.profiler
+
+        # closes streamed logs even if the run fails part way
+        with state_log, sensor_log, torque_log:
+            for state, estimated_state, torque_gen, aVelEstimates in self.iter_lqr(timesteps, state_desired,
+                                                                                    initial_state, gain_schedule,
+                                                                                    dynamics, integrator,
+                                                                                    convergence):
+                if profiler is not None:
+                    start = time.perf_counter()
+
+                # Logging data at each time step
+                state_row = state_log.next_row()
+                state_row[:6] = state[:,0]
+                state_row[6] = state_desired[2,0]
+                state_row[7] = state_desired[4,0]
+                sensor_log.append(aVelEstimates[:,0])
+                torque_log.append(torque_gen)
+
+                # If verbose is set to true, this conditional periodically prints state
+                # data to the console
+                if i%10 == 0 and verbose:
+                    print("State at time step", i, ":\t", state)
+                    if (i != 0):
+                        print("A-Vel Estimates: ", aVelEstimates)
+
+                if profiler is not None:
+                    profiler.add('logging', time.perf_counter() - start)
+
+                i += 1
+
+        state_data = state_log.data()
+        sensor_data = sensor_log.data()
+        torque_data = torque_log.data()
+
+        if plots:
+            start = time.perf_counter()
+            plot_lqr_run(state_data, sensor_data, self.dt)
+            if profiler is not None:
+                profiler.add('plotting', time.perf_counter() - start)
+
+        if not quiet:
+            print("Done!")
+            if i == timesteps:
+                print("Destination not reached in", i, "time steps.")
+            else:
+                print("Destination reached in", i, "time steps.")
 
-        state = np.zeros(6).reshape(6,1)
-        state_desired = np.array([0.0, 0.0, 2, 0.0, 2, 0.0]).reshape(6,1)
+        return state_data, torque_data
+
+
+    def _lqr_setpoint(self, state_desired):
+        # (6,1) desired state, defaulting to hovering at x=2, z=2
+        if state_desired is None:
+            return np.array([0.0, 0.0, 2, 0.0, 2, 0.0]).reshape(6,1)
+        return np.array(state_desired, dtype=float).reshape(6,1)
+
+
+    def iter_lqr(self, timesteps = None, state_desired = None, initial_state = None, gain_schedule = None,
+                 dynamics = 'linear', integrator = 'rk4', convergence = None):
+        """
+        Generator version of run_lqr(): runs the same simulation, but instead of
+        logging anything it yields each time step's data as soon as it has been
+        computed. This lets online consumers (a NN trainer, a live plot, a custom
+        stopping criterion...) pull data at their own rate without the simulator
+        holding the whole history. Stop iterating to end the simulation early.
+
+        ==== ARGUMENTS ====
+        timesteps     = maximum number of time steps, or None to keep going until the
+                        desired state is reached
+        state_desired, initial_state, gain_schedule, dynamics, integrator, convergence = see run_lqr()
+
+        ==== YIELDS ====
+        state           = (6,1) state of the robot at the start of the time step
+        estimated_state = (6,1) state the controller acted on (theta_dot is the
+                          estimate from the sensors, z_dot includes the altitude
+                          controller's adjustment)
+        torque_gen      = torque the LQR told the robot to generate this time step
+        sensor_estimate = (2,1) angular velocity estimates from the sensors
+        """
+        if initial_state is None:
+            state = np.zeros(6).reshape(6,1)
+        else:
+            state = np.array(initial_state, dtype=float).reshape(6,1)
+
+        state_desired = self._lqr_setpoint(state_desired)
+
+        # a Kalman filter starts every run from the run's initial state, and the first
+        # time step uses that estimate (the finite difference observer has nothing to
+        # go on until the second step, and keeps its last readings as it always has)
+        initial_estimates = np.zeros((2,1))
+        if isinstance(self.observer, KalmanFilter):
+            self.observer.reset(state)
+            initial_estimates[0,0] = state[1,0]
+
+        if dynamics == 'nonlinear':
+            # the plant is kept around so its full state can be looked at afterwards
+            self.nonlinear_plant = NonlinearPlant(self, integrator)
+            self.nonlinear_plant.set_lqr_state(state)
+        elif dynamics != 'linear':
+            raise ValueError("dynamics must be 'linear' or 'nonlinear', not %r" % (dynamics,))
+
+        if convergence is None:
+            convergence = L1Criterion()
+        convergence.reset()
 
         gains = self.LQR_gains()
         torque_gen = 0
@@ -310,98 +539,41 @@ class roboBee(object):
         pointReached = False
         i = 0
 
-        while i < timesteps and not pointReached:
-            # if the sum of the differences of each state variable and its desired value
-            # is less than 0.01, the simulation will stop as the robot has (more or less)
-            # reached its desired state
-            diff = sum( abs(state - state_desired) )
-            if diff < 0.01:
+        while (timesteps is None or i < timesteps) and not pointReached:
+            # by default, if the sum of the differences of each state variable and its
+            # desired value is less than 0.01, the simulation will stop as the robot has
+            # (more or less) reached its desired state
+            if convergence.update(state, state_desired):
                 pointReached = True
 
-            # Logging data at each time step
             if (i==0):
-                state_data = np.vstack([ state, state_desired[2], state_desired[4] ])
-                sensor_data = np.array([0.0, 0.0]).reshape(2,1)
-                aVelEstimates = np.array([0.0, 0.0]).reshape(2,1)
+                aVelEstimates = initial_estimates
             else:
-                state_data = np.hstack([ state_data, np.vstack([state, state_desired[2], state_desired[4] ])  ])
-                new_reading = self.readSensors(state[0])
-                aVelEstimates = self.getAngularVel(new_reading, torque_gen)
-                sensor_data = np.hstack([ sensor_data, aVelEstimates ])
-
-            # If verbose is set to true, this conditional periodically prints state
-            # data to the console
-            if i%10 == 0 and verbose:
-                print("State at time step", i, ":\t", state)
-                if (i != 0):
-                    print("A-Vel Estimates: ", aVelEstimates)
+                new_reading = self.readSensors(state[0,0], state[2::2,0])
+                # copied since the observer reuses its buffer next time step
+                aVelEstimates = self.getAngularVel(new_reading, torque_gen, state[2::2,0]).copy()
 
             estimated_state = state.copy()
             estimated_state[1] = aVelEstimates[0]
 
+            # the altitude controller changes the lift coefficient, which the plant
+            # (and so the ideal gains) depends on
+            if gain_schedule is not None:
+                gains = gain_schedule.gains_at(self.LIFT_COEFFICIENT)
 
-
-
-            state, torque_gen = self.updateState_LQR_Control(estimated_state, self.dt, state_desired, gains)
-
-            if (i==0):
-                torque_data = np.array(torque_gen)
+            if dynamics == 'nonlinear':
+                new_state, torque_gen = self.updateState_LQR_Nonlinear(estimated_state, self.dt, state_desired,
+                                                                       gains, self.nonlinear_plant)
             else:
-                torque_data = np.append(torque_data, torque_gen)
-
-            i += 1
+                new_state, torque_gen = self.updateState_LQR_Control(estimated_state, self.dt, state_desired, gains)
 
-        state_data = np.array(state_data)
+            yield state, estimated_state, torque_gen, aVelEstimates
 
-        # Create time array to plot state data against
-        t = np.linspace(0, self.dt*state_data.shape[1], state_data.shape[1])
-
-        if plots:
-            plt.figure(figsize=[8,6])
-            plt.title("Comparing Actual and Estimated Angular Velocity")
-            plt.plot(t, sensor_data[0,:], label="Estimates from Sensors")
-            plt.plot(t, state_data[1,:], label="Actual Angular Velocity Values")
-            plt.plot(t, state_data[0,:], label="Actual Theta Value")
-            plt.ylabel("Rotational Velocity [rad/sec]")
-            plt.xlabel("Time [sec]")
-            plt.xlim(0,1)
-            #plt.ylim(-2,2)
-            plt.legend()
-            plt.show()
-
-            plt.figure(figsize=[9,7])
-            plt.suptitle("LQR Controller - Position (Desired Position x=%4.2f, y=%4.2f)" % (state_desired[2], state_desired[4]))
-            #plt.suptitle("LQR Controller (R = 10)")
-            plt.subplot(1,2,1)
-            plt.plot(state_data[2,:], state_data[4,:])
-            plt.ylabel('Y [m]')
-            plt.xlabel('X [m]')
-            #plt.plot(t, state_data[2,:])
-            #plt.ylabel('X [m]')
-            #plt.xlabel("t [sec]")
-            plt.grid()
-
-
-            plt.subplot(1,2,2)
-            plt.plot(t, state_data[0,:], label='Theta  [rad]')
-            plt.plot(t, state_data[1,:], label='Omega (Theta Dot)  [rad/sec]')
-            plt.xlim(0,1) #angle usually congeres within first 100 time steps of simulation
-            #plt.ylim(-0.5,0.5)
-            plt.xlabel("Time [sec]")
-            plt.ylabel("Magnitude")
-            plt.legend()
-            plt.show()
-
-        print("Done!")
-        if i == timesteps:
-            print("Destination not reached in", i, "time steps.")
-        else:
-            print("Destination reached in", i, "time steps.")
-
-        return np.transpose(state_data), torque_data
+            state = new_state
+            i += 1
 
 
-    def run_pd(self, timesteps, verbose = False, plots = True):
+    def run_pd(self, timesteps, verbose = False, plots = True, stream_to = None):
         """
         This function drives the PD controller by calling the updateState_PD_Control
         function a number of times equal to the timesteps argument. It logs state,
@@ -421,6 +593,8 @@ class roboBee(object):
                   while simulation is running
         plots   = if set to true, this function will generate a few plots to outline
                   system performance during the simulation
+        stream_to = optional directory to stream the state and torque logs to, see
+                    run_lqr()
 
         ==== RETURNS ====
         state_data  = state of the robot at each time step (training input for a NN)
@@ -428,58 +602,116 @@ class roboBee(object):
                       time step (training output for a NN)
         """
         print("Running simulation with PD controller...")
-        seed(0) #initializes random number generator
+        rng = Random(0) #this run's own random number generator
         state = np.zeros(4)
 
-        state[1] = -10 + (random() * 20)
+        state[1] = -10 + (rng.random() * 20)
 
-        for i in range(timesteps):
-            if state[0] > 0.176:
-                print("WARNING: Robot has rotated so much that the error of the small angle approximation has exceeded 1%.")
-                print("In a real experiment, this would likely result in the robot losing control and crashing.")
-                print("Current state: ", state)
+        state_log = make_recorder('state', timesteps, 4, stream_to)
+        torque_log = make_recorder('torque', timesteps, None, stream_to)
+        profiler = self.profiler
 
-            if verbose:
-                print("State at time step ", i, ":\t", state)
+        with state_log, torque_log:
+            for i in range(timesteps):
+                if state[0] > 0.176:
+                    print("WARNING: Robot has rotated so much that the error of the small angle approximation has exceeded 1%.")
+                    print("In a real experiment, this would likely result in the robot losing control and crashing.")
+                    print("Current state: ", state)
 
-            if(i % 250 == 0):
-                #this conditional occasionally varies angular vel to validate functionality
-                #of torque controller
-                state[1] = -10 + (random() * 20)
+                if verbose:
+                    print("State at time step ", i, ":\t", state)
 
-            if (i==0):
-                state_data = np.array(state)
-            else:
-                state_data = np.vstack([state_data, np.array(state)])
+                if(i % 250 == 0):
+                    #this conditional occasionally varies angular vel to validate functionality
+                    #of torque controller
+                    state[1] = -10 + (rng.random() * 20)
 
-            state, torque_applied = self.updateState_PD_Control(state.copy(), self.dt)
+                new_state, torque_applied = self.updateState_PD_Control(state.copy(), self.dt)
 
+                if profiler is not None:
+                    start = time.perf_counter()
 
-            if (i==0):
-                torques_data = np.array(torque_applied)
-            else:
-                torques_data = np.append(torques_data, torque_applied)
+                state_log.append(state)
+                torque_log.append(torque_applied)
 
-        t = np.linspace(0, self.dt*len(state_data[:,0]), len(state_data[:,0]))
+                if profiler is not None:
+                    profiler.add('logging', time.perf_counter() - start)
 
-        if plots:
-            plt.plot(t, state_data[:,3], label='Velocity [m/s]')
-            plt.plot(t, state_data[:,1], label='Angular Velocity [rad/s]')
-            plt.plot(t, state_data[:,0], label='Angular Position [rad]')
-            plt.grid()
-            plt.legend()
-            #plt.ylim(-10, 10)
-            plt.ylabel("Magnitude")
-            plt.xlabel("time [sec]")
-            plt.title("State Space - PD Controller")
-            plt.show()
+                state = new_state
 
+        state_data = state_log.data()
+        torques_data = torque_log.data()
+
+        if plots:
+            start = time.perf_counter()
+            plot_pd_run(state_data, self.dt)
+            if profiler is not None:
+                profiler.add('plotting', time.perf_counter() - start)
 
         print("Done!")
         return state_data, torques_data
 
 
-    def readSensors(self, theta):
+    def updateState_analytical(self, u, dt):
+        """
+        Steps the nonlinear 12 state model of the robot (see analytical_model.py). The
+        model is compiled with Numba if it is installed, otherwise the NumPy version is
+        used.
+
+        ==== ARGUMENTS ====
+        u  = current state (12 double numpy 1D array: position, velocity, orientation
+             and angular velocity), updated in place
+        dt = time step [seconds]
+
+        ==== RETURNS ====
+        u = the state one time step later
+        """
+        if self.analytical_model is None:
+            from analytical_model import AnalyticalModel
+            self.analytical_model = AnalyticalModel(self)
+
+        return self.analytical_model.step(u, dt)
+
+
+    def run_analytical(self, timesteps, use_jit = None, stream_to = None):
+        """
+        Simulates the nonlinear model with its built in torque controller, which
+        generates torque opposing the robot's angular velocity. Every 250 time steps the
+        robot's altitude is knocked to a random value to check that it recovers.
+
+        ==== ARGUMENTS ====
+        timesteps = number of time steps to simulate. Each one is a half step followed
+                    by a full step, since the torque controller is unstable with plain
+                    dt sized Euler steps
+        use_jit   = see AnalyticalModel, None uses Numba if it is installed
+        stream_to = optional directory to stream the state log to, see run_lqr()
+
+        ==== RETURNS ====
+        state_data = (timesteps+1, 12) state of the robot at each time step
+        """
+        from analytical_model import AnalyticalModel
+
+        rng = Random(0) #this run's own random number generator
+        model = AnalyticalModel(self, use_jit=use_jit)
+        self.analytical_model = model
+        state = model.initial_state()
+
+        state_log = make_recorder('state', timesteps + 1, 12, stream_to)
+        with state_log:
+            state_log.append(state)
+
+            for i in range(timesteps):
+                if i%250 == 0 and i != 0:
+                    state[1] = -1 + (rng.random() * 2)
+
+                model.step(state, self.dt/2)
+                model.step(state, self.dt)
+                state_log.append(state)
+
+        return state_log.data()
+
+
+    def readSensors(self, theta, position = None):
         """
         This function provides a crude estimation for what each of the robot's four
         phototransistors would output given the robot's current state. The thought behind
@@ -498,45 +730,26 @@ class roboBee(object):
             https://royalsocietypublishing.org/doi/full/10.1098/rsif.2014.0281#d3e1883
 
         ==== ARGUMENTS ====
-        theta = current angle of rotation of robot body relative to pointing straight up
+        theta    = current angle of rotation of robot body relative to pointing straight up
+        position = current (x, z) position of the robot, only used by sensor models
+                   with lights at a finite distance (see light_sources.py)
 
         ==== RETURNS ====
-        sensor_readings = array of 4 doubles containing the predicted output of each of the
+        sensor_readings = (4,1) array of doubles containing the predicted output of each of the
                           four phototransistors given the robot's current state
         """
 
 
-        # Normalized vector from robot to light source. Check out the assumptions in the
-        # paper mentioned above for an in-depth explanation as to how it's okay to use
-        # something this simple for this vector
-        light_vec = [0,1,0]
-
-        light_output = 850 #output of light in lumens, typical bulbs give off 600~1200ish lumens
-        init_angle = 30 * np.pi / 180 #angle of normal vector of sensor face relative to horizontal
-                                      # when robot is in starting position (pointing straight up)
-
-        new_sensor_orientations = np.array([ [np.cos(init_angle - theta),       np.sin(init_angle - theta),       0],
-                                         [np.sin(init_angle)*np.sin(theta), np.sin(init_angle)*np.cos(theta), np.cos(init_angle)],
-                                         [-np.cos(init_angle + theta),      np.sin(init_angle + theta),       0],
-                                         [np.sin(init_angle)*np.sin(theta), np.sin(init_angle)*np.cos(theta), -np.cos(init_angle)] ])
-
-
-        sensor_readings = np.array([0.0, 0.0, 0.0, 0.0]).reshape(4,1)
-
-        for i in range(new_sensor_orientations.shape[0]):
-            # calculate the angle between vector normal to this phototransistor's face
-            #and the vector from the robot to the lightsource using definition of dot product
-            angle = np.arccos(np.dot(light_vec, new_sensor_orientations[i]) /
-                                np.linalg.norm(light_vec) * np.linalg.norm(new_sensor_orientations[i]))
-
-            # assume sensor output is proportional to the angle calculated in the step above
-            sensor_readings[i] = light_output * angle
-
+        # The vector from robot to light source is simply [0,1,0] (straight up). Check out
+        # the assumptions in the paper mentioned above for an in-depth explanation as to
+        # how it's okay to use something this simple for this vector. The model itself is
+        # vectorized in SensorModel so whole trajectories can be evaluated at once.
+        sensor_readings = self.sensor_model.readings(theta, position).reshape(4,1)
 
         return sensor_readings
 
 
-    def getAngularVel(self, new_readings, torque_gen):
+    def getAngularVel(self, new_readings, torque_gen, position = None):
         """
         This function reads in the current sensor readings, and uses those alongside
         the sensor readings of the last time step in order to estimate the robot's
@@ -553,30 +766,16 @@ class roboBee(object):
                        the current time step
         torque_gen   = torque generated in the updateState_LQR_Control() function during
                        the current time step
+        position     = current (x, z) position of the robot, needed if the observer is
+                       a KalmanFilter (see kalman_filter.py)
 
         ==== RETURNS ====
         angular_vel_estimates = estimated angular velocities about Y and X axes (in
-                                that order, X axis angular velocity is just about always 0)
+                                that order, X axis angular velocity is just about always 0).
+                                The array is reused by the next call, copy it to keep it
         """
 
-        diffs = new_readings - self.last_sensor_readings
-        self.last_sensor_readings = new_readings
-
-        # Factor to convert from angular position to sensor readings
-        # Original estimate was pi/850, added the 7468.8 to scale from obtained
-        # values to desired values
-        k = np.pi / (850) * 7468.8
-
-        # Matrix to convert change in sensor readings (d[SR]) over time to angular velocity (w)
-        # such that:    w = L*d[SR]
-        L = np.array([ [np.sqrt(3)/k,   0,  -np.sqrt(3)/k,    0,  ],
-                       [0,  -np.sqrt(3)/k,  0,  np.sqrt(3)/k]       ])
-
-        angular_vel_estimates = L.dot(diffs)
-
-        angular_vel_estimates[0,0] += self.dt*torque_gen
-
-        print(angular_vel_estimates)
-
+        # The observer holds the constant L matrix and the last step's readings
+        angular_vel_estimates = self.observer.update(new_readings, torque_gen, position)
 
         return angular_vel_estimates
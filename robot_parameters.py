@@ -0,0 +1,47 @@
+"""
+Description:
+    Immutable set of a robot's parameters.
+
+    The physical constants and LQR weights are class attributes of roboBee, and
+    anything that changes while a robot flies (its lift coefficient, sensor history,
+    models and random numbers) is kept on the instance. A RobotParameters is a
+    read-only snapshot of the parameters, safe to hand to any number of robots,
+    threads or processes at once:
+
+        parameters = RobotParameters.defaults()._replace(MASS=0.09)
+        bee = roboBee(parameters)
+        bee.parameters == parameters    # True until the robot starts flying (its lift changes)
+"""
+
+
+from collections import namedtuple
+
+from plant_cache import CONSTANT_NAMES
+
+PARAMETER_NAMES = CONSTANT_NAMES + ('dt', 'LQR_Q', 'LQR_R')
+
+
+class RobotParameters(namedtuple('RobotParameters', PARAMETER_NAMES)):
+    """
+    g, LIFT_COEFFICIENT, B_w, MASS, Rw, Jz, dt, LQR_Q and LQR_R, see the roboBee
+    class for what each one is. LIFT_COEFFICIENT is the lift the robot starts with.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, bee):
+        """
+        ==== ARGUMENTS ====
+        bee = roboBee instance (or the roboBee class itself, for the defaults)
+
+        ==== RETURNS ====
+        parameters = the robot's current parameters
+        """
+        return cls(*[ getattr(bee, name) for name in PARAMETER_NAMES ])
+
+
+    @classmethod
+    def defaults(cls):
+        # imported here, the simulator imports this module
+        from roboBee_class_PD_and_LQR import roboBee
+        return cls.of(roboBee)
@@ -0,0 +1,227 @@
+"""
+Description:
+    Model of the roboBee's four phototransistors (ocelli), vectorized over time steps
+    and robots.
+
+    roboBee.readSensors() used to loop over the four sensors in Python for a single
+    theta. SensorModel.readings() computes every sensor for any number of thetas in one
+    pass, so sensor traces can be regenerated for recorded trajectories offline, e.g.
+        readings = SensorModel().readings(state_data[:,0])
+    without stepping the simulator.
+
+    See roboBee.readSensors() for the physics and assumptions behind the model.
+"""
+
+
+import math
+import numpy as np
+
+class SensorModel(object):
+
+    def __init__(self, light_vec = (0, 1, 0), light_output = 850, init_angle = 30 * np.pi / 180):
+        """
+        ==== ARGUMENTS ====
+        light_vec    = vector from robot to light source (light is infinitely far away,
+                       so this is the same wherever the robot is)
+        light_output = output of light in lumens, typical bulbs give off 600~1200ish lumens
+        init_angle   = angle of normal vector of sensor face relative to horizontal when
+                       robot is in starting position (pointing straight up)
+        """
+        self.light_vec = np.array(light_vec, dtype=float)
+        self.light_output = light_output
+        self.init_angle = init_angle
+
+        # constant, so only computed once
+        self.light_norm = np.linalg.norm(self.light_vec)
+
+
+    def orientations(self, theta):
+        """
+        ==== ARGUMENTS ====
+        theta = angle(s) of rotation of robot body relative to pointing straight up,
+                scalar or array of any shape, e.g. (T,) or (N,T)
+
+        ==== RETURNS ====
+        orientations = vectors normal to each sensor face, shape theta.shape + (4,3)
+        """
+        return np.stack(self._orientation_components(np.asarray(theta, dtype=float)), axis=-1)
+
+
+    def _orientation_components(self, theta):
+        # x, y and z components of the four sensor normals, each shaped theta.shape + (4,)
+        init_angle = self.init_angle
+        front_x = np.sin(init_angle)*np.sin(theta)
+        front_y = np.sin(init_angle)*np.cos(theta)
+        front_z = np.full_like(theta, np.cos(init_angle))
+        zeros = np.zeros_like(theta)
+
+        x = np.stack([np.cos(init_angle - theta), front_x, -np.cos(init_angle + theta), front_x], axis=-1)
+        y = np.stack([np.sin(init_angle - theta), front_y, np.sin(init_angle + theta), front_y], axis=-1)
+        z = np.stack([zeros, front_z, zeros, -front_z], axis=-1)
+
+        return x, y, z
+
+
+    def readings(self, theta, position = None):
+        """
+        ==== ARGUMENTS ====
+        theta    = angle(s) of rotation of robot body relative to pointing straight up,
+                   scalar or array of any shape, e.g. (T,) for one trajectory or (N,T)
+                   for N trajectories
+        position = robot's (x, altitude) position(s), unused since the light is
+                   infinitely far away (see light_sources.py for lights that aren't)
+
+        ==== RETURNS ====
+        sensor_readings = predicted output of each of the four phototransistors,
+                          shape theta.shape + (4,)
+        """
+        if np.ndim(theta) == 0:
+            return self._readings_scalar(float(theta))
+
+        x, y, z = self._orientation_components(np.asarray(theta, dtype=float))
+        light_x, light_y, light_z = self.light_vec
+
+        # angle between each sensor's normal vector and the vector from the robot to
+        # the light source, using the definition of the dot product
+        dots = x*light_x + y*light_y + z*light_z
+        norms = np.sqrt(x*x + y*y + z*z)
+        angles = np.arccos(dots / (self.light_norm * norms))
+
+        # assume sensor output is proportional to the angle
+        return self.light_output * angles
+
+
+    def _readings_scalar(self, theta):
+        # Same as readings(), written with plain floats since building arrays costs more
+        # than the math when there is only one theta (i.e. every step of run_lqr())
+        init_angle = self.init_angle
+        light_x, light_y, light_z = self.light_vec
+        front_x = math.sin(init_angle)*math.sin(theta)
+        front_y = math.sin(init_angle)*math.cos(theta)
+        front_z = math.cos(init_angle)
+
+        orientations = ( (math.cos(init_angle - theta),  math.sin(init_angle - theta), 0.0),
+                         (front_x,                       front_y,                      front_z),
+                         (-math.cos(init_angle + theta), math.sin(init_angle + theta), 0.0),
+                         (front_x,                       front_y,                      -front_z) )
+
+        sensor_readings = np.empty(4)
+        for i, (x, y, z) in enumerate(orientations):
+            dot = x*light_x + y*light_y + z*light_z
+            norm = math.sqrt(x*x + y*y + z*z)
+            sensor_readings[i] = self.light_output * math.acos(dot / (self.light_norm * norm))
+
+        return sensor_readings
+
+
+class LookupTableSensorModel(SensorModel):
+    """
+    SensorModel that answers readings() from a table precomputed over a range of
+    thetas, by linear or cubic (Hermite) interpolation, instead of evaluating the
+    arccos model every time. Meant for generating large datasets, where the sensor
+    model is evaluated for every time step of every trajectory:
+        bee.sensor_model = LookupTableSensorModel()
+
+    The readings are smooth in theta except for a few kinks, where a sensor's normal
+    lines up with the light vector (or points straight away from it) and arccos'
+    argument reaches +-1. The interpolation error is largest in the table cells
+    holding those, about light_output*spacing/2 there with either method, and much
+    smaller everywhere else. error_bound bounds the error against the exact model over
+    the whole table (from the error measured on a finer grid at construction), and
+    check_accuracy() measures it at any thetas. Thetas outside the table's range are computed with the
+    exact model.
+    """
+
+    def __init__(self, theta_min = -np.pi, theta_max = np.pi, points = 4097, method = 'linear',
+                 light_vec = (0, 1, 0), light_output = 850, init_angle = 30 * np.pi / 180):
+        """
+        ==== ARGUMENTS ====
+        theta_min, theta_max = range of thetas the table covers [rad]
+        points               = number of thetas in the table (evenly spaced)
+        method               = 'linear' or 'cubic' interpolation
+        light_vec, light_output, init_angle = see SensorModel
+        """
+        if method not in ('linear', 'cubic'):
+            raise ValueError("method must be 'linear' or 'cubic', not %r" % (method,))
+        if points < 2 or not theta_max > theta_min:
+            raise ValueError("the table needs at least 2 points and theta_max > theta_min")
+
+        SensorModel.__init__(self, light_vec, light_output, init_angle)
+        self.method = method
+        self.theta_min = float(theta_min)
+        self.theta_max = float(theta_max)
+        self.spacing = (self.theta_max - self.theta_min) / (points - 1)
+        self._last_cell = points - 2
+
+        thetas = np.linspace(self.theta_min, self.theta_max, points)
+        exact = SensorModel.readings
+        self.table = exact(self, thetas)
+
+        # each cell's polynomial in the fraction of the cell covered, (cells, degree + 1, 4)
+        y0, y1 = self.table[:-1], self.table[1:]
+        if method == 'linear':
+            self._coefficients = np.stack([ y0, y1 - y0 ], axis=1)
+        else:
+            # slopes at the table points from the exact model, scaled to one cell
+            step = 1e-6
+            slopes = (exact(self, thetas + step) - exact(self, thetas - step)) * (self.spacing / (2*step))
+            m0, m1 = slopes[:-1], slopes[1:]
+            self._coefficients = np.stack([ y0, m0, 3*(y1 - y0) - 2*m0 - m1, 2*(y0 - y1) + m0 + m1 ], axis=1)
+
+        self._powers = np.arange(self._coefficients.shape[1], dtype=float)
+
+        # largest error on a grid 32 times finer than the table, plus how much the error
+        # can grow between two of its points (the interpolation and the model each
+        # change by at most about one cell's largest step over 1/64 of a cell)
+        largest_step = np.abs(np.diff(self.table, axis=0)).max()
+        self.error_bound = float(self.check_accuracy(np.linspace(self.theta_min, self.theta_max, 32*(points - 1) + 1)) \
+                           + largest_step / 16)
+
+
+    def _interpolate(self, theta):
+        # theta within the table's range, any shape
+        position = (theta - self.theta_min) / self.spacing
+        cell = np.minimum(position.astype(np.intp), self._last_cell)
+        fraction = (position - cell)[..., None]
+        coefficients = self._coefficients.take(cell, axis=0)
+
+        # Horner's rule, highest power first
+        sensor_readings = coefficients[..., -1, :]
+        for power in range(coefficients.shape[-2] - 2, -1, -1):
+            sensor_readings = sensor_readings*fraction + coefficients[..., power, :]
+
+        return sensor_readings
+
+
+    def readings(self, theta, position = None):
+        """
+        Same as SensorModel.readings(), interpolated from the table.
+        """
+        if np.ndim(theta) == 0 and self.theta_min <= theta <= self.theta_max:
+            # plain floats for a single theta, like SensorModel._readings_scalar()
+            position = (float(theta) - self.theta_min) / self.spacing
+            cell = min(int(position), self._last_cell)
+            fraction = position - cell
+            return np.dot(fraction**self._powers, self._coefficients[cell])
+
+        theta = np.asarray(theta, dtype=float)
+        inside = (theta >= self.theta_min) & (theta <= self.theta_max)
+        if inside.all():
+            return self._interpolate(theta)
+
+        # the exact model for whatever falls outside the table
+        sensor_readings = np.empty(theta.shape + (4,))
+        sensor_readings[inside] = self._interpolate(theta[inside])
+        sensor_readings[~inside] = SensorModel.readings(self, theta[~inside])
+        return sensor_readings
+
+
+    def check_accuracy(self, theta):
+        """
+        ==== ARGUMENTS ====
+        theta = thetas to compare the table against the exact model at
+
+        ==== RETURNS ====
+        max_error = largest absolute difference between the two, over all sensors
+        """
+        return float(np.abs(self.readings(theta) - SensorModel.readings(self, theta)).max())
@@ -0,0 +1,107 @@
+"""
+Description:
+    Named, compact layouts for the simulator's states and logs.
+
+    Every state the simulator works with is a run of float64s in one contiguous
+    buffer: the analytical model's 12 state vector, the LQR's (6,1) state, and a row
+    of run_lqr()'s log (the LQR state plus desired x and z). The structured dtypes
+    below name the fields of each without changing the memory, so
+        as_records(array, dtype) = the same memory seen as named fields
+        as_matrix(records)       = named fields back to plain float64 columns
+    are both views (no copies), and the controllers and models keep working on the
+    plain arrays.
+
+        log = as_records(state_data, LQR_LOG_DTYPE)     # state_data from run_lqr()
+        log['theta'].max(), log['x'][-1]
+
+    A FleetHistory holds a whole batch of robots' logs as one contiguous (steps,
+    robots) record array (see run_lqr_fleet()), which can be handed on as a single 2D
+    float64 table (table()) or saved with np.save without copying anything.
+"""
+
+
+import numpy as np
+
+# theta, theta_dot, x, x_dot, z, z_dot (see updateState_LQR_Control())
+LQR_STATE_DTYPE = np.dtype([ ('theta', np.float64), ('theta_dot', np.float64),
+                             ('x', np.float64), ('x_dot', np.float64),
+                             ('z', np.float64), ('z_dot', np.float64) ])
+
+# a row of run_lqr()'s state log: the state plus the desired x and z
+LQR_LOG_DTYPE = np.dtype(LQR_STATE_DTYPE.descr + [ ('x_desired', np.float64), ('z_desired', np.float64) ])
+
+# state vector of the analytical model (see AnalyticalModel.step())
+ANALYTICAL_STATE_DTYPE = np.dtype([ ('position', np.float64, (3,)), ('velocity', np.float64, (3,)),
+                                    ('orientation', np.float64, (3,)), ('angular_velocity', np.float64, (3,)) ])
+
+
+def as_records(array, dtype):
+    """
+    ==== ARGUMENTS ====
+    array = float64 array whose last axis holds the fields of dtype, in order (e.g. a
+            (n, 8) run_lqr() log, or a (6,1) LQR state, whose last two axes are used
+            as one). Must be contiguous along that axis
+    dtype = one of the structured dtypes above
+
+    ==== RETURNS ====
+    records = view of array with one record per row
+    """
+    array = np.asarray(array)
+    width = dtype.itemsize // array.itemsize
+    if array.shape[-1] != width:
+        # e.g. a (6,1) column, whose 6 values are contiguous
+        array = array.reshape(array.shape[:-2] + (width,))
+
+    return array.view(dtype)[..., 0]
+
+
+def as_matrix(records):
+    """
+    ==== ARGUMENTS ====
+    records = array of one of the structured dtypes above
+
+    ==== RETURNS ====
+    matrix = view of records as float64s, with the fields on a new last axis
+    """
+    width = records.dtype.itemsize // np.dtype(np.float64).itemsize
+    return records.reshape(records.shape + (1,)).view(np.float64).reshape(records.shape + (width,))
+
+
+class FleetHistory(object):
+
+    __slots__ = ('records', 'torques', 'lengths')
+
+    def __init__(self, records, torques, lengths):
+        """
+        ==== ARGUMENTS ====
+        records = (steps, robots) LQR_LOG_DTYPE array, every robot's log in one buffer
+        torques = (steps, robots) torque_gen of every robot
+        lengths = (robots,) number of steps each robot ran for; rows past a robot's
+                  length hold its last state
+        """
+        self.records = records
+        self.torques = torques
+        self.lengths = lengths
+
+
+    def __len__(self):
+        return self.records.shape[1]
+
+
+    def robot(self, n):
+        """
+        ==== RETURNS ====
+        state_data, torque_data = views of robot n's log, the same data run_lqr()
+                                  returns for it
+        """
+        length = self.lengths[n]
+        return as_matrix(self.records[:length, n]), self.torques[:length, n]
+
+
+    def table(self):
+        """
+        ==== RETURNS ====
+        table = (steps*robots, 8) float64 view of all the logs, step by step (row
+                step*robots + n is robot n at that step)
+        """
+        return as_matrix(self.records).reshape(-1, LQR_LOG_DTYPE.itemsize // 8)
@@ -0,0 +1,43 @@
+"""
+Description:
+    Checks that run_lqr_batch() gives the same trajectories as calling run_lqr() once
+    per robot (see batch_simulator.py). Run with
+        python -m pytest test_batch_simulator.py
+"""
+
+
+import numpy as np
+import pytest
+
+from roboBee_class_PD_and_LQR import roboBee
+from robot_parameters import RobotParameters
+from batch_simulator import run_lqr_batch
+from kalman_filter import BatchKalmanFilter
+
+
+STATES_DESIRED = np.array([ [0, 0, 1.0, 0, 1.0, 0],
+                            [0, 0, -1.0, 0, 2.0, 0] ])
+INITIAL_STATES = np.array([ [0.05, 0, 0, 0, 0, 0],
+                            [0, 0, 0.5, 0, 0.5, 0] ])
+
+
+@pytest.mark.parametrize('dt', [ 1/120, 1/240 ])
+def test_batch_matches_serial(dt):
+    parameters = RobotParameters.defaults()._replace(dt=dt)
+    timesteps = 2000
+
+    batch = run_lqr_batch(timesteps, STATES_DESIRED, INITIAL_STATES, bee=roboBee(parameters))
+
+    for (batch_states, batch_torques), state_desired, initial_state in zip(batch, STATES_DESIRED, INITIAL_STATES):
+        serial_states, serial_torques = roboBee(parameters).run_lqr(timesteps, plots=False, quiet=True,
+                                                                    state_desired=state_desired,
+                                                                    initial_state=initial_state)
+        assert batch_states.shape == serial_states.shape
+        np.testing.assert_allclose(batch_states, serial_states, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(batch_torques, serial_torques, rtol=1e-9, atol=1e-9)
+
+
+def test_estimator_rejects_per_robot_constants():
+    estimator = BatchKalmanFilter(roboBee(), len(STATES_DESIRED))
+    with pytest.raises(ValueError):
+        run_lqr_batch(10, STATES_DESIRED, INITIAL_STATES, constants={ 'MASS': [0.08, 0.09] }, estimator=estimator)
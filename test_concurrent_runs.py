@@ -0,0 +1,34 @@
+"""
+Description:
+    Checks that the thread pool runners give exactly the same results as running the
+    same simulations one after the other (see concurrent_runs.py). Run with
+        python -m pytest test_concurrent_runs.py
+"""
+
+
+import numpy as np
+
+from batch_simulator import run_lqr_batch
+from concurrent_runs import matches_serial, run_lqr_batch_threaded
+
+
+STATES_DESIRED = np.array([ [0, 0, x, 0, z, 0] for x in (-1.0, 1.0) for z in (0.5, 1.0, 1.5, 2.0) ])
+
+
+def test_threaded_runs_match_serial():
+    runs = [ { 'timesteps': 1500, 'state_desired': state_desired, 'quiet': True } for state_desired in STATES_DESIRED ]
+
+    assert matches_serial(runs, max_workers=8)
+
+
+def test_threaded_batch_matches_batch():
+    initial_states = np.zeros((len(STATES_DESIRED), 6))
+    initial_states[:,0] = np.linspace(-0.1, 0.1, len(STATES_DESIRED))
+
+    threaded = run_lqr_batch_threaded(1500, STATES_DESIRED, initial_states, chunk_size=3, max_workers=3)
+    serial = run_lqr_batch(1500, STATES_DESIRED, initial_states)
+
+    assert len(threaded) == len(serial)
+    for (threaded_states, threaded_torques), (serial_states, serial_torques) in zip(threaded, serial):
+        np.testing.assert_array_equal(threaded_states, serial_states)
+        np.testing.assert_array_equal(threaded_torques, serial_torques)
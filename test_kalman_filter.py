@@ -0,0 +1,93 @@
+"""
+Description:
+    Checks the Kalman filter estimators (see kalman_filter.py). Run with
+        python -m pytest test_kalman_filter.py
+"""
+
+
+import numpy as np
+import pytest
+
+from roboBee_class_PD_and_LQR import roboBee
+from kalman_filter import KalmanFilter, BatchKalmanFilter
+from light_sources import LightingModel, PointLight
+
+
+def _run_with_filter(bee, kalman_filter, timesteps, **kwargs):
+    # flies the robot with the filter as its observer, and returns the trajectory with
+    # the theta_dot estimate and smallest covariance eigenvalue after every update
+    estimates = []
+    smallest_eigenvalues = []
+
+    def log_hook(angular_vel_estimates):
+        estimates.append(angular_vel_estimates[0,0])
+        smallest_eigenvalues.append(np.linalg.eigvalsh(kalman_filter.covariances).min())
+
+    kalman_filter.log_hook = log_hook
+    bee.observer = kalman_filter
+    state_data, torque_data = bee.run_lqr(timesteps, plots=False, quiet=True, **kwargs)
+
+    # the filter updates from the second time step on
+    return state_data, np.array(estimates), np.array(smallest_eigenvalues)
+
+
+def test_tracks_theta_dot():
+    bee = roboBee()
+    state_data, estimates, smallest_eigenvalues = _run_with_filter(bee, KalmanFilter(bee), 3000,
+                                                                   initial_state=[0.1, 0.5, 0, 0, 0, 0])
+
+    assert np.max(np.abs(estimates - state_data[1:,1])) < 1e-6
+
+
+def test_reset_starts_from_state():
+    bee = roboBee()
+    kalman_filter = KalmanFilter(bee)
+    # an estimate left over from an earlier run
+    kalman_filter.reset([0.3, -2.0, 1.0, 0.1, 0, 0])
+
+    initial_state = np.array([0.1, 0.5, 0.2, 0.0, 0.0, 0.0])
+    kalman_filter.reset(initial_state)
+    np.testing.assert_array_equal(kalman_filter.estimate, initial_state[:4])
+
+    # run_lqr() resets the filter to the run's initial state itself
+    kalman_filter.reset([0.3, -2.0, 1.0, 0.1, 0, 0])
+    state_data, estimates, smallest_eigenvalues = _run_with_filter(bee, kalman_filter, 10,
+                                                                   initial_state=initial_state)
+    assert np.max(np.abs(estimates - state_data[1:,1])) < 1e-5
+
+
+@pytest.mark.parametrize('extended', [ False, True ])
+def test_batch_matches_single_filters(extended):
+    bees = [ roboBee() for n in range(3) ]
+    single = [ KalmanFilter(bee, extended=extended) for bee in bees ]
+    batch = BatchKalmanFilter(bees[0], len(bees), extended=extended)
+
+    states = np.array([ [0.1, 0.5, 0.0, 0.0, 1.0, 0.0],
+                        [-0.05, 0.0, 0.3, 0.1, 0.5, 0.0],
+                        [0.0, -0.2, -0.1, 0.0, 2.0, 0.0] ])
+    batch.reset(states)
+    for kalman_filter, state in zip(single, states):
+        kalman_filter.reset(state)
+
+    rng = np.random.default_rng(0)
+    for i in range(50):
+        thetas = states[:,0] + rng.normal(0.0, 0.05, len(bees))
+        positions = states[:,2::2] + rng.normal(0.0, 0.01, (len(bees), 2))
+        readings = bees[0].sensor_model.readings(thetas, positions)
+        torque_gen = rng.normal(0.0, 1.0, len(bees))
+        lifts = 1.0 + rng.normal(0.0, 0.1, len(bees))
+
+        batch_estimates = batch.update(readings, torque_gen, positions, lifts)
+        for n, (bee, kalman_filter) in enumerate(zip(bees, single)):
+            bee.LIFT_COEFFICIENT = lifts[n]
+            kalman_filter.update(readings[n].reshape(4,1), torque_gen[n], positions[n])
+            np.testing.assert_allclose(batch_estimates[n], kalman_filter.estimate, rtol=1e-7, atol=1e-9)
+
+
+def test_extended_filter_with_lights():
+    bee = roboBee()
+    bee.sensor_model = LightingModel([ PointLight((0.0, 3.0, 0.0)) ])
+    state_data, estimates, smallest_eigenvalues = _run_with_filter(bee, KalmanFilter(bee, extended=True), 4000)
+
+    assert np.all(smallest_eigenvalues > 0)
+    assert np.max(np.abs(estimates - state_data[1:,1])) < 1e-3
@@ -0,0 +1,41 @@
+"""
+Description:
+    Checks NonlinearPlant (see nonlinear_plant.py): its lift, and that its compiled
+    substep kernel matches the NumPy reference. Run with
+        python -m pytest test_nonlinear_plant.py
+"""
+
+
+import numpy as np
+import pytest
+
+from roboBee_class_PD_and_LQR import roboBee
+from nonlinear_plant import NonlinearPlant
+
+
+def test_lift_is_physical():
+    # upright and at rest, the vertical acceleration is g*(lift_coefficient - 1) (and
+    # a tiny bit of drag)
+    bee = roboBee()
+    plant = NonlinearPlant(bee, 'rk4')
+    plant.advance(1e-3, 0.0, 1.5)
+
+    np.testing.assert_allclose(plant.lqr_state()[5,0], 1e-3*bee.g*0.5, rtol=1e-5)
+
+
+@pytest.mark.parametrize('integrator', [ 'euler', 'rk4' ])
+def test_kernel_matches_numpy(integrator):
+    pytest.importorskip('numba')
+    bee = roboBee()
+    plants = [ NonlinearPlant(bee, integrator, substeps=10, use_jit=use_jit) for use_jit in (False, True) ]
+    sample_times = np.linspace(0.0, bee.dt, 9)[1:]
+
+    for plant in plants:
+        plant.set_lqr_state([0.1, 0.5, 0.0, 0.2, 1.0, 0.0])
+
+    for i in range(200):
+        torque = 1e-9*np.sin(0.1*i)
+        reference, compiled = [ plant.advance(bee.dt, torque, 1.02, sample_times) for plant in plants ]
+        np.testing.assert_allclose(compiled, reference, rtol=1e-12, atol=1e-12)
+
+    np.testing.assert_allclose(plants[1].state, plants[0].state, rtol=1e-12, atol=1e-12)
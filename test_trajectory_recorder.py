@@ -0,0 +1,41 @@
+"""
+Description:
+    Checks that streamed logs (see trajectory_recorder.py) stay readable. Run with
+        python -m pytest test_trajectory_recorder.py
+"""
+
+
+import numpy as np
+import pytest
+
+from roboBee_class_PD_and_LQR import roboBee
+from trajectory_recorder import load_trajectory
+
+
+def test_streamed_run_matches_memory(tmp_path):
+    state_data, torque_data = roboBee().run_lqr(3000, plots=False, quiet=True, stream_to=str(tmp_path))
+    expected_states, expected_torques = roboBee().run_lqr(3000, plots=False, quiet=True)
+
+    np.testing.assert_array_equal(state_data, expected_states)
+    np.testing.assert_array_equal(torque_data, expected_torques)
+
+
+def test_failed_run_closes_streamed_logs(tmp_path):
+    bee = roboBee()
+    update = bee.updateState_LQR_Control
+    steps = []
+
+    def failing_update(*args):
+        steps.append(None)
+        if len(steps) == 100:
+            raise RuntimeError("simulated failure")
+        return update(*args)
+
+    bee.updateState_LQR_Control = failing_update
+    with pytest.raises(RuntimeError):
+        bee.run_lqr(1000, plots=False, quiet=True, stream_to=str(tmp_path))
+
+    # every log has a valid header for the rows written before the failure
+    logs = load_trajectory(str(tmp_path))
+    assert sorted(logs) == [ 'sensor', 'state', 'torque' ]
+    assert all(len(log) == 99 for log in logs.values())
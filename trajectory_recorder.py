@@ -0,0 +1,260 @@
+"""
+Description:
+    Preallocated storage for the data the roboBee simulator logs at every time step.
+
+    The run_lqr() and run_pd() methods used to grow their logs with np.hstack,
+    np.vstack and np.append, which copies the whole log on every step (so a run
+    costs O(n^2) in copies). A TrajectoryRecorder allocates its buffer once, writes
+    each row in place, and only reallocates (doubling its capacity) if more rows
+    are logged than it was sized for.
+
+    For very long runs a StreamingTrajectoryRecorder can be used instead. It has the
+    same interface, but writes rows to an .npy file on disk a block at a time, so
+    memory use stays flat no matter how long the run is. The file can be read back
+    without loading it into memory with np.load(path, mmap_mode='r') (or
+    load_trajectory() for a whole run).
+
+    Both are context managers. The simulators log inside a with block, so a run that
+    fails part way still closes its streamed files, with a valid header for the rows
+    written so far.
+"""
+
+
+import os
+import struct
+import numpy as np
+
+class TrajectoryRecorder(object):
+
+    def __init__(self, capacity, width = None, dtype = float):
+        """
+        ==== ARGUMENTS ====
+        capacity = number of rows to allocate up front, usually the number of time
+                   steps the simulation will run for (the buffer doubles in size if
+                   this is exceeded)
+        width    = number of values logged per time step (or a tuple giving the shape
+                   of each row, e.g. (n_bees, 8) for a batch of robots). If None, a
+                   single value is logged per time step and the recorded data is a
+                   1D array
+        dtype    = data type of the recorded values
+        """
+        self.width = width
+        self.length = 0
+
+        self._buffer = np.empty(self._shape(max(int(capacity), 1)), dtype=dtype)
+
+
+    def _shape(self, rows):
+        if self.width is None:
+            return (rows,)
+        return (rows,) + tuple(np.atleast_1d(self.width))
+
+
+    def _grow(self):
+        # double the capacity so appending n rows only costs O(n) copies in total
+        new_buffer = np.empty(self._shape(2 * self._buffer.shape[0]), dtype=self._buffer.dtype)
+        new_buffer[:self.length] = self._buffer[:self.length]
+        self._buffer = new_buffer
+
+
+    def __len__(self):
+        return self.length
+
+
+    def next_row(self):
+        """
+        Reserves the next row of the buffer and returns a writable view of it, so
+        callers can fill a row piece by piece without building a temporary array.
+        Only valid when the recorder was created with a width.
+        """
+        if self.length == self._buffer.shape[0]:
+            self._grow()
+
+        row = self._buffer[self.length]
+        self.length += 1
+
+        return row
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        """
+        Nothing to close for a recorder in memory, see StreamingTrajectoryRecorder.
+        """
+        pass
+
+
+    def append(self, values):
+        """
+        Writes one time step's worth of values into the next row of the buffer.
+
+        ==== ARGUMENTS ====
+        values = scalar (if width is None) or array-like with 'width' values
+        """
+        if self.length == self._buffer.shape[0]:
+            self._grow()
+
+        self._buffer[self.length] = values
+        self.length += 1
+
+
+    def data(self):
+        """
+        ==== RETURNS ====
+        recorded = the rows logged so far. If the run ended before the buffer was
+                   filled (e.g. the desired state was reached early) the unused rows
+                   are trimmed off and a compact copy is returned, so the oversized
+                   buffer isn't kept alive by the caller
+        """
+        if self.length == self._buffer.shape[0]:
+            return self._buffer
+
+        return self._buffer[:self.length].copy()
+
+
+class StreamingTrajectoryRecorder(object):
+
+    def __init__(self, path, width = None, dtype = float, block_rows = 4096):
+        """
+        ==== ARGUMENTS ====
+        path       = .npy file the rows are written to (overwritten if it exists)
+        width      = number of values logged per time step (or the shape of each row),
+                     None for a single value per time step
+        dtype      = data type of the recorded values
+        block_rows = number of rows buffered in memory before they are written out
+        """
+        self.path = path
+        self.width = width
+        self.length = 0
+
+        self._dtype = np.dtype(dtype)
+        self._row_shape = () if width is None else tuple(int(n) for n in np.atleast_1d(width))
+        self._block = np.empty((block_rows,) + self._row_shape, dtype=self._dtype)
+        self._block_length = 0
+
+        # The number of rows isn't known until the run ends, so the header is written
+        # with room for the largest possible shape and rewritten when the file is closed
+        largest_header = self._header_text((2**63 - 1,) + self._row_shape)
+        self._header_length = 64 * ((len(largest_header) + 10 + 1 + 63) // 64) - 10
+
+        self._file = open(path, 'wb')
+        self._write_header()
+
+
+    def _header_text(self, shape):
+        return "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+                    np.lib.format.dtype_to_descr(self._dtype), shape)
+
+
+    def _write_header(self):
+        # .npy version 1.0 header, padded with spaces to a fixed length
+        header = self._header_text((self.length,) + self._row_shape)
+        header = header.ljust(self._header_length - 1) + '\n'
+        self._file.write(np.lib.format.magic(1, 0))
+        self._file.write(struct.pack('<H', self._header_length))
+        self._file.write(header.encode('latin1'))
+
+
+    def _flush_block(self):
+        self._file.write(self._block[:self._block_length].data)
+        self._block_length = 0
+
+
+    def __len__(self):
+        return self.length
+
+
+    def next_row(self):
+        """
+        Reserves the next row and returns a writable view of it (see
+        TrajectoryRecorder.next_row()). The row is written to disk later, so it must
+        be filled in before the next row is reserved.
+        """
+        if self._block_length == self._block.shape[0]:
+            self._flush_block()
+
+        row = self._block[self._block_length]
+        self._block_length += 1
+        self.length += 1
+
+        return row
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def append(self, values):
+        """
+        Writes one time step's worth of values (see TrajectoryRecorder.append()).
+        """
+        if self._block_length == self._block.shape[0]:
+            self._flush_block()
+
+        self._block[self._block_length] = values
+        self._block_length += 1
+        self.length += 1
+
+
+    def close(self):
+        """
+        Writes out any buffered rows and fixes up the file's header with the final
+        number of rows. Nothing can be appended after this.
+        """
+        if self._file.closed:
+            return
+
+        self._flush_block()
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+
+
+    def data(self):
+        """
+        ==== RETURNS ====
+        recorded = read-only memory map of the recorded rows (the file is closed
+                   first if it is still open)
+        """
+        self.close()
+
+        return np.load(self.path, mmap_mode='r')
+
+
+def make_recorder(name, capacity, width = None, stream_to = None):
+    """
+    Creates the recorder for one of a run's logs: in memory by default, or streamed
+    to stream_to/<name>.npy if a directory is given.
+    """
+    if stream_to is None:
+        return TrajectoryRecorder(capacity, width)
+
+    os.makedirs(stream_to, exist_ok=True)
+    return StreamingTrajectoryRecorder(os.path.join(stream_to, name + ".npy"), width)
+
+
+def load_trajectory(run_dir):
+    """
+    Opens every .npy log a streamed run wrote to run_dir as a read-only memory map,
+    so slices of a run can be used (e.g. for training) without loading all of it.
+
+    ==== RETURNS ====
+    logs = dictionary from log name (e.g. 'state', 'torque') to memory mapped array
+    """
+    logs = {}
+    for file_name in sorted(os.listdir(run_dir)):
+        if file_name.endswith(".npy"):
+            logs[file_name[:-len(".npy")]] = np.load(os.path.join(run_dir, file_name), mmap_mode='r')
+
+    return logs